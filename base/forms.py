@@ -18,8 +18,7 @@ from social.apps.django_app.default.models import UserSocialAuth
 from utils.funcs import verify_username, form_add_error
 from utils.variables import ANONYMOUS_USERNAME, MESSAGES
 from base.models import UserProfile, ProfileRequest, create_user_profile
-from threads.models import Thread, Message
-from managers.models import Request, Response
+from managers.utils import rebuild_request_counters
 
 class ProfileRequestForm(forms.ModelForm):
     ''' Form to create a new profile request. '''
@@ -250,16 +249,8 @@ class DeleteUserForm(forms.Form):
 
     def save(self):
         self.user.delete()
-        for req in Request.objects.all():
-            recount = Response.objects.filter(request=req).count()
-            if req.number_of_responses != recount:
-                req.number_of_responses = recount
-                req.save()
-        for thread in Thread.objects.all():
-            recount = Message.objects.filter(thread=thread).count()
-            if thread.number_of_messages != recount:
-                thread.number_of_messages = recount
-                thread.save()
+        # Deleting the user's responses doesn't update the requests' counts
+        rebuild_request_counters()
 
 class UpdateUserForm(forms.ModelForm):
     class Meta:
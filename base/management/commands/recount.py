@@ -0,0 +1,27 @@
+"""
+Project: Farnsworth
+
+Authors: Karandeep Singh Nagra and Nader Morshed
+"""
+
+from django.core.management.base import BaseCommand
+
+from managers.utils import rebuild_request_counters
+from threads.utils import rebuild_thread_counters
+
+
+class Command(BaseCommand):
+    help = "Recounts the responses to requests and the messages in threads."
+
+    def handle(self, *args, **options):
+        requests_changed = rebuild_request_counters()
+        threads_changed, dates_changed = rebuild_thread_counters()
+
+        self.stdout.write(
+            "Updated {0} request{1}, {2} thread{3} and {4} change date{5}."
+            .format(
+                requests_changed, "" if requests_changed == 1 else "s",
+                threads_changed, "" if threads_changed == 1 else "s",
+                dates_changed, "" if dates_changed == 1 else "s",
+            )
+        )
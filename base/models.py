@@ -11,8 +11,11 @@ from django.db import models
 
 from phonenumber_field.modelfields import PhoneNumberField
 
+from notifications.models import Notification
 from social.utils import setting_name
 
+from utils.navbar import invalidate_navbar_state
+
 UID_LENGTH = getattr(settings, setting_name('UID_LENGTH'), 255)
 
 def _get_user_view_url(user):
@@ -179,3 +182,9 @@ def create_user_profile(sender, instance, created, **kwargs):
 # Connect signals with their respective functions from above.
 # When a user is created, create a user profile associated with that user.
 models.signals.post_save.connect(create_user_profile, sender=User)
+# Profile requests are counted in the navbar
+models.signals.post_save.connect(invalidate_navbar_state, sender=ProfileRequest)
+models.signals.post_delete.connect(invalidate_navbar_state, sender=ProfileRequest)
+# As are unread notifications
+models.signals.post_save.connect(invalidate_navbar_state, sender=Notification)
+models.signals.post_delete.connect(invalidate_navbar_state, sender=Notification)
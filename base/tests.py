@@ -5,20 +5,27 @@ Authors: Karandeep Singh Nagra and Nader Morshed
 """
 
 from datetime import date, timedelta
+import json
 
 from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth.models import User
 from django.core.management import call_command
 from django.core.urlresolvers import reverse
+from django.db import connection
 from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
 from django.utils.timezone import now
 
 from notifications import notify
 import haystack
 from haystack.query import SearchQuerySet
 
+from utils.navbar import invalidate_navbar_state
 from utils.variables import MESSAGES
 from base.models import UserProfile, ProfileRequest
+from base.views import add_context, get_updates_view
 from threads.models import Thread, Message
 from managers.models import Manager, Announcement, RequestType, Request, Response
 from events.models import Event
@@ -153,6 +160,56 @@ class TestHomepage(TestCase):
         self.assertContains(response, self.ev.title)
         self.assertContains(response, "{0} Requests".format(self.rt.name))
 
+    def _count_homepage_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("homepage"))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_homepage_queries(self):
+        Response.objects.create(
+            owner=self.profile,
+            body="Response",
+            request=self.req,
+        )
+        self.req.upvotes = [self.profile]
+        self.ev.rsvps = [self.profile]
+        thread = Thread.objects.create(owner=self.profile, subject="Subject")
+        Message.objects.create(owner=self.profile, body="Body", thread=thread)
+        num_queries = self._count_homepage_queries()
+
+        other = User.objects.create_user(username="o", password="pwd")
+        other_profile = UserProfile.objects.get(user=other)
+        start = now().replace(second=0, microsecond=0)
+        for i in range(5):
+            req = Request.objects.create(
+                owner=other_profile,
+                request_type=self.rt,
+            )
+            req.upvotes = [self.profile, other_profile]
+            Response.objects.create(
+                owner=other_profile,
+                body="Response",
+                request=req,
+            )
+            event = Event.objects.create(
+                owner=other_profile,
+                title="Event {0}".format(i),
+                start_time=start,
+                end_time=start + timedelta(days=1),
+            )
+            event.rsvps = [self.profile, other_profile]
+            thread = Thread.objects.create(owner=other_profile, subject="Subject")
+            Message.objects.create(owner=other_profile, body="Body", thread=thread)
+            Message.objects.create(owner=self.profile, body="Reply", thread=thread)
+            Announcement.objects.create(
+                manager=self.manager,
+                incumbent=self.profile,
+                body="Announcement {0}".format(i),
+            )
+
+        self.assertEqual(num_queries, self._count_homepage_queries())
+
     def test_homepage_no_requests(self):
         self.req.delete()
         response = self.client.get(reverse("homepage"))
@@ -1247,3 +1304,140 @@ class TestNotifications(TestCase):
             )
 
         self.assertEqual(0, self.u.notifications.unread().count())
+
+class TestNavbarState(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.u = User.objects.create_user(username="u", password="pwd")
+        self.ou = User.objects.create_user(username="ou", password="pwd")
+        self.rt = RequestType.objects.create(name="Food")
+        self.factory = RequestFactory()
+
+    def _get_context(self):
+        request = self.factory.get("/")
+        request.user = self.u
+        request.session = {}
+        return add_context(request)
+
+    def test_cached(self):
+        context = self._get_context()
+        self.assertEqual([(self.rt, 0)], context["REQUEST_TYPES"])
+
+        with self.assertNumQueries(0):
+            context = self._get_context()
+        self.assertEqual([(self.rt, 0)], context["REQUEST_TYPES"])
+        self.assertEqual(False, context["PRESIDENT"])
+
+    def test_invalidated(self):
+        self._get_context()
+
+        Request.objects.create(
+            owner=UserProfile.objects.get(user=self.ou),
+            body="Request",
+            request_type=self.rt,
+        )
+        Request.objects.create(
+            owner=UserProfile.objects.get(user=self.ou),
+            body="Private request",
+            request_type=self.rt,
+            private=True,
+        )
+        context = self._get_context()
+        self.assertEqual([(self.rt, 1)], context["REQUEST_TYPES"])
+
+        ProfileRequest.objects.create(
+            username="pr",
+            email="pr@email.com",
+            affiliation=UserProfile.RESIDENT,
+        )
+        context = self._get_context()
+        self.assertEqual(1, context["NUM_OF_PROFILE_REQUESTS"])
+
+    def _get_updates(self, **kwargs):
+        request = self.factory.get(
+            reverse("get_updates"), HTTP_X_REQUESTED_WITH="XMLHttpRequest",
+            **kwargs
+        )
+        request.user = self.u
+        request.session = {}
+        return get_updates_view(request)
+
+    def test_updates(self):
+        Request.objects.create(
+            owner=UserProfile.objects.get(user=self.ou),
+            body="Request",
+            request_type=self.rt,
+        )
+        notify.send(self.ou, verb="tested", recipient=self.u)
+
+        response = self._get_updates()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {"notifications": 1, "requests": {self.rt.url_name: 1}},
+            json.loads(response.content),
+        )
+
+        etag = response["ETag"]
+        with self.assertNumQueries(0):
+            response = self._get_updates(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.u.notifications.mark_all_as_read()
+        invalidate_navbar_state()
+        response = self._get_updates(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(etag, response["ETag"])
+        self.assertEqual(0, json.loads(response.content)["notifications"])
+
+    def test_updates_batched(self):
+        profiles = [
+            UserProfile.objects.get(user=self.u),
+            UserProfile.objects.get(user=self.ou),
+        ]
+        requests = [
+            Request.objects.create(
+                owner=profiles[1],
+                body="Request {0}".format(i),
+                request_type=self.rt,
+            )
+            for i in range(10)
+        ]
+        events = [
+            Event.objects.create(
+                owner=profiles[1],
+                title="Event {0}".format(i),
+                location="Location",
+                description="Description",
+                start_time=now(),
+                end_time=now() + timedelta(hours=2),
+            )
+            for i in range(5)
+        ]
+        for req in requests:
+            req.upvotes = profiles
+        for event in events:
+            event.rsvps = profiles[1:]
+
+        with self.assertNumQueries(10):
+            response = self._get_updates(data={
+                "request_pk_list": ",".join(str(i.pk) for i in requests),
+                "event_pk_list": ",".join(str(i.pk) for i in events),
+            })
+        content = json.loads(response.content)
+
+        self.assertEqual(10, len(content["votes"]))
+        votes = content["votes"][str(requests[0].pk)]
+        self.assertEqual(2, votes["count"])
+        self.assertEqual(True, votes["voted"])
+        self.assertEqual(
+            ["You", self.ou.get_full_name()],
+            [i["name"] for i in votes["voters"]],
+        )
+
+        self.assertEqual(5, len(content["rsvps"]))
+        rsvps = content["rsvps"][str(events[0].pk)]
+        self.assertEqual(False, rsvps["rsvped"])
+        self.assertEqual(
+            [reverse("member_profile", kwargs={"targetUsername": "ou"})],
+            [i["url"] for i in rsvps["rsvps"]],
+        )
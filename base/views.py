@@ -7,9 +7,11 @@ Authors: Karandeep Singh Nagra and Nader Morshed
 Views for base application.
 """
 
+from collections import defaultdict
 from datetime import timedelta
 from importlib import import_module
 from smtplib import SMTPException
+import hashlib
 import json
 
 from django.conf import settings
@@ -21,16 +23,20 @@ from django.contrib.auth.models import User
 from django.contrib.auth.views import password_reset, password_reset_confirm
 from django.core.urlresolvers import reverse
 from django.core.mail import send_mail
-from django.db.models import Q
-from django.http import HttpResponseRedirect, HttpResponse, Http404
+from django.db.models import Count, Prefetch, Q
+from django.http import HttpResponseRedirect, HttpResponse, Http404, \
+    HttpResponseNotModified
 from django.shortcuts import render_to_response, render, get_object_or_404
 from django.template import RequestContext
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
 from django.utils.timezone import now
 
 import inflect
 p = inflect.engine()
 
 from utils.funcs import form_add_error
+from utils.navbar import get_navbar_state, invalidate_navbar_state
 from utils.variables import ANONYMOUS_USERNAME, MESSAGES, APPROVAL_SUBJECT, \
     APPROVAL_EMAIL, DELETION_SUBJECT, DELETION_EMAIL, SUBMISSION_SUBJECT, \
     SUBMISSION_EMAIL
@@ -43,59 +49,90 @@ from base.forms import ProfileRequestForm, AddUserForm, \
     UpdateEmailForm, UpdateProfileForm, DeleteUserForm
 from threads.models import Thread, Message
 from threads.forms import ThreadForm
+from threads.utils import rebuild_thread_counters
 from managers.models import RequestType, Manager, Request, Response, Announcement
 from managers.forms import AnnouncementForm, ManagerResponseForm, VoteForm, PinForm
-from managers.ajax import build_ajax_votes
+from managers.ajax import get_ajax_votes
+from managers.utils import rebuild_request_counters
 from events.models import Event
 from events.forms import RsvpForm
-from events.ajax import build_ajax_rsvps
+from events.ajax import get_ajax_rsvps
 from rooms.models import Room, PreviousResident
 
-def add_context(request):
-    """ Add variables to all dictionaries passed to templates. """
-    # Whether the user has president privileges
-    try:
-        PRESIDENT = Manager.objects.filter(
-            incumbent__user=request.user,
+def get_open_request_counts(user):
+    """
+    Counts the open requests of each enabled request type that a user can
+    see, hiding other members' private requests from anyone who doesn't
+    manage that type of request.
+
+    Returns
+    -------
+    list of (managers.models.RequestType, int)
+    """
+    request_types = list(RequestType.objects.filter(enabled=True))
+    managed = RequestType.managers.through.objects.filter(
+        manager__incumbent__user=user,
+    ).values_list("requesttype", flat=True)
+
+    counts = dict(
+        Request.objects.filter(
+            Q(request_type__in=managed) | Q(private=False) |
+            Q(owner__user=user),
+            request_type__in=request_types,
+            status=Request.OPEN,
+        ).order_by().values_list("request_type").annotate(Count("pk"))
+    )
+
+    return [
+        (request_type, counts.get(request_type.pk, 0))
+        for request_type in request_types
+    ]
+
+
+def _get_navbar_state(user):
+    if not user.is_authenticated():
+        return {
+            "PRESIDENT": False,
+            "REQUEST_TYPES": [],
+            "NUM_OF_PROFILE_REQUESTS": ProfileRequest.objects.count(),
+        }
+
+    return {
+        # Whether the user has president privileges
+        "PRESIDENT": Manager.objects.filter(
+            incumbent__user=user,
             president=True,
-        ).count() > 0
-    except TypeError:
-        PRESIDENT = False
+        ).exists(),
+        # A list with items of form (RequestType, number_of_open_requests)
+        "REQUEST_TYPES": get_open_request_counts(user),
+        "NUM_OF_PROFILE_REQUESTS": ProfileRequest.objects.count(),
+    }
 
+
+def add_context(request):
+    """ Add variables to all dictionaries passed to templates. """
     # If the user is logged in as an anymous user
     if request.user.username == ANONYMOUS_USERNAME:
         request.session["ANONYMOUS_SESSION"] = True
 
     ANONYMOUS_SESSION = request.session.get("ANONYMOUS_SESSION", False)
 
-    # A list with items of form (RequestType, number_of_open_requests)
-    request_types = list()
-    if request.user.is_authenticated():
-        for request_type in RequestType.objects.filter(enabled=True):
-            requests = Request.objects.filter(
-                request_type=request_type,
-                status=Request.OPEN,
-            )
-            if not request_type.managers.filter(incumbent__user=request.user):
-                requests = requests.exclude(
-                    ~Q(owner__user=request.user),
-                    private=True,
-                )
-            request_types.append((request_type, requests.count()))
-
-    profile_requests_count = ProfileRequest.objects.all().count()
-    admin_unread_count = profile_requests_count
+    state = get_navbar_state(
+        request, "base",
+        [request.user.pk, getattr(request.user, "date_joined", None)],
+        lambda: _get_navbar_state(request.user),
+    )
 
     return {
-        "REQUEST_TYPES": request_types,
+        "REQUEST_TYPES": state["REQUEST_TYPES"],
         "HOUSE": settings.HOUSE_NAME,
         "ANONYMOUS_USERNAME": ANONYMOUS_USERNAME,
         "SHORT_HOUSE": settings.SHORT_HOUSE_NAME,
         "ADMIN": settings.ADMINS[0],
-        "NUM_OF_PROFILE_REQUESTS": profile_requests_count,
-        "ADMIN_UNREAD_COUNT": admin_unread_count,
+        "NUM_OF_PROFILE_REQUESTS": state["NUM_OF_PROFILE_REQUESTS"],
+        "ADMIN_UNREAD_COUNT": state["NUM_OF_PROFILE_REQUESTS"],
         "ANONYMOUS_SESSION": ANONYMOUS_SESSION,
-        "PRESIDENT": PRESIDENT,
+        "PRESIDENT": state["PRESIDENT"],
     }
 
 def landing_view(request):
@@ -133,29 +170,36 @@ def landing_view(request):
 def homepage_view(request, message=None):
     ''' The view of the homepage. '''
     userProfile = UserProfile.objects.get(user=request.user)
-    request_types = RequestType.objects.filter(enabled=True)
     # List of request types for which the user is a relevant manager
-    manager_request_types = list()
-    for request_type in request_types:
-        for position in request_type.managers.filter(active=True):
-            if userProfile == position.incumbent:
-                manager_request_types.append(request_type)
-                break
+    manager_request_types = list(RequestType.objects.filter(
+        enabled=True,
+        managers__incumbent=userProfile,
+        managers__active=True,
+    ).distinct())
     # Pseudo-dictionary, list with items of form (request_type, (request,
     # [list_of_request_responses], response_form))
     requests_dict = list()
     # Generate a dict of open requests for each request_type for which the user
     # is a relevant manager:
     if manager_request_types:
+        # Select only open requests of the managed types, along with their
+        # owners, votes and responses
+        open_requests = defaultdict(list)
+        for req in Request.objects.filter(
+                request_type__in=manager_request_types, status=Request.OPEN,
+        ).select_related("owner__user").prefetch_related(
+            "upvotes__user",
+            Prefetch(
+                "response_set",
+                queryset=Response.objects.select_related("owner__user"),
+            ),
+        ):
+            open_requests[req.request_type_id].append(req)
         for request_type in manager_request_types:
             # Items of form (request, [list_of_request_responses],
             # response_form, upvote, vote_form)
             requests_list = list()
-            # Select only open requests of type request_type:
-            requests = Request.objects.filter(
-                request_type=request_type, status=Request.OPEN,
-                )
-            for req in requests:
+            for req in open_requests[request_type.pk]:
                 response_form = ManagerResponseForm(
                     request.POST if "add_response-{0}".format(req.pk) in request.POST else None,
                     initial={'action': Response.NONE},
@@ -183,7 +227,7 @@ def homepage_view(request, message=None):
                     vote_form.save()
                     return HttpResponseRedirect(reverse('homepage'))
 
-                response_list = Response.objects.filter(request=req)
+                response_list = req.response_set.all()
                 upvote = userProfile in req.upvotes.all()
                 requests_list.append(
                     (req, response_list, response_form, upvote, vote_form)
@@ -197,9 +241,11 @@ def homepage_view(request, message=None):
 
     # Oldest genesis of an unpinned announcement to be displayed.
     within_life = now() - timedelta(hours=settings.ANNOUNCEMENT_LIFE)
-    announcements = \
-      list(Announcement.objects.filter(pinned=True)) + \
-      list(Announcement.objects.filter(pinned=False, post_date__gte=within_life))
+    announcements = Announcement.objects.filter(
+        Q(pinned=True) | Q(post_date__gte=within_life),
+    ).select_related("manager__incumbent", "incumbent__user").order_by(
+        "-pinned", "-post_date",
+    )
     for a in announcements:
         pin_form = None
         if request.user.is_superuser or a.manager.incumbent == userProfile:
@@ -213,13 +259,12 @@ def homepage_view(request, message=None):
                 return HttpResponseRedirect(reverse('homepage'))
         announcements_dict.append((a, pin_form))
 
-    if Manager.objects.filter(incumbent=userProfile, active=True).count():
-        announcement_form = AnnouncementForm(
-            request.POST if "post_announcement" in request.POST else None,
-            profile=userProfile,
-            prefix="announce",
-            )
-    else:
+    announcement_form = AnnouncementForm(
+        request.POST if "post_announcement" in request.POST else None,
+        profile=userProfile,
+        prefix="announce",
+        )
+    if not announcement_form.manager_positions:
         announcement_form = None
 
     if announcement_form and announcement_form.is_valid():
@@ -233,7 +278,9 @@ def homepage_view(request, message=None):
         start_time__gte=week_from_now
     ).exclude(
         end_time__lte=now(),
-    )
+    ).select_related(
+        "owner__user", "as_manager",
+    ).prefetch_related("rsvps__user")
     # Pseudo-dictionary, list with items of form (event, ongoing, rsvpd, rsvp_form)
     events_dict = list()
     for event in events_list:
@@ -270,13 +317,12 @@ def homepage_view(request, message=None):
         return HttpResponseRedirect(reverse('homepage'))
 
     # List of with items of form (thread, most_recent_message_in_thread)
-    thread_set = []
-    for thread in Thread.objects.all()[:settings.HOME_MAX_THREADS]:
-        try:
-            latest_message = Message.objects.filter(thread=thread).latest('post_date')
-        except Message.DoesNotExist:
-            latest_message = None
-        thread_set.append((thread, latest_message))
+    thread_set = [
+        (thread, thread.last_message)
+        for thread in Thread.objects.select_related(
+            "owner__user", "last_message__owner__user",
+        )[:settings.HOME_MAX_THREADS]
+    ]
 
     return render_to_response('homepage.html', {
         'page_name': "Home",
@@ -349,6 +395,7 @@ def notifications_view(request):
     # Copy the notifications so that they are still unread when we render the page
     notifications = list(request.user.notifications.all())
     request.user.notifications.mark_all_as_read()
+    invalidate_navbar_state()
     return render_to_response("list_notifications.html", {
         "page_name": page_name,
         "notifications": notifications,
@@ -733,29 +780,11 @@ def reset_pw_confirm_view(request, uidb64=None, token=None):
 def recount_view(request):
     """
     Recount number_of_messages for all threads and number_of_responses for all requests.
-    Also set the change_date for every thread to the post_date of the latest message
-    associated with that thread.
+    Also point every thread at its latest message and set its change_date to the
+    post_date of that message.
     """
-    requests_changed = 0
-    for req in Request.objects.all():
-        recount = Response.objects.filter(request=req).count()
-        if req.number_of_responses != recount:
-            req.number_of_responses = recount
-            req.save()
-            requests_changed += 1
-    threads_changed = 0
-    for thread in Thread.objects.all():
-        recount = Message.objects.filter(thread=thread).count()
-        if thread.number_of_messages != recount:
-            thread.number_of_messages = recount
-            thread.save()
-            threads_changed += 1
-    dates_changed = 0
-    for thread in Thread.objects.all():
-        if thread.change_date != thread.message_set.latest('post_date').post_date:
-            thread.change_date = thread.message_set.latest('post_date').post_date
-            thread.save()
-            dates_changed += 1
+    requests_changed = rebuild_request_counters()
+    threads_changed, dates_changed = rebuild_thread_counters()
     messages.add_message(request, messages.SUCCESS, MESSAGES['RECOUNTED'].format(
         requests_changed=requests_changed,
         request_count=Request.objects.all().count(),
@@ -800,160 +829,92 @@ def archives_view(request):
         "nodes": nodes,
         }, context_instance=RequestContext(request))
 
-def get_updates_view(request):
-    """Return a user's updates. AJAX."""
-    if not request.is_ajax():
-        raise Http404
+def _parse_pks(value):
+    return sorted(set(int(pk) for pk in value.split(",") if pk.isdigit()))
 
-    if not request.user.is_authenticated():
-        return HttpResponse(json.dumps(dict()),
-                            content_type="application/json")
 
+def _get_updates(user, request_pks, event_pks, thread_pk):
     try:
-        user_profile = UserProfile.objects.get(user=request.user)
+        user_profile = UserProfile.objects.get(user=user)
     except UserProfile.DoesNotExist:
-        return HttpResponse(json.dumps(dict()),
-                            content_type="application/json")
+        return dict()
 
     response = dict()
-    if request.user.is_superuser:
-        num_of_profile_requests = ProfileRequest.objects.all().count()
-
-        if num_of_profile_requests == 0:
-            response['profile_requests_link'] = '''
-                <span class="glyphicon glyphicon-inbox"></span>
-                Profile Requests
-            '''
-
-        else:
-            response['profile_requests_link'] = """
-                <span title="{req_num} open profile request{mult}"
-                    class="badge pull-right">{req_num}</span>
-                <span class="glyphicon glyphicon-inbox"></span>
-                Profile Requests
-            """.format(
-                req_num=num_of_profile_requests,
-                mult='s' if num_of_profile_requests > 1 else '',
-            )
+    if user.is_superuser:
+        response['profile_requests'] = ProfileRequest.objects.count()
 
-    notification_count = request.user.notifications.unread().count()
+    response['notifications'] = user.notifications.unread().count()
 
-    if notification_count == 0:
-        response['notifications_link'] = '''
-            <span class="glyphicon glyphicon-bell"></span>
-            Notifications
-        '''
-
-        response['profile_dropdown_link'] = '''
-            <span><span class="pull-right"><b class="caret"></b></span>
-            <span class="glyphicon glyphicon-user"></span>
-            {first_name}&nbsp;</span>
-        '''.format(first_name=request.user.first_name)
+    # Open requests of each type, keyed by the request type's url_name
+    response['requests'] = dict(
+        (request_type.url_name, count)
+        for request_type, count in get_open_request_counts(user)
+    )
 
-    else:
-        response['notifications_link'] = """
-            <span title="{n_num} unread notification{mult}"
-                class="badge pull-right">{n_num}</span>
-            <span class="glyphicon glyphicon-bell"></span>
-            Notifications
-        """.format(
-            n_num=notification_count,
-            mult='s' if notification_count > 1 else '',
+    if request_pks:
+        response['votes'] = get_ajax_votes(
+            Request.objects.filter(pk__in=request_pks), user_profile,
         )
 
-        response['profile_dropdown_link'] = '''
-            <span><span class="pull-right"><b class="caret"></b></span><span
-            title="You have {n_num} unread notification{mult}."
-            class="badge pull-right">{n_num}</span>
-            <span class="glyphicon glyphicon-user"></span>
-            {first_name}&nbsp;</span>
-        '''.format(
-            n_num=notification_count,
-            mult='s' if notification_count > 1 else '',
-            first_name=request.user.first_name,
+    if event_pks:
+        response['rsvps'] = get_ajax_rsvps(
+            Event.objects.filter(pk__in=event_pks), user_profile,
         )
 
-    req_dict = dict()
-    for req_type in RequestType.objects.filter(enabled=True):
-        open_reqs = Request.objects.filter(request_type=req_type,
-                                          status=Request.OPEN)
-        if not req_type.managers.filter(incumbent__user=request.user):
-            open_reqs = open_reqs.exclude(
-                ~Q(owner__user=request.user), private=True,
-                )
-        num_open = open_reqs.count()
-        if num_open == 0:
-            req_dict['{rtype}_requests_link'.format(rtype=req_type.url_name)] \
-                = """
-                    <span class="glyphicon glyphicon-{icon}"></span>
-                    {name}
-                """.format(
-                    icon=req_type.glyphicon if req_type.glyphicon else 'inbox',
-                    name=req_type.name
-                )
-
-        else:
-            req_dict['{rtype}_requests_link'.format(rtype=req_type.url_name)] \
-                = """
-                    <span title="{num} open request{mult}"
-                        class="badge pull-right">{num}</span>
-                    <span class="glyphicon glyphicon-{icon}"></span>
-                    {name}
-                """.format(
-                    num=num_open,
-                    mult='s' if num_open > 1 else '',
-                    icon=req_type.glyphicon if req_type.glyphicon else 'inbox',
-                    name=req_type.name,
-                )
-
-    if req_dict.keys():
-        response['requests_dict'] = req_dict
-
-    request_pk_list = request.GET.get('request_pk_list', False)
-    if request_pk_list:
-        request_pk_list = request_pk_list.split(',')
-        for request_pk in request_pk_list:
-            try:
-                req = Request.objects.get(pk=request_pk)
-            except Request.DoesNotExist:
-                continue
-
-            response['vote_count_{pk}'.format(pk=req.pk)] = req.upvotes.all().count()
-
-            list_string = 'vote_list_{pk}'.format(pk=request_pk)
-            vote_string = 'in_votes_{pk}'.format(pk=request_pk)
-            count_string = 'vote_count_{pk}'.format(pk=request_pk)
-            response[list_string], response[vote_string], \
-                response[count_string] = build_ajax_votes(
-                    req,
-                    user_profile
-                )
-
-    event_pk_list = request.GET.get('event_pk_list', False)
-    if event_pk_list:
-        event_pk_list = event_pk_list.split(',')
-        for event_pk in event_pk_list:
-            try:
-                event = Event.objects.get(pk=event_pk)
-            except Event.DoesNotExist:
-                continue
-
-            link_string = 'rsvp_link_{pk}'.format(pk=event.pk)
-            list_string = 'rsvp_list_{pk}'.format(pk=event.pk)
-            response[link_string], response[list_string] = build_ajax_rsvps(
-                event,
-                user_profile
-            )
-
-    thread_pk = request.GET.get('thread_pk', False)
-    if thread_pk:
+    if thread_pk is not None:
         try:
             thread = Thread.objects.get(pk=thread_pk)
         except Thread.DoesNotExist:
             pass
         else:
-            response['following'] = user_profile in thread.followers.all()
-            response['num_of_followers'] = thread.followers.all().count()
+            response['following'] = thread.followers.filter(
+                pk=user.pk,
+            ).exists()
+            response['num_of_followers'] = thread.followers.count()
+
+    return response
+
+
+def get_updates_view(request):
+    """
+    Return a user's unread notifications, open request counts, and the votes,
+    RSVPs and followers of anything on the page they are looking at. AJAX.
+
+    The response is cached until something it depends on changes and carries
+    an ETag, so a poll that finds nothing new is answered with a 304 without
+    touching the database.
+    """
+    if not request.is_ajax():
+        raise Http404
+
+    if not request.user.is_authenticated():
+        return HttpResponse(json.dumps(dict()),
+                            content_type="application/json")
+
+    request_pks = _parse_pks(request.GET.get('request_pk_list', ''))
+    event_pks = _parse_pks(request.GET.get('event_pk_list', ''))
+    thread_pk = request.GET.get('thread_pk', '')
+    thread_pk = int(thread_pk) if thread_pk.isdigit() else None
+
+    page = hashlib.md5("{0}|{1}|{2}".format(
+        request_pks, event_pks, thread_pk,
+    )).hexdigest()
+    content = get_navbar_state(
+        request, "updates",
+        [request.user.pk, request.user.date_joined, page],
+        lambda: json.dumps(
+            _get_updates(request.user, request_pks, event_pks, thread_pk),
+            sort_keys=True, separators=(",", ":"),
+        ),
+    )
+
+    etag = hashlib.md5(content).hexdigest()
+    if etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type="application/json")
 
-    return HttpResponse(json.dumps(response),
-                        content_type="application/json")
+    response["ETag"] = quote_etag(etag)
+    # Browsers must check back with us each time they poll
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -9,29 +9,62 @@ AJAX utilities for the events package.
 from django.core.urlresolvers import reverse
 
 
+def _get_rsvps(profiles, user_profile):
+    """Return (profile url, name) pairs for a list of RSVPs."""
+    return [
+        (
+            reverse(
+                'member_profile',
+                kwargs={'targetUsername': profile.user.username}
+            ),
+            'You' if profile.user_id == user_profile.user_id \
+                else profile.user.get_full_name(),
+        )
+        for profile in profiles
+    ]
+
+
 def build_ajax_rsvps(event, user_profile):
     """Return link and list strings for a given event."""
-    if user_profile in event.rsvps.all():
-        link_string = True
-    else:
-        link_string = False
+    profiles = list(event.rsvps.all().select_related('user'))
+    link_string = user_profile in profiles
 
-    if not event.rsvps.all().count():
+    if not profiles:
         list_string = 'No RSVPs.'
     else:
-        list_string = 'RSVPs:'
-        for counter, profile in enumerate(event.rsvps.all()):
-            if counter > 0:
-                list_string += ','
-
-            list_string += \
-                ' <a class="page_link" title="View Profile" href="{url}">' \
-                    '{name}</a>'.format(
-                        url=reverse(
-                            'member_profile',
-                            kwargs={'targetUsername': profile.user.username}
-                        ),
-                        name='You' if profile.user == user_profile.user \
-                            else profile.user.get_full_name(),
-                    )
+        list_string = 'RSVPs:' + ','.join(
+            ' <a class="page_link" title="View Profile" href="{url}">' \
+                '{name}</a>'.format(url=url, name=name)
+            for url, name in _get_rsvps(profiles, user_profile)
+        )
     return (link_string, list_string)
+
+
+def get_ajax_rsvps(events, user_profile):
+    """
+    Gathers the RSVPs to several events at once, loading every member who
+    RSVPed in a fixed number of queries.
+
+    Parameters
+    ----------
+    events : django.db.models.query.QuerySet of events.models.Event
+    user_profile : base.models.UserProfile
+        The profile the RSVPs are being shown to.
+
+    Returns
+    -------
+    dict of int, dict
+        Maps each event's primary key to whether user_profile RSVPed to it
+        and a list of the RSVPed members' profile urls and names.
+    """
+    rsvps = dict()
+    for event in events.prefetch_related('rsvps__user'):
+        profiles = event.rsvps.all()
+        rsvps[event.pk] = {
+            'rsvped': user_profile in profiles,
+            'rsvps': [
+                {'url': url, 'name': name}
+                for url, name in _get_rsvps(profiles, user_profile)
+            ],
+        }
+    return rsvps
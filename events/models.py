@@ -7,6 +7,7 @@ Author: Karandeep Singh Nagra
 from django.core.urlresolvers import reverse
 from django.db import models
 
+from utils.navbar import invalidate_navbar_state
 from base.models import UserProfile
 from managers.models import Manager
 
@@ -93,3 +94,9 @@ class Event(models.Model):
 
     def get_edit_url(self):
         return reverse("events:edit", kwargs={"event_pk": self.pk})
+
+# RSVPs are polled for by get_updates_view
+models.signals.post_delete.connect(invalidate_navbar_state, sender=Event)
+models.signals.m2m_changed.connect(
+    invalidate_navbar_state, sender=Event.rsvps.through,
+)
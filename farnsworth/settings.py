@@ -236,6 +236,7 @@ CRON_CLASSES = (
     "managers.cron.ExpireRequestsCronJob",
     "workshift.cron.CollectBlownCronJob",
     "workshift.cron.UpdateWeeklyStandings",
+    "workshift.cron.SnapshotFineDates",
 )
 
 WIKI_HOOKSET = "farnswiki.hooks.ProjectWikiHookset"
@@ -10,21 +10,65 @@ AJAX utilities for the managers module.
 from django.core.urlresolvers import reverse
 
 
+def _get_voters(profiles, user_profile):
+    """Return (profile url, name) pairs for a list of voters."""
+    return [
+        (
+            reverse(
+                'member_profile',
+                kwargs={'targetUsername': profile.user.username}
+            ),
+            'You' if profile.user_id == user_profile.user_id \
+                else profile.user.get_full_name(),
+        )
+        for profile in profiles
+    ]
+
+
 def build_ajax_votes(request, user_profile):
     """Build vote information for the request."""
-    vote_list = ''
-    for profile in request.upvotes.all():
-        vote_list += \
-            '<li><a title="View Profile" href="{url}">{name}</a></li>'.format(
-                url=reverse(
-                    'member_profile',
-                    kwargs={'targetUsername': profile.user.username}
-                ),
-                name='You' if profile.user == user_profile.user \
-                    else profile.user.get_full_name(),
-            )
-
-    in_votes = user_profile in request.upvotes.all()
-    count = request.upvotes.all().count()
+    profiles = list(request.upvotes.all().select_related('user'))
+    vote_list = ''.join(
+        '<li><a title="View Profile" href="{url}">{name}</a></li>'.format(
+            url=url,
+            name=name,
+        )
+        for url, name in _get_voters(profiles, user_profile)
+    )
+
+    in_votes = user_profile in profiles
+    count = len(profiles)
 
     return (vote_list, in_votes, count)
+
+
+def get_ajax_votes(requests, user_profile):
+    """
+    Gathers the votes on several requests at once, loading every voter in a
+    fixed number of queries.
+
+    Parameters
+    ----------
+    requests : django.db.models.query.QuerySet of managers.models.Request
+    user_profile : base.models.UserProfile
+        The profile the votes are being shown to.
+
+    Returns
+    -------
+    dict of int, dict
+        Maps each request's primary key to its vote count, whether
+        user_profile voted for it, and a list of the voters' profile urls and
+        names.
+    """
+    votes = dict()
+    for request in requests.prefetch_related('upvotes__user'):
+        profiles = request.upvotes.all()
+        votes[request.pk] = {
+            'count': len(profiles),
+            'voted': user_profile in profiles,
+            'voters': [
+                {'url': url, 'name': name}
+                for url, name in _get_voters(profiles, user_profile)
+            ],
+        }
+    return votes
@@ -4,6 +4,8 @@ Project: Farnsworth
 Author: Karandeep Singh Nagra
 '''
 
+from __future__ import absolute_import
+
 from smtplib import SMTPException
 
 from django import forms
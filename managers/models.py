@@ -4,6 +4,8 @@ Project: Farnsworth
 Author: Karandeep Singh Nagra
 '''
 
+from __future__ import absolute_import
+
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
@@ -11,6 +13,7 @@ from django.core.urlresolvers import reverse
 from django.db import models
 
 from utils.funcs import convert_to_url
+from utils.navbar import invalidate_navbar_state
 from base.models import UserProfile
 
 class Manager(models.Model):
@@ -369,3 +372,15 @@ def update_response(sender, instance, created, **kwargs):
 
 models.signals.pre_save.connect(update_request, sender=Request)
 models.signals.post_save.connect(update_response, sender=Response)
+
+# Open requests and president status are shown in the navbar
+for model in [Manager, RequestType, Request]:
+    models.signals.post_save.connect(invalidate_navbar_state, sender=model)
+    models.signals.post_delete.connect(invalidate_navbar_state, sender=model)
+models.signals.m2m_changed.connect(
+    invalidate_navbar_state, sender=RequestType.managers.through,
+)
+# Votes are polled for by get_updates_view
+models.signals.m2m_changed.connect(
+    invalidate_navbar_state, sender=Request.upvotes.through,
+)
@@ -5,6 +5,8 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+from __future__ import absolute_import
+
 from datetime import datetime, timedelta
 
 from django.conf import settings
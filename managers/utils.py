@@ -0,0 +1,40 @@
+'''
+Project: Farnsworth
+
+Author: Karandeep Singh Nagra
+'''
+
+from __future__ import absolute_import
+
+from collections import defaultdict
+
+from django.db.models import Count
+
+from managers.models import Request
+
+
+def rebuild_request_counters():
+    '''
+    Recounts the responses to every request, writing only the requests that
+    were out of date.
+
+    Returns
+    -------
+    int
+        The number of requests whose response count changed.
+    '''
+    # Group requests by their response count, to fix them in one query each
+    recounted = defaultdict(list)
+
+    for request_pk, number_of_responses, count in Request.objects.order_by() \
+            .annotate(count=Count("response")) \
+            .values_list("pk", "number_of_responses", "count"):
+        if number_of_responses != count:
+            recounted[count].append(request_pk)
+
+    for number_of_responses, request_pks in recounted.items():
+        Request.objects.filter(pk__in=request_pks).update(
+            number_of_responses=number_of_responses,
+        )
+
+    return sum(len(request_pks) for request_pks in recounted.values())
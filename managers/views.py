@@ -4,6 +4,8 @@ Project: Farnsworth
 Author: Karandeep Singh Nagra
 '''
 
+from __future__ import absolute_import
+
 from datetime import timedelta
 
 import json
@@ -31,7 +33,9 @@ from managers.models import Manager, RequestType, Request, Response, Announcemen
 from managers.forms import ManagerForm, RequestTypeForm, RequestForm, ResponseForm, \
     ManagerResponseForm, VoteForm, AnnouncementForm, PinForm
 from managers.ajax import build_ajax_votes
-from threads.models import Thread, Message
+from managers.utils import rebuild_request_counters
+from threads.models import Thread
+from threads.utils import rebuild_thread_counters
 
 def add_archive_context(request):
     request_count = Request.objects.all().count()
@@ -697,20 +701,8 @@ def recount_view(request):
     Recount number_of_messages for all threads and number_of_responses for all
     requests.
     '''
-    requests_changed = 0
-    for req in Request.objects.all():
-        recount = Response.objects.filter(request=req).count()
-        if req.number_of_responses != recount:
-            req.number_of_responses = recount
-            req.save()
-            requests_changed += 1
-    threads_changed = 0
-    for thread in Thread.objects.all():
-        recount = Message.objects.filter(thread=thread).count()
-        if thread.number_of_messages != recount:
-            thread.number_of_messages = recount
-            thread.save()
-            threads_changed += 1
+    requests_changed = rebuild_request_counters()
+    threads_changed, dates_changed = rebuild_thread_counters()
     messages.add_message(
         request, messages.SUCCESS,
         MESSAGES['RECOUNTED'].format(
@@ -718,6 +710,7 @@ def recount_view(request):
             request_count=Request.objects.all().count(),
             threads_changed=threads_changed,
             thread_count=Thread.objects.all().count(),
+            dates_changed=dates_changed,
             ),
         )
     return HttpResponseRedirect(reverse('utilities'))
@@ -96,7 +96,8 @@ class DeleteMessageForm(forms.ModelForm):
         thread = message.thread
         message.delete()
 
-        if thread.number_of_messages > 1:
+        # The thread is deleted along with its last message
+        if Thread.objects.filter(pk=thread.pk).exists():
             return thread
 
 class EditMessageForm(forms.ModelForm):
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('threads', '0003_message_edited'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thread',
+            name='last_message',
+            field=models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, blank=True, to='threads.Message', help_text='The most recent message in this thread.', null=True),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='thread',
+            name='number_of_messages',
+            field=models.PositiveSmallIntegerField(default=0, help_text='The number of messages in this thread.'),
+            preserve_default=True,
+        ),
+    ]
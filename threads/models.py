@@ -4,10 +4,13 @@ Project: Farnsworth
 Author: Karandeep Singh Nagra
 '''
 
+from __future__ import absolute_import
+
 from django.contrib.auth.models import User, Group, Permission
 from django.core.urlresolvers import reverse
 from django.db import models
 
+from utils.navbar import invalidate_navbar_state
 from base.models import UserProfile
 
 class Thread(models.Model):
@@ -33,9 +36,17 @@ class Thread(models.Model):
         help_text="The last time this thread was modified.",
         )
     number_of_messages = models.PositiveSmallIntegerField(
-        default=1,
+        default=0,
         help_text="The number of messages in this thread.",
         )
+    last_message = models.ForeignKey(
+        "Message",
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL,
+        related_name="+",
+        help_text="The most recent message in this thread.",
+        )
     active = models.BooleanField(
         default=True,
         help_text="Whether this thread is still active.",
@@ -58,6 +69,20 @@ class Thread(models.Model):
     class Meta:
         ordering = ['-change_date']
 
+    # Kept up to date by the message signals below, so saving a thread never
+    # writes back a stale copy of them
+    COUNTER_FIELDS = ("number_of_messages", "last_message", "change_date")
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None and not kwargs.get("force_insert") and \
+           kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and
+                field.name not in self.COUNTER_FIELDS
+            ]
+        super(Thread, self).save(*args, **kwargs)
+
     def is_thread(self):
         return True
 
@@ -101,31 +126,47 @@ class Message(models.Model):
     def is_message(self):
         return True
 
-def pre_save_thread(sender, instance, **kwargs):
-    thread = instance
-    thread.number_of_messages = thread.message_set.count()
-
-def post_save_thread(sender, instance, created, **kwargs):
-    thread = instance
-    if not created and thread.number_of_messages == 0:
-        thread.delete()
-
 def post_save_message(sender, instance, created, **kwargs):
     message = instance
-    thread = message.thread
 
     if created:
-        thread.change_date = message.post_date
-
-    thread.save()
+        Thread.objects.filter(pk=message.thread_id).update(
+            number_of_messages=models.F("number_of_messages") + 1,
+            last_message=message,
+            change_date=message.post_date,
+        )
 
 def post_delete_message(sender, instance, **kwargs):
     message = instance
-    message.thread.save()
+    threads = Thread.objects.filter(pk=message.thread_id)
+    threads.filter(number_of_messages__gt=0).update(
+        number_of_messages=models.F("number_of_messages") - 1,
+    )
+
+    try:
+        number_of_messages, last_message = threads.values_list(
+            "number_of_messages", "last_message",
+        ).get()
+    except Thread.DoesNotExist:
+        # The thread is being deleted along with its messages
+        return
+
+    if number_of_messages == 0:
+        threads.delete()
+    elif last_message is None:
+        # Deleting the latest message cleared the thread's pointer to it
+        threads.update(
+            last_message=Message.objects.filter(
+                thread=message.thread_id,
+            ).order_by("-post_date", "-pk")[0],
+        )
 
 # Connect signals with their respective functions from above.
 # When a message is created, update that message's thread's change_date to the post_date of that message.
 models.signals.post_save.connect(post_save_message, sender=Message)
 models.signals.post_delete.connect(post_delete_message, sender=Message)
-models.signals.pre_save.connect(pre_save_thread, sender=Thread)
-models.signals.post_save.connect(post_save_thread, sender=Thread)
+# Followers are polled for by get_updates_view
+models.signals.post_delete.connect(invalidate_navbar_state, sender=Thread)
+models.signals.m2m_changed.connect(
+    invalidate_navbar_state, sender=Thread.followers.through,
+)
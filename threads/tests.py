@@ -3,13 +3,19 @@ This file demonstrates writing tests using the unittest module. These will pass
 when you run "manage.py test".
 """
 
+from __future__ import absolute_import
+
+from StringIO import StringIO
+
 from django.test import TestCase
 from django.contrib.auth.models import User
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
 
 from utils.variables import MESSAGES
 from base.models import UserProfile
 from threads.models import Thread, Message
+from threads.utils import rebuild_thread_counters
 
 class VerifyThread(TestCase):
     def setUp(self):
@@ -176,3 +182,62 @@ class VerifyThread(TestCase):
             "New message body",
             Message.objects.get(pk=self.message.pk).body
             )
+
+class TestCounters(TestCase):
+    def setUp(self):
+        self.u = User.objects.create_user(username="u", password="pwd")
+        self.profile = UserProfile.objects.get(user=self.u)
+        self.thread = Thread.objects.create(
+            owner=self.profile,
+            subject="Counter Thread Test",
+            )
+        self.messages = [
+            Message.objects.create(
+                owner=self.profile,
+                body="Message {0}".format(i),
+                thread=self.thread,
+                )
+            for i in range(3)
+            ]
+
+    def test_created(self):
+        thread = Thread.objects.get(pk=self.thread.pk)
+        self.assertEqual(3, thread.number_of_messages)
+        self.assertEqual(self.messages[-1], thread.last_message)
+        self.assertEqual(self.messages[-1].post_date, thread.change_date)
+
+    def test_deleted(self):
+        self.messages[-1].delete()
+        thread = Thread.objects.get(pk=self.thread.pk)
+        self.assertEqual(2, thread.number_of_messages)
+        self.assertEqual(self.messages[-2], thread.last_message)
+
+        self.messages[0].delete()
+        thread = Thread.objects.get(pk=self.thread.pk)
+        self.assertEqual(1, thread.number_of_messages)
+        self.assertEqual(self.messages[-2], thread.last_message)
+
+        self.messages[1].delete()
+        self.assertEqual(0, Thread.objects.filter(pk=self.thread.pk).count())
+
+    def test_stale_save(self):
+        # self.thread was loaded before any of its messages were posted
+        self.thread.subject = "New Subject"
+        self.thread.save()
+
+        thread = Thread.objects.get(pk=self.thread.pk)
+        self.assertEqual("New Subject", thread.subject)
+        self.assertEqual(3, thread.number_of_messages)
+        self.assertEqual(self.messages[-1], thread.last_message)
+
+    def test_recount(self):
+        Thread.objects.filter(pk=self.thread.pk).update(
+            number_of_messages=7,
+            last_message=self.messages[0],
+            )
+        call_command("recount", stdout=StringIO())
+
+        thread = Thread.objects.get(pk=self.thread.pk)
+        self.assertEqual(3, thread.number_of_messages)
+        self.assertEqual(self.messages[-1], thread.last_message)
+        self.assertEqual((0, 0), rebuild_thread_counters())
@@ -0,0 +1,98 @@
+'''
+Project: Farnsworth
+
+Author: Karandeep Singh Nagra
+'''
+
+from __future__ import absolute_import
+
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Max
+
+from threads.models import Thread, Message
+
+LATEST_BATCH_SIZE = 500
+
+
+def rebuild_thread_counters():
+    '''
+    Recounts the messages in every thread and points each thread at its latest
+    message, writing only the threads that were out of date.
+
+    Returns
+    -------
+    threads_changed : int
+        The number of threads whose message count or latest message changed.
+    dates_changed : int
+        The number of threads whose change_date changed.
+    '''
+    with transaction.atomic():
+        threads = list(Thread.objects.annotate(
+            message_count=Count("message"),
+            latest_post_date=Max("message__post_date"),
+        ).order_by().values_list(
+            "pk", "number_of_messages", "last_message", "change_date",
+            "message_count", "latest_post_date",
+        ))
+
+        # Only fetch the messages posted at the latest time in some thread,
+        # a few hundred dates at a time to keep under the query parameter
+        # limits of some databases
+        post_dates = sorted(set(
+            thread[5] for thread in threads if thread[5] is not None
+        ))
+        latest = dict()
+        for i in range(0, len(post_dates), LATEST_BATCH_SIZE):
+            for thread_pk, message_pk, post_date in Message.objects.filter(
+                    post_date__in=post_dates[i:i + LATEST_BATCH_SIZE],
+            ).order_by("post_date", "pk").values_list(
+                "thread", "pk", "post_date",
+            ):
+                latest[thread_pk, post_date] = message_pk
+
+        threads_changed, dates_changed = 0, 0
+        # Group threads by their new values, to fix them in one query each
+        recounted = defaultdict(list)
+        repointed = defaultdict(list)
+        emptied = []
+
+        for thread_pk, number_of_messages, last_message, change_date, \
+                message_count, latest_post_date in threads:
+            message_pk = latest.get((thread_pk, latest_post_date))
+            changed = False
+
+            if number_of_messages != message_count:
+                recounted[message_count].append(thread_pk)
+                changed = True
+
+            if latest_post_date is None and last_message is not None:
+                # Threads without messages keep their change_date
+                emptied.append(thread_pk)
+                changed = True
+            elif last_message != message_pk or \
+                    change_date != latest_post_date:
+                repointed[message_pk, latest_post_date].append(thread_pk)
+                if last_message != message_pk:
+                    changed = True
+                if change_date != latest_post_date:
+                    dates_changed += 1
+
+            threads_changed += changed
+
+        for number_of_messages, thread_pks in recounted.items():
+            Thread.objects.filter(pk__in=thread_pks).update(
+                number_of_messages=number_of_messages,
+            )
+
+        if emptied:
+            Thread.objects.filter(pk__in=emptied).update(last_message=None)
+
+        for (message_pk, post_date), thread_pks in repointed.items():
+            Thread.objects.filter(pk__in=thread_pks).update(
+                last_message=message_pk,
+                change_date=post_date,
+            )
+
+    return threads_changed, dates_changed
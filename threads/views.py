@@ -4,11 +4,14 @@ Project: Farnsworth
 Author: Karandeep Singh Nagra
 '''
 
+from __future__ import absolute_import
+
 import json
 
 from django.contrib.auth.models import User
 from django.contrib import messages
 from django.core.urlresolvers import reverse
+from django.db.models import F
 from django.http import HttpResponseRedirect, HttpResponse, Http404
 from django.shortcuts import render_to_response, get_object_or_404
 from django.template import RequestContext
@@ -43,7 +46,7 @@ def add_archive_context(request):
 @profile_required
 def list_all_threads_view(request):
     ''' View of all threads. '''
-    threads = Thread.objects.all()
+    threads = Thread.objects.all().select_related("owner__user")
 
     create_form = ThreadForm(
         request.POST if "submit_thread_form" in request.POST else None,
@@ -174,8 +177,8 @@ def thread_view(request, pk):
         messages.add_message(request, messages.ERROR, MESSAGES['MESSAGE_ERROR'])
 
 
+    Thread.objects.filter(pk=thread.pk).update(views=F("views") + 1)
     thread.views += 1
-    thread.save()
 
     following = request.user in thread.followers.all()
 
@@ -194,7 +197,8 @@ def list_user_threads_view(request, targetUsername):
     ''' View of threads a user has created. '''
     targetUser = get_object_or_404(User, username=targetUsername)
     targetProfile = get_object_or_404(UserProfile, user=targetUser)
-    threads = Thread.objects.filter(owner=targetProfile)
+    threads = Thread.objects.filter(owner=targetProfile) \
+        .select_related("owner__user")
     page_name = "{0}'s Threads".format(targetUser.get_full_name())
     create_form = ThreadForm(
         request.POST if "submit_thread_form" in request.POST else None,
@@ -222,7 +226,8 @@ def list_user_messages_view(request, targetUsername):
     targetProfile = get_object_or_404(UserProfile, user=targetUser)
     user_messages = Message.objects.filter(owner=targetProfile)
     thread_pks = list(set([i.thread.pk for i in user_messages]))
-    threads = Thread.objects.filter(pk__in=thread_pks)
+    threads = Thread.objects.filter(pk__in=thread_pks) \
+        .select_related("owner__user")
     page_name = "Threads {0} has posted in".format(targetUser.get_full_name())
     return render_to_response('list_threads.html', {
         'page_name': page_name,
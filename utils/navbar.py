@@ -0,0 +1,69 @@
+'''
+Project: Farnsworth
+
+Author: Karandeep Singh Nagra
+
+Caching for the per-user state shown in the navbar on every page.
+'''
+
+from django.core.cache import cache
+
+from utils.versions import get_versions, bump_versions
+
+GENERATION_KEY = "navbar-generation"
+
+# Some of the state depends on the time of day, so don't hold onto it forever
+NAVBAR_TIMEOUT = 5 * 60
+
+
+def get_navbar_state(request, name, key, build):
+    '''
+    Gets a piece of navbar state for a request, building it at most once per
+    request and caching it between requests until invalidate_navbar_state is
+    called.
+
+    Parameters
+    ----------
+    request : django.http.HttpRequest
+    name : str
+        Name of this piece of state, i.e. "base" or "workshift".
+    key : list
+        Everything that the state depends on, i.e. the user and semester.
+    build : callable
+        Builds the state when it is not cached.
+    '''
+    states = request.__dict__.setdefault("_navbar_states", {})
+    if name in states:
+        return states[name]
+
+    cache_key = "navbar-{0}-{1}".format(
+        name, "-".join(str(i) for i in key),
+    )
+
+    if "_navbar_generation" in request.__dict__:
+        cached = {cache_key: cache.get(cache_key)}
+    else:
+        cached = cache.get_many([GENERATION_KEY, cache_key])
+        request._navbar_generation = get_versions(
+            [GENERATION_KEY], cached,
+        )[GENERATION_KEY]
+
+    generation = request._navbar_generation
+    cached = cached.get(cache_key)
+
+    if cached is not None and cached[0] == generation:
+        state = cached[1]
+    else:
+        state = build()
+        cache.set(cache_key, (generation, state), NAVBAR_TIMEOUT)
+
+    states[name] = state
+    return state
+
+
+def invalidate_navbar_state(*args, **kwargs):
+    '''
+    Marks every cached navbar state as out of date. Takes any arguments so
+    that it can be connected to model signals directly.
+    '''
+    bump_versions([GENERATION_KEY])
@@ -0,0 +1,60 @@
+'''
+Project: Farnsworth
+
+Author: Karandeep Singh Nagra
+
+Version counters kept in the cache, used to mark everything cached under an
+old version as out of date without having to find and delete it.
+'''
+
+from time import time
+
+from django.core.cache import cache
+
+
+def get_versions(keys, cached=None):
+    '''
+    Gets the current value of each version counter, starting any that are
+    missing.
+
+    Parameters
+    ----------
+    keys : list of str
+    cached : dict, optional
+        Values already fetched with cache.get_many, to save looking them up
+        again.
+
+    Returns
+    -------
+    dict of str to int
+    '''
+    if cached is None:
+        cached = cache.get_many(keys)
+
+    versions = {}
+    for key in keys:
+        version = cached.get(key)
+        if version is None:
+            # Start from a new value, so that anything cached before the
+            # version was evicted is not mistaken for fresh
+            cache.add(key, int(time() * 1000), None)
+            version = cache.get(key)
+        versions[key] = version
+    return versions
+
+
+def bump_versions(keys):
+    '''
+    Moves each version counter on, so that anything cached under its old value
+    is out of date.
+
+    Parameters
+    ----------
+    keys : list of str
+    '''
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Nothing has been cached since the version was last evicted
+            pass
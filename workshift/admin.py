@@ -11,6 +11,24 @@ from django.contrib import admin
 from workshift.models import Semester, WorkshiftPool, WorkshiftType, \
     TimeBlock, WorkshiftRating, PoolHours, WorkshiftProfile, \
     RegularWorkshift, ShiftLogEntry, InstanceInfo, WorkshiftInstance
+from workshift import utils
+
+class DeferredRecomputeAdmin(admin.ModelAdmin):
+    """
+    Runs the recomputes triggered by saving objects once per page, rather
+    than once per object for bulk actions.
+    """
+    def changeform_view(self, *args, **kwargs):
+        with utils.deferred_recompute():
+            return super(DeferredRecomputeAdmin, self).changeform_view(
+                *args, **kwargs
+            )
+
+    def changelist_view(self, *args, **kwargs):
+        with utils.deferred_recompute():
+            return super(DeferredRecomputeAdmin, self).changelist_view(
+                *args, **kwargs
+            )
 
 class SemesterAdmin(admin.ModelAdmin):
     list_display = ('season', 'year', 'start_date', 'end_date')
@@ -19,7 +37,7 @@ class SemesterAdmin(admin.ModelAdmin):
     ordering = ('-year',)
 admin.site.register(Semester, SemesterAdmin)
 
-class WorkshiftPoolAdmin(admin.ModelAdmin):
+class WorkshiftPoolAdmin(DeferredRecomputeAdmin):
     list_display = ('title', 'semester', 'hours', 'is_primary')
     search_fields = ('title', 'semester', 'hours')
     list_filter = ('title', 'hours')
@@ -47,7 +65,7 @@ class WorkshiftRatingAdmin(admin.ModelAdmin):
     ordering = ('rating',)
 admin.site.register(WorkshiftRating, WorkshiftRatingAdmin)
 
-class PoolHoursAdmin(admin.ModelAdmin):
+class PoolHoursAdmin(DeferredRecomputeAdmin):
     list_display = ('pool', 'hours', 'standing')
     search_fields = ('pool', 'hours', 'standing')
     list_filter = ('pool', 'hours',)
@@ -61,7 +79,7 @@ class WorkshiftProfileAdmin(admin.ModelAdmin):
     ordering = ('semester', 'user')
 admin.site.register(WorkshiftProfile, WorkshiftProfileAdmin)
 
-class RegularWorkshiftAdmin(admin.ModelAdmin):
+class RegularWorkshiftAdmin(DeferredRecomputeAdmin):
     list_display = ('workshift_type', 'pool', 'active',)
     search_fields = ('workshift_type', 'pool', 'hours', 'start_time', 'end_time', 'addendum')
     list_filter = ('workshift_type',)
@@ -0,0 +1,135 @@
+"""
+Project: Farnsworth
+
+Authors: Karandeep Singh Nagra and Nader Morshed
+
+Weekly availability bitmaps for workshift profiles.
+
+A week is split into SLOT_MINUTES long slots, with bit
+day * SLOTS_PER_DAY + slot set if a member is busy (or prefers to work) during
+that slot. Checking a member against a shift is then a handful of integer
+operations rather than a walk over their time blocks.
+"""
+
+from __future__ import division, absolute_import
+
+SLOT_MINUTES = 5
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+
+def _get_slot(value, round_up=False):
+    slot, remainder = divmod(value.hour * 60 + value.minute, SLOT_MINUTES)
+    if round_up and (remainder or value.second or value.microsecond):
+        slot += 1
+    return slot
+
+
+def day_mask(day, start_time=None, end_time=None):
+    """
+    Makes a bitmap of every slot touched by the time between two times on a
+    given day.
+
+    Parameters
+    ----------
+    day : int
+    start_time : datetime.time, optional
+        Defaults to the start of the day.
+    end_time : datetime.time, optional
+        Defaults to the end of the day.
+
+    Returns
+    -------
+    int
+
+    Raises
+    ------
+    ValueError
+        If day is None, i.e. for shifts that aren't on a particular day.
+    """
+    if day is None:
+        raise ValueError("Shifts without a day have no time slots.")
+
+    start = 0 if start_time is None else _get_slot(start_time)
+    end = SLOTS_PER_DAY if end_time is None \
+        else _get_slot(end_time, round_up=True)
+
+    if end <= start:
+        return 0
+
+    return ((1 << (end - start)) - 1) << (int(day) * SLOTS_PER_DAY + start)
+
+
+def build(time_blocks):
+    """
+    Compiles a member's time blocks into busy and preferred bitmaps.
+
+    Parameters
+    ----------
+    time_blocks : list of workshift.models.TimeBlock
+
+    Returns
+    -------
+    busy : int
+    preferred : int
+    """
+    from workshift.models import TimeBlock
+
+    busy, preferred = 0, 0
+
+    for block in time_blocks:
+        mask = day_mask(block.day, block.start_time, block.end_time)
+        if block.preference == TimeBlock.BUSY:
+            busy |= mask
+        elif block.preference == TimeBlock.PREFERRED:
+            preferred |= mask
+
+    return busy, preferred
+
+
+def longest_run(mask):
+    """
+    Finds the number of consecutive set bits in the longest run in a bitmap.
+    """
+    run = 0
+    while mask:
+        mask &= mask >> 1
+        run += 1
+    return run
+
+
+def free_minutes(busy, day, start_time=None, end_time=None):
+    """
+    Finds the longest stretch of time that a member is free between two times
+    on a given day.
+
+    Parameters
+    ----------
+    busy : int
+    day : int
+    start_time : datetime.time, optional
+    end_time : datetime.time, optional
+
+    Returns
+    -------
+    int
+    """
+    window = day_mask(day, start_time, end_time)
+    return longest_run(window & ~busy) * SLOT_MINUTES
+
+
+def overlaps(busy, day, start_time=None, end_time=None):
+    """
+    Checks whether a member is busy at any point between two times on a given
+    day. Members are never busy for shifts that aren't on a particular day.
+    """
+    if day is None:
+        return False
+    return bool(day_mask(day, start_time, end_time) & busy)
+
+
+def to_string(mask):
+    return "{0:x}".format(mask)
+
+
+def from_string(value):
+    return int(value, 16)
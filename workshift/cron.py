@@ -21,4 +21,24 @@ class UpdateWeeklyStandings(CronJobBase):
     code = "workshift.update_standings"
 
     def do(self):
-        utils.update_standings()
+        changed, elapsed = utils.update_standings()
+        return "Updated {0} standing{1} in {2:.2f}s".format(
+            changed, "s" if changed != 1 else "", elapsed,
+        )
+
+
+class SnapshotFineDates(CronJobBase):
+    # After the weekly standings have been updated
+    RUN_AT_TIMES = ["0:11"]
+
+    schedule = Schedule(run_at_times=RUN_AT_TIMES)
+    code = "workshift.snapshot_fine_dates"
+
+    def do(self):
+        snapshots = utils.snapshot_fine_dates()
+        return "\n".join(
+            "Fined {0} member{1} in {2}".format(
+                fined, "s" if fined != 1 else "", pool.title,
+            )
+            for pool, field, fined in snapshots
+        )
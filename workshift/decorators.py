@@ -8,7 +8,7 @@ from utils.variables import MESSAGES
 from base.redirects import red_home
 from workshift.models import WorkshiftProfile, Semester
 from workshift.redirects import red_workshift
-from workshift.utils import can_manage
+from workshift.utils import get_permissions
 
 def _extract_semester(kwargs):
     sem_url = kwargs.pop("sem_url", None)
@@ -68,7 +68,9 @@ def workshift_manager_required(function=None, redirect_no_user='login',
                     redirect_to += "?next=" + request.path
                 return HttpResponseRedirect(redirect_to)
 
-            if not can_manage(request.user, semester=kwargs.get("semester", None)):
+            if not get_permissions(request).can_manage(
+                    semester=kwargs.get("semester", None),
+            ):
                 messages = MESSAGES['ADMINS_ONLY']
                 if Semester.objects.filter(current=True).count() == 0:
                     messages = "Workshift semester has not been created yet. " + messages
@@ -12,19 +12,17 @@ from django import forms
 from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth.forms import AuthenticationForm
-from django.db.models import Q
 from django.forms.models import BaseModelFormSet, modelformset_factory
 
 from notifications import notify
 from django_select2.widgets import Select2MultipleWidget, Select2Widget
 
-from managers.models import Manager
 from workshift.models import Semester, WorkshiftPool, WorkshiftType, \
     TimeBlock, WorkshiftRating, WorkshiftProfile, \
     RegularWorkshift, ShiftLogEntry, InstanceInfo, WorkshiftInstance, \
-    PoolHours, AUTO_VERIFY, WORKSHIFT_MANAGER_VERIFY, \
+    PoolHours, StandingDelta, AUTO_VERIFY, WORKSHIFT_MANAGER_VERIFY, \
     POOL_MANAGER_VERIFY, ANY_MANAGER_VERIFY, OTHER_VERIFY, VERIFY_CHOICES
-from workshift import utils
+from workshift import availability, utils
 from workshift.templatetags.workshift_tags import currency
 
 valid_time_formats = ['%H:%M', '%I:%M%p', '%I:%M %p']
@@ -62,13 +60,15 @@ class StartPoolForm(forms.ModelForm):
             "hours": "",
         }
 
-    def save(self, semester):
+    def save(self, semester, commit=True):
         if self.cleaned_data['copy_pool']:
             pool = super(StartPoolForm, self).save(commit=False)
             pool.semester = semester
-            pool.save()
+            if commit:
+                pool.save()
 
-            utils.make_workshift_pool_hours(pool.semester, pools=[pool])
+                utils.make_workshift_pool_hours(pool.semester, pools=[pool])
+            return pool
 
 
 class CloseSemesterForm(forms.Form):
@@ -367,8 +367,15 @@ class InteractShiftForm(forms.Form):
     def __init__(self, *args, **kwargs):
         self.profile = kwargs.pop("profile")
         self.undo = kwargs.pop("undo", False)
+        # The utils.Permissions for profile's user, if already loaded
+        self.permissions = kwargs.pop("permissions", None)
         super(InteractShiftForm, self).__init__(*args, **kwargs)
 
+    def get_permissions(self):
+        if self.permissions is None:
+            self.permissions = utils.Permissions(self.profile.user)
+        return self.permissions
+
     def clean_pk(self):
         pk = self.cleaned_data["pk"]
         if self.profile is None:
@@ -384,16 +391,24 @@ class InteractShiftForm(forms.Form):
         return shift
 
 
-def _undo_verify_blown(instance, pool_hours):
+def _undo_verify_blown(instance):
+    """
+    Reopens a shift that was verified or marked as blown, returning the change
+    this makes to the workshifter's standing.
+    """
+    amount = 0
+
     if instance.blown:
         instance.blown = False
         instance.closed = False
-        pool_hours.standing += instance.hours
+        amount += instance.hours
 
     if instance.verifier:
         instance.verifier = None
         instance.closed = False
-        pool_hours.standing -= instance.hours
+        amount -= instance.hours
+
+    return amount
 
 
 class VerifyShiftForm(InteractShiftForm):
@@ -405,7 +420,7 @@ class VerifyShiftForm(InteractShiftForm):
         instance = super(VerifyShiftForm, self).clean_pk()
 
         workshifter = instance.workshifter or instance.liable
-        managers = Manager.objects.filter(incumbent__user=self.profile.user)
+        permissions = self.get_permissions()
 
         if not workshifter:
             raise forms.ValidationError("Workshift is not filled.")
@@ -413,13 +428,13 @@ class VerifyShiftForm(InteractShiftForm):
         if instance.verify == AUTO_VERIFY:
             raise forms.ValidationError("Workshift is automatically verified.")
         elif instance.verify == WORKSHIFT_MANAGER_VERIFY:
-            if not any(i.workshift_manager for i in managers):
+            if not permissions.workshift_manager:
                 raise forms.ValidationError("Verifier is not a workshift manager.")
         elif instance.verify == POOL_MANAGER_VERIFY:
-            if not set(managers).intersection(instance.pool.managers):
+            if instance.pool.pk not in permissions.pools:
                 raise forms.ValidationError("Verifier is not in the list of managers for this pool.")
         elif instance.verify == ANY_MANAGER_VERIFY:
-            if not managers.count():
+            if not permissions.managers:
                 raise forms.ValidationError("Verifier is not a manager.")
         elif instance.verify == OTHER_VERIFY:
             if workshifter == self.profile:
@@ -436,7 +451,7 @@ class VerifyShiftForm(InteractShiftForm):
         pool_hours = workshifter.pool_hours.get(pool=instance.pool)
 
         # Check if the shift was previously verified or marked as blown
-        _undo_verify_blown(instance, pool_hours)
+        undone = _undo_verify_blown(instance)
 
         instance.verifier = self.profile
         instance.closed = True
@@ -451,8 +466,16 @@ class VerifyShiftForm(InteractShiftForm):
         )
 
         # Update the workshifter's hours
-        pool_hours.standing += instance.hours
-        pool_hours.save(update_fields=["standing"])
+        utils.adjust_standings([
+            StandingDelta(
+                pool_hours=pool_hours, amount=undone,
+                reason=StandingDelta.UNDONE, instance=instance,
+            ),
+            StandingDelta(
+                pool_hours=pool_hours, amount=instance.hours,
+                reason=StandingDelta.VERIFIED, instance=instance,
+            ),
+        ])
 
         if self.profile != workshifter:
             notify.send(
@@ -477,7 +500,7 @@ class BlownShiftForm(InteractShiftForm):
             raise forms.ValidationError("Workshift is not filled.")
         pool = shift.pool
         if not pool.any_blown and \
-           not utils.can_manage(self.profile.user, semester=shift.semester, pool=pool):
+           not self.get_permissions().can_manage(semester=shift.semester, pool=pool):
             raise forms.ValidationError("You are not a workshift manager.")
 
         return shift
@@ -488,7 +511,7 @@ class BlownShiftForm(InteractShiftForm):
         pool_hours = workshifter.pool_hours.get(pool=instance.pool)
 
         # Check if the shift was previously verified or marked as blown
-        _undo_verify_blown(instance, pool_hours)
+        undone = _undo_verify_blown(instance)
 
         # Close the shift
         instance.blown = True
@@ -504,8 +527,16 @@ class BlownShiftForm(InteractShiftForm):
         )
 
         # Update the workshifter's hours
-        pool_hours.standing -= instance.hours
-        pool_hours.save(update_fields=["standing"])
+        utils.adjust_standings([
+            StandingDelta(
+                pool_hours=pool_hours, amount=undone,
+                reason=StandingDelta.UNDONE, instance=instance,
+            ),
+            StandingDelta(
+                pool_hours=pool_hours, amount=-instance.hours,
+                reason=StandingDelta.BLOWN, instance=instance,
+            ),
+        ])
 
         # Notify the workshifter as well as the workshift manager
         targets = []
@@ -536,9 +567,12 @@ class UndoShiftForm(InteractShiftForm):
 
     @staticmethod
     def check_marked_blown(instance, profile):
-        if instance.logs.count() > 0:
-            latest = instance.logs.latest("entry_time")
-            if latest.entry_type == ShiftLogEntry.BLOWN and latest.person == profile:
+        # Uses the logs if they were prefetched with the instance
+        logs = list(instance.logs.all())
+        if logs:
+            latest = max(logs, key=lambda log: log.entry_time)
+            if latest.entry_type == ShiftLogEntry.BLOWN and \
+               latest.person_id == profile.pk:
                 return True
 
         return False
@@ -563,9 +597,11 @@ class UndoShiftForm(InteractShiftForm):
         # Check if the shift was previously verified or marked as blown
         marked_blown = UndoShiftForm.check_marked_blown(instance, self.profile)
 
-        _undo_verify_blown(instance, pool_hours)
+        undone = _undo_verify_blown(instance)
         instance.save(update_fields=["verifier", "blown", "closed"])
-        pool_hours.save(update_fields=["standing"])
+        utils.adjust_standing(
+            pool_hours, undone, StandingDelta.UNDONE, instance=instance,
+        )
 
         if marked_blown:
             instance.logs.add(
@@ -730,12 +766,15 @@ class EditHoursForm(forms.Form):
                 pool=self.instance.pool,
             )
 
-            # Remove the hours we gave them previously
-            pool_hours.standing -= self.instance.hours
-
-            # Then give them the hours for this shift
-            pool_hours.standing += hours
-            pool_hours.save(update_fields=["standing"])
+            # Swap the hours we gave (or took from) them previously for the
+            # hours for this shift
+            change = hours - self.instance.hours
+            utils.adjust_standing(
+                pool_hours,
+                -change if self.instance.blown else change,
+                StandingDelta.EDITED,
+                instance=self.instance,
+            )
 
         self.instance.hours = hours
         self.instance.save(update_fields=["hours"])
@@ -876,6 +915,12 @@ class AutoAssignShiftForm(forms.Form):
         queryset=WorkshiftPool.objects.filter(semester__current=True),
         help_text="Auto-assign all recurring workshifts for this pool.",
     )
+    strategy = forms.ChoiceField(
+        required=False,
+        choices=utils.AUTO_ASSIGN_STRATEGIES,
+        initial=utils.AUTO_ASSIGN_MATCHING,
+        help_text="How to decide who gets which shift.",
+    )
 
     def __init__(self, *args, **kwargs):
         self.semester = kwargs.pop('semester')
@@ -892,6 +937,7 @@ class AutoAssignShiftForm(forms.Form):
     def save(self):
         unfinished = utils.auto_assign_shifts(
             self.semester, pool=self.cleaned_data['pool'],
+            strategy=self.cleaned_data['strategy'] or utils.AUTO_ASSIGN_MATCHING,
         )
         return unfinished
 
@@ -969,22 +1015,36 @@ class AssignShiftForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         self.semester = kwargs.pop('semester')
+        # Mapping of profile pks to their availability, from
+        # utils.load_availability, to share between many forms
+        profile_availability = kwargs.pop('availability', None)
         super(AssignShiftForm, self).__init__(*args, **kwargs)
         start, end = self.instance.start_time, self.instance.end_time
-        if start and end:
-            query = []
-            for profile in WorkshiftProfile.objects.filter(semester=self.semester):
-                time_blocks = profile.time_blocks.filter(
-                    Q(start_time__lt=start, end_time__gt=start) |
-                    Q(start_time__lt=end, end_time__gt=end) |
-                    Q(start_time__gt=start, end_time__lt=end),
-                    preference=TimeBlock.BUSY, day=self.instance.day,
+        if start and end and (
+                self.instance.week_long or self.instance.day is None
+        ):
+            # Anyone can fit in shifts that aren't on a particular day
+            self.fields['current_assignees'].queryset = \
+              WorkshiftProfile.objects.filter(semester=self.semester) \
+              .select_related("user__userprofile")
+        elif start and end:
+            if profile_availability is None:
+                profile_availability = utils.load_availability(
+                    WorkshiftProfile.objects.filter(semester=self.semester),
+                )
+
+            query = [
+                profile_pk
+                for profile_pk, (busy, preferred) in
+                profile_availability.items()
+                if not availability.overlaps(
+                    busy, self.instance.day, start, end,
                 )
-                if not time_blocks:
-                    query.append(profile.pk)
+            ]
 
             self.fields['current_assignees'].queryset = \
-              WorkshiftProfile.objects.filter(pk__in=query)
+              WorkshiftProfile.objects.filter(pk__in=query) \
+              .select_related("user__userprofile")
 
 
 class AdjustHoursForm(forms.ModelForm):
@@ -1128,6 +1188,7 @@ class BaseTimeBlockFormSet(BaseModelFormSet):
         for block in blocks:
             if not self.profile.time_blocks.filter(pk=block.pk):
                 self.profile.time_blocks.add(block)
+        self.profile.update_availability()
         return blocks
 
 
@@ -0,0 +1,47 @@
+"""
+Project: Farnsworth
+
+Authors: Karandeep Singh Nagra and Nader Morshed
+"""
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from workshift.models import Semester, WorkshiftPool
+from workshift import utils
+
+
+class Command(BaseCommand):
+    help = "Clears the regular workshift assignments of the current semester."
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            "--pool",
+            action="append",
+            default=[],
+            help="Title of a pool to clear, defaults to the primary pool. "
+            "May be given more than once.",
+        ),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            semester = Semester.objects.get(current=True)
+        except (Semester.DoesNotExist, Semester.MultipleObjectsReturned):
+            raise CommandError("There is no single current semester.")
+
+        pools = WorkshiftPool.objects.filter(semester=semester)
+        if options["pool"]:
+            pools = pools.filter(title__in=options["pool"])
+        else:
+            pools = pools.filter(is_primary=True)
+
+        if not pools:
+            raise CommandError("No matching workshift pools.")
+
+        for pool in pools:
+            count = utils.clear_all_assignments(semester, pool)
+            self.stdout.write("Cleared {0} assignment{1} from {2}.".format(
+                count, "" if count == 1 else "s", pool.title,
+            ))
@@ -0,0 +1,35 @@
+"""
+Project: Farnsworth
+
+Authors: Karandeep Singh Nagra and Nader Morshed
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from workshift.models import Semester, WorkshiftPool, RegularWorkshift
+from workshift import utils
+
+
+class Command(BaseCommand):
+    help = "Reassigns the open workshift instances of the current semester " \
+        "to their regular workshifts' current assignees."
+
+    def handle(self, *args, **options):
+        try:
+            semester = Semester.objects.get(current=True)
+        except (Semester.DoesNotExist, Semester.MultipleObjectsReturned):
+            raise CommandError("There is no single current semester.")
+
+        total = 0
+        for pool in WorkshiftPool.objects.filter(semester=semester):
+            count = utils.reset_instance_assignments(
+                semester, RegularWorkshift.objects.filter(pool=pool),
+            )
+            total += count
+            self.stdout.write("Reset {0} instance{1} in {2}.".format(
+                count, "" if count == 1 else "s", pool.title,
+            ))
+
+        self.stdout.write("Reset {0} instance{1} in total.".format(
+            total, "" if total == 1 else "s",
+        ))
@@ -0,0 +1,37 @@
+"""
+Project: Farnsworth
+
+Authors: Karandeep Singh Nagra and Nader Morshed
+"""
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from workshift.models import WorkshiftInstance
+from workshift import utils
+
+
+class Command(BaseCommand):
+    help = "Fills in the verify and sign out deadlines of workshift instances."
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            "--current",
+            action="store_true",
+            default=False,
+            help="Only update instances in the current semester.",
+        ),
+    )
+
+    def handle(self, *args, **options):
+        instances = WorkshiftInstance.objects.all()
+
+        if options["current"]:
+            instances = instances.filter(semester__current=True)
+
+        count = utils.update_deadlines(instances)
+
+        self.stdout.write("Updated the deadlines of {0} instance{1}.".format(
+            count, "" if count == 1 else "s",
+        ))
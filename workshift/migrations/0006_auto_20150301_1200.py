@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workshift', '0005_auto_20150219_1742'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workshiftinstance',
+            name='sign_out_deadline',
+            field=models.DateTimeField(help_text='Time after which workshifters can no longer sign out of this shift.', null=True, editable=False, db_index=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='workshiftinstance',
+            name='verify_deadline',
+            field=models.DateTimeField(help_text='Time after which this shift can no longer be verified.', null=True, editable=False, db_index=True, blank=True),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workshift', '0006_auto_20150301_1200'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workshiftprofile',
+            name='busy_slots',
+            field=models.TextField(help_text='Bitmap of when this member is busy each week, built from their time blocks.', null=True, editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='workshiftprofile',
+            name='preferred_slots',
+            field=models.TextField(help_text='Bitmap of when this member would prefer to work each week, built from their time blocks.', null=True, editable=False, blank=True),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+import django.db.models.deletion
+
+
+def start_ledger(apps, schema_editor):
+    # Open the ledger with everyone's current standing
+    PoolHours = apps.get_model("workshift", "PoolHours")
+    StandingDelta = apps.get_model("workshift", "StandingDelta")
+    StandingDelta.objects.bulk_create([
+        StandingDelta(pool_hours_id=pk, amount=standing, reason="R")
+        for pk, standing in PoolHours.objects.exclude(standing=0)
+        .values_list("pk", "standing")
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workshift', '0007_auto_20150302_1200'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StandingDelta',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('amount', models.DecimalField(help_text='Hours added to (or taken away from) the standing.', max_digits=5, decimal_places=2)),
+                ('reason', models.CharField(help_text='Why the standing changed.', max_length=1, choices=[('V', 'Verified'), ('B', 'Blown'), ('U', 'Undone'), ('E', 'Hours Edited'), ('D', 'Shift Deleted'), ('P', 'Period Requirement'), ('A', 'Hour Adjustment'), ('R', 'Recalculated')])),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now, help_text='When the standing changed.')),
+                ('instance', models.ForeignKey(related_name='standing_deltas', on_delete=django.db.models.deletion.SET_NULL, blank=True, to='workshift.WorkshiftInstance', help_text='The shift that caused this change, if any.', null=True)),
+                ('pool_hours', models.ForeignKey(related_name='deltas', to='workshift.PoolHours', help_text='The pool hours whose standing changed.')),
+            ],
+            options={
+                'ordering': ['timestamp'],
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterIndexTogether(
+            name='standingdelta',
+            index_together=set([('pool_hours', 'timestamp')]),
+        ),
+        migrations.RunPython(start_ledger, lambda apps, schema_editor: None),
+    ]
@@ -6,14 +6,19 @@ Author: Karandeep Singh Nagra
 
 from __future__ import unicode_literals, absolute_import
 
+from datetime import datetime, time, timedelta
+
 from django.contrib.auth.models import User
 from django.conf import settings
 from django.db import models
+from django.db.models import Sum
 from django.utils.dateformat import time_format
-from django.utils.timezone import now, localtime
+from django.utils.timezone import now, localtime, make_aware, \
+    get_default_timezone
 
 from base.models import UserProfile
 from managers.models import Manager
+from workshift import availability
 from workshift.fields import DayField
 from workshift.templatetags.workshift_tags import wurl
 
@@ -202,6 +207,34 @@ class WorkshiftPool(models.Model):
             self.hours, "s" if self.hours != 1 else "",
         )
 
+    def periods_since(self, last_updated, moment=None):
+        """
+        Finds the number of periods (n weeks / once per semester) that have
+        passed between a member's standing last being updated and moment.
+
+        Parameters
+        ----------
+        last_updated : datetime.datetime or None
+        moment : datetime.datetime, optional
+        """
+        if moment is None:
+            moment = localtime(now())
+
+        if self.weeks_per_period == 0:
+            # Only update this pool once
+            return 1 if last_updated is None else 0
+
+        # Note, this will give periods > 0 on weeks starting on
+        # start_date's day, rather than explicitly Sunday
+        start_date = self.semester.start_date
+        if last_updated is None:
+            last_weeks = 0
+        else:
+            last_weeks = (last_updated.date() - start_date).days // 7
+
+        sem_weeks = (moment.date() - start_date).days // 7
+        return (sem_weeks - last_weeks) // self.weeks_per_period
+
     def get_view_url(self):
         return wurl("workshift:view_pool", pk=self.pk, sem_url=self.semester.sem_url)
 
@@ -408,31 +441,23 @@ class PoolHours(models.Model):
         )
 
     def periods_since_last_update(self, moment=None):
+        return self.pool.periods_since(self.last_updated, moment=moment)
+
+    def get_standing(self, moment=None):
+        """
+        Finds this member's standing at a given point in time from the ledger
+        of changes to it.
+
+        Parameters
+        ----------
+        moment : datetime, optional
+            Defaults to the current standing.
+        """
         if moment is None:
-            moment = localtime(now())
-
-        periods_since = 0
-        semester = self.pool.semester
-
-        # Calculate the number of periods since we last updated the standings
-        if self.pool.weeks_per_period == 0:
-            # Only update this pool once
-            if self.last_updated is None:
-                periods_since = 1
-        else:
-            # Note, this will give periods > 0 on weeks starting on
-            # start_date's day, rather than explicitly Sunday
-            if self.last_updated is None:
-                last_weeks = 0
-            else:
-                last_delta = self.last_updated.date() - semester.start_date
-                last_weeks = last_delta.days // 7
-
-            sem_delta = moment.date() - semester.start_date
-            sem_weeks = sem_delta.days // 7
-            periods_since = (sem_weeks - last_weeks) // self.pool.weeks_per_period
-
-        return periods_since
+            return self.standing
+        return self.deltas.filter(timestamp__lte=moment).aggregate(
+            total=Sum("amount"),
+        )["total"] or 0
 
 
 class WorkshiftProfile(models.Model):
@@ -471,13 +496,27 @@ class WorkshiftProfile(models.Model):
         blank=True,
         help_text="Hours required for each workshift pool for this profile.",
     )
+    busy_slots = models.TextField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Bitmap of when this member is busy each week, built from "
+        "their time blocks.",
+    )
+    preferred_slots = models.TextField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Bitmap of when this member would prefer to work each "
+        "week, built from their time blocks.",
+    )
 
     def __str__(self):
         return self.__unicode__()
 
     def __unicode__(self):
         ret = self.user.get_full_name()
-        if UserProfile.objects.get(user=self.user).status == UserProfile.BOARDER:
+        if self.user.userprofile.status == UserProfile.BOARDER:
             ret += " (Boarder)"
         return ret
 
@@ -487,6 +526,38 @@ class WorkshiftProfile(models.Model):
     def is_workshift_profile(self):
         return True
 
+    def get_availability(self):
+        """
+        Returns the busy and preferred bitmaps for this profile (see
+        workshift.availability), rebuilding them if their time blocks have
+        changed since they were last built.
+        """
+        if self.busy_slots is None or self.preferred_slots is None:
+            self.update_availability()
+
+        return (
+            availability.from_string(self.busy_slots),
+            availability.from_string(self.preferred_slots),
+        )
+
+    def update_availability(self, time_blocks=None):
+        """
+        Rebuilds the busy and preferred bitmaps from this profile's time
+        blocks.
+        """
+        if time_blocks is None:
+            time_blocks = self.time_blocks.all()
+
+        busy, preferred = availability.build(time_blocks)
+        self.busy_slots = availability.to_string(busy)
+        self.preferred_slots = availability.to_string(preferred)
+
+        if self.pk:
+            WorkshiftProfile.objects.filter(pk=self.pk).update(
+                busy_slots=self.busy_slots,
+                preferred_slots=self.preferred_slots,
+            )
+
     def get_first(self):
         return self.user.first_name
 
@@ -741,6 +812,20 @@ class InstanceInfo(models.Model):
     )
 
 
+def _combine(day, value):
+    # Times on unsaved shifts may still be datetimes, the field only converts
+    # them once they are written to the database
+    if isinstance(value, datetime):
+        value = value.time()
+
+    value = datetime.combine(day, value)
+
+    if settings.USE_TZ:
+        value = make_aware(value, get_default_timezone())
+
+    return value
+
+
 class WorkshiftInstance(models.Model):
     """ An instance of a workshift. """
     semester = models.ForeignKey(
@@ -810,6 +895,21 @@ class WorkshiftInstance(models.Model):
         blank=True,
         help_text="The entries for sign ins, sign outs, and verification.",
     )
+    verify_deadline = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=True,
+        help_text="Time after which this shift can no longer be verified.",
+    )
+    sign_out_deadline = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=True,
+        help_text="Time after which workshifters can no longer sign out of "
+        "this shift.",
+    )
 
     def get_info(self):
         return self.weekly_workshift or self.info
@@ -857,7 +957,7 @@ class WorkshiftInstance(models.Model):
 
         super(WorkshiftInstance, self).__init__(*args, **kwargs)
 
-        if self.weekly_workshift is not None and self.info is not None:
+        if self.weekly_workshift_id is not None and self.info_id is not None:
             raise ValueError("Only one of [weekly_workshift, info] can be set")
 
     def __str__(self):
@@ -886,6 +986,41 @@ class WorkshiftInstance(models.Model):
             self.get_end_time(),
         )
 
+    def get_verify_deadline(self):
+        """
+        Calculates the time after which this shift can no longer be verified,
+        from the end of the shift and the pool's verify cutoff.
+        """
+        if self.get_info() is None or self.pool is None:
+            return None
+
+        if self.end_time is None:
+            end_datetime = _combine(
+                self.date + timedelta(days=1), time(23, 59),
+            )
+        else:
+            end_datetime = _combine(self.date, self.end_time)
+
+        return end_datetime + timedelta(hours=self.pool.verify_cutoff)
+
+    def get_sign_out_deadline(self):
+        """
+        Calculates the time after which workshifters can no longer sign out
+        of this shift, from the start of the shift and the pool's sign out
+        cutoff.
+        """
+        if self.get_info() is None or self.pool is None:
+            return None
+
+        start_datetime = _combine(self.date, self.start_time or time(0))
+
+        return start_datetime - timedelta(hours=self.pool.sign_out_cutoff)
+
+    def set_deadlines(self):
+        """ Updates verify_deadline and sign_out_deadline, without saving. """
+        self.verify_deadline = self.get_verify_deadline()
+        self.sign_out_deadline = self.get_sign_out_deadline()
+
     def is_workshift_instance(self):
         return True
 
@@ -895,4 +1030,70 @@ class WorkshiftInstance(models.Model):
     def get_edit_url(self):
         return wurl("workshift:edit_instance", pk=self.pk, sem_url=self.semester.sem_url)
 
+
+class StandingDelta(models.Model):
+    """
+    A single change to a member's standing in a pool. Rows are only ever
+    added, PoolHours.standing is kept as their running sum.
+    """
+    pool_hours = models.ForeignKey(
+        PoolHours,
+        related_name="deltas",
+        help_text="The pool hours whose standing changed.",
+    )
+    amount = models.DecimalField(
+        max_digits=5,
+        decimal_places=2,
+        help_text="Hours added to (or taken away from) the standing.",
+    )
+    instance = models.ForeignKey(
+        WorkshiftInstance,
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL,
+        related_name="standing_deltas",
+        help_text="The shift that caused this change, if any.",
+    )
+    VERIFIED = "V"
+    BLOWN = "B"
+    UNDONE = "U"
+    EDITED = "E"
+    DELETED = "D"
+    PERIOD = "P"
+    ADJUSTMENT = "A"
+    RESET = "R"
+    REASON_CHOICES = (
+        (VERIFIED, "Verified"),
+        (BLOWN, "Blown"),
+        (UNDONE, "Undone"),
+        (EDITED, "Hours Edited"),
+        (DELETED, "Shift Deleted"),
+        (PERIOD, "Period Requirement"),
+        (ADJUSTMENT, "Hour Adjustment"),
+        (RESET, "Recalculated"),
+    )
+    reason = models.CharField(
+        max_length=1,
+        choices=REASON_CHOICES,
+        help_text="Why the standing changed.",
+    )
+    timestamp = models.DateTimeField(
+        default=now,
+        help_text="When the standing changed.",
+    )
+
+    def __str__(self):
+        return self.__unicode__()
+
+    def __unicode__(self):
+        return "<{0}, {1}: {2}>".format(
+            self.pool_hours_id,
+            self.get_reason_display(),
+            self.amount,
+        )
+
+    class Meta:
+        ordering = ["timestamp"]
+        index_together = [["pool_hours", "timestamp"]]
+
 from workshift import signals
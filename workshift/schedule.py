@@ -0,0 +1,321 @@
+"""
+Project: Farnsworth
+
+Authors: Karandeep Singh Nagra and Nader Morshed
+
+The schedule of workshift instances shown on the semester page, serialized
+into rows and cached for each date.
+
+Every member looks at the same few days, which only change when an instance
+is signed in or out of, verified, blown or edited. The rows for each date are
+cached under that date's version, which is bumped whenever one of its
+instances changes, so that polling the schedule mostly just reads the cache.
+Changes to the shifts, types and pools behind the instances bump the version
+of the whole semester (or of every semester) instead.
+"""
+
+from __future__ import absolute_import
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db.models import Q
+
+from utils.versions import get_versions, bump_versions
+from workshift.models import WorkshiftInstance
+
+VERSION_KEY = "workshift-schedule-version"
+
+# Versions are never evicted on purpose, so the rows are only kept around for
+# long enough to be useful
+SCHEDULE_TIMEOUT = 24 * 60 * 60
+
+
+def get_week_range(start_date, end_date):
+    """
+    Finds the Monday before start_date and the Sunday after end_date, the
+    days between which week-long shifts are shown alongside those dates.
+    """
+    last_monday = start_date - timedelta(days=start_date.weekday())
+    next_sunday = end_date - timedelta(days=end_date.weekday() + 1) + \
+        timedelta(weeks=1)
+    return last_monday, next_sunday
+
+
+def get_schedule_instances(start_date, end_date, instances=None):
+    """
+    Splits the instances between two dates into those for each day and the
+    week-long ones for the weeks around them.
+
+    Parameters
+    ----------
+    start_date : datetime.date
+    end_date : datetime.date
+    instances : django.db.models.query.QuerySet, optional
+        Instances to pick from, i.e. with related objects selected. Defaults
+        to all instances.
+
+    Returns
+    -------
+    day_instances : django.db.models.query.QuerySet
+    week_instances : django.db.models.query.QuerySet
+    """
+    if instances is None:
+        instances = WorkshiftInstance.objects.all()
+
+    last_monday, next_sunday = get_week_range(start_date, end_date)
+    week_long = Q(weekly_workshift__week_long=True) | Q(info__week_long=True)
+
+    day_instances = instances.filter(
+        date__gte=start_date,
+        date__lte=end_date,
+    ).exclude(week_long)
+    week_instances = instances.filter(
+        week_long,
+        date__gte=last_monday,
+        date__lte=next_sunday,
+    )
+    return day_instances, week_instances
+
+
+# The columns of each set of rows from get_schedule_rows
+SCHEDULE_COLUMNS = (
+    "id", "title", "date", "start_time", "end_time", "hours", "pool",
+    "workshifter", "liable", "verifier", "closed", "blown",
+)
+
+
+def get_schedule_rows(instances, profiles=None):
+    """
+    Serializes instances for the semester page's schedule as columns, one list
+    for each of SCHEDULE_COLUMNS, so that the field names are only sent once.
+
+    Parameters
+    ----------
+    instances : list of workshift.models.WorkshiftInstance
+        With their types, pools and people already selected.
+    profiles : dict of int, str, optional
+        Filled in with the names of the people in instances.
+
+    Returns
+    -------
+    dict of str, list
+    """
+    def _time(value):
+        return value.strftime("%H:%M") if value else None
+
+    def _person(profile):
+        if profile is None:
+            return None
+        if profiles is not None:
+            profiles[profile.pk] = profile.user.get_full_name()
+        return profile.pk
+
+    columns = dict((name, []) for name in SCHEDULE_COLUMNS)
+
+    for instance in instances:
+        info = instance.get_info()
+        columns["id"].append(instance.pk)
+        columns["title"].append(instance.title)
+        columns["date"].append(instance.date.isoformat())
+        columns["start_time"].append(_time(info.start_time))
+        columns["end_time"].append(_time(info.end_time))
+        columns["hours"].append(str(instance.hours))
+        columns["pool"].append(info.pool_id)
+        columns["workshifter"].append(_person(instance.workshifter))
+        columns["liable"].append(_person(instance.liable))
+        columns["verifier"].append(_person(instance.verifier))
+        columns["closed"].append(instance.closed)
+        columns["blown"].append(instance.blown)
+
+    return columns
+
+
+def _get_version_key(semester_pk=None, day=None):
+    key = VERSION_KEY
+    if semester_pk is not None:
+        key += "-{0}".format(semester_pk)
+    if day is not None:
+        key += "-{0}".format(day.isoformat())
+    return key
+
+
+def invalidate_schedule(semester=None, dates=None):
+    """
+    Marks the cached schedule as out of date.
+
+    Parameters
+    ----------
+    semester : workshift.models.Semester or int, optional
+        The semester (or its primary key) that changed. If None, every
+        semester's schedule is invalidated.
+    dates : list of datetime.date, optional
+        The dates in semester that changed. If None, every date is.
+    """
+    semester_pk = getattr(semester, "pk", semester)
+    if semester_pk is None:
+        keys = [_get_version_key()]
+    elif dates is None:
+        keys = [_get_version_key(semester_pk)]
+    else:
+        keys = [
+            _get_version_key(semester_pk, day)
+            for day in set(dates)
+            if day is not None
+        ]
+
+    bump_versions(keys)
+
+
+def invalidate_instances(instances):
+    """
+    Invalidates the dates of instances that were changed in bulk, without
+    their signals being sent.
+
+    Parameters
+    ----------
+    instances : list of workshift.models.WorkshiftInstance
+    """
+    dates = defaultdict(set)
+    for instance in instances:
+        dates[instance.semester_id].add(instance.date)
+    for semester_pk, semester_dates in dates.items():
+        invalidate_schedule(semester_pk, semester_dates)
+
+
+def _get_instances(semester, dates):
+    return WorkshiftInstance.objects.filter(
+        semester=semester,
+        date__in=dates,
+    ).select_related(
+        "weekly_workshift__workshift_type",
+        "info",
+        "workshifter__user",
+        "liable__user",
+        "verifier__user",
+    ).order_by("date", "pk")
+
+
+def _merge_rows(rows, more_rows):
+    for name in SCHEDULE_COLUMNS:
+        rows[name].extend(more_rows[name])
+
+
+def get_schedule(semester, start_date, end_date):
+    """
+    Gets the rows of the semester page's schedule between two dates, using
+    the cached rows for each date where they are still current.
+
+    Parameters
+    ----------
+    semester : workshift.models.Semester
+    start_date : datetime.date
+    end_date : datetime.date
+
+    Returns
+    -------
+    dict
+        With the day and week-long rows (see get_schedule_rows) and the names
+        of everyone they refer to.
+    """
+    last_monday, next_sunday = get_week_range(start_date, end_date)
+    days = [
+        last_monday + timedelta(days=i)
+        for i in range((next_sunday - last_monday).days + 1)
+    ]
+
+    global_key = _get_version_key()
+    semester_key = _get_version_key(semester.pk)
+    day_keys = dict((day, _get_version_key(semester.pk, day)) for day in days)
+    versions = get_versions(
+        [global_key, semester_key] + list(day_keys.values()),
+    )
+
+    row_keys = dict(
+        (
+            day,
+            "workshift-schedule-{0}-{1}-{2}-{3}-{4}".format(
+                semester.pk, day.isoformat(), versions[global_key],
+                versions[semester_key], versions[day_keys[day]],
+            ),
+        )
+        for day in days
+    )
+    cached = cache.get_many(list(row_keys.values()))
+    by_day = dict(
+        (day, cached[key])
+        for day, key in row_keys.items()
+        if key in cached
+    )
+
+    # Build every date that was missing with one query
+    missing = [day for day in days if day not in by_day]
+    if missing:
+        instances = dict((day, ([], [])) for day in missing)
+        for instance in _get_instances(semester, missing):
+            instances[instance.date][int(bool(instance.week_long))] \
+                .append(instance)
+
+        new_rows = {}
+        for day, (day_instances, week_instances) in instances.items():
+            profiles = {}
+            by_day[day] = new_rows[row_keys[day]] = {
+                "day": get_schedule_rows(day_instances, profiles),
+                "week": get_schedule_rows(week_instances, profiles),
+                "profiles": profiles,
+            }
+        cache.set_many(new_rows, SCHEDULE_TIMEOUT)
+
+    schedule = {
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "day": dict((name, []) for name in SCHEDULE_COLUMNS),
+        "week": dict((name, []) for name in SCHEDULE_COLUMNS),
+        "profiles": {},
+    }
+    for day in days:
+        rows = by_day[day]
+        if start_date <= day <= end_date:
+            _merge_rows(schedule["day"], rows["day"])
+        _merge_rows(schedule["week"], rows["week"])
+        schedule["profiles"].update(rows["profiles"])
+
+    return schedule
+
+
+def record_schedule_date(sender, instance, **kwargs):
+    """
+    Remembers the date an instance was loaded with, so that moving it to
+    another date invalidates both.
+    """
+    instance._schedule_date = instance.date
+
+
+def instance_changed(sender, instance, **kwargs):
+    """
+    Invalidates the dates that an instance was and is on. Takes any arguments
+    so that it can be connected to model signals directly.
+    """
+    dates = [instance.date, getattr(instance, "_schedule_date", None)]
+    invalidate_schedule(instance.semester_id, dates)
+    instance._schedule_date = instance.date
+
+
+def semester_changed(sender, instance, **kwargs):
+    """
+    Invalidates the schedule of a shift's or pool's semester.
+    """
+    semester_pk = getattr(instance, "semester_id", None)
+    if semester_pk is None:
+        pool = getattr(instance, "pool", None)
+        semester_pk = pool.semester_id if pool is not None else None
+    if semester_pk is not None:
+        invalidate_schedule(semester_pk)
+
+
+def everything_changed(*args, **kwargs):
+    """
+    Invalidates the schedule of every semester.
+    """
+    invalidate_schedule()
@@ -1,22 +1,34 @@
 
 from __future__ import division, absolute_import
 
-from collections import defaultdict
+from functools import wraps
 
-from django.db.models import signals
+from django.db import transaction
+from django.db.models import signals, F, Q
 from django.dispatch import receiver
 from django.utils.timezone import now, localtime
 
-from notifications import notify
-
+from utils.navbar import invalidate_navbar_state
 from utils.variables import ANONYMOUS_USERNAME
 from managers.models import Manager
 from workshift.models import *
 from workshift.fields import DAY_CHOICES
-from workshift import utils
+from workshift import schedule, utils
+
+
+def _unless_suppressed(handler):
+    """
+    Skips a signal handler while utils.suppress_signals is in effect.
+    """
+    @wraps(handler)
+    def _handler(*args, **kwargs):
+        if not utils.signals_suppressed():
+            return handler(*args, **kwargs)
+    return _handler
 
 
 @receiver(signals.post_save, sender=UserProfile)
+@_unless_suppressed
 def create_workshift_profile(sender, instance, created, **kwargs):
     '''
     Function to add a workshift profile for every User that is created.
@@ -44,6 +56,7 @@ def create_workshift_profile(sender, instance, created, **kwargs):
 
 
 @receiver(signals.post_save, sender=WorkshiftPool)
+@_unless_suppressed
 def create_workshift_pool_hours(sender, instance, **kwargs):
     pool = instance
     utils.make_workshift_pool_hours(
@@ -53,59 +66,41 @@ def create_workshift_pool_hours(sender, instance, **kwargs):
 
 
 @receiver(signals.post_save, sender=Semester)
+@_unless_suppressed
 def initialize_semester(sender, instance, created, **kwargs):
-    if not created:
-        return
-
-    semester = instance
-    semester.workshift_managers = [
-        i.incumbent.user
-        for i in Manager.objects.filter(workshift_manager=True)
-    ]
-    semester.preferences_open = True
-    semester.save(update_fields=["preferences_open"])
-
-    # Set current to false for previous semesters
-    for prev_semester in Semester.objects.exclude(pk=semester.pk):
-        prev_semester.current = False
-        prev_semester.save(update_fields=["current"])
-
-    # Create the primary workshift pool
-    pool, created = WorkshiftPool.objects.get_or_create(
-        semester=semester,
-        is_primary=True,
-    )
     if created:
-        pool.managers = Manager.objects.filter(workshift_manager=True)
-
-    # Create this semester's workshift profiles
-    for uprofile in UserProfile.objects.filter(
-            status=UserProfile.RESIDENT,
-    ).exclude(user__username=ANONYMOUS_USERNAME):
-        WorkshiftProfile.objects.create(
-            user=uprofile.user,
-            semester=semester,
-        )
-
-    utils.make_workshift_pool_hours(semester=semester)
-    utils.make_manager_workshifts(semester=semester)
+        utils.bootstrap_semester(instance)
 
 
 @receiver(signals.pre_save, sender=WorkshiftPool)
+@_unless_suppressed
 def update_pool_hours(sender, instance, **kwargs):
     pool = instance
-    old_pool = None
 
-    if pool.id:
-        old_pool = sender.objects.get(pk=pool.id)
+    # New pools don't have any hours yet
+    if not pool.id:
+        return
+
+    old_pool = sender.objects.get(pk=pool.id)
+    if pool.hours == old_pool.hours:
+        return
+
+    # Members still on the pool's old requirement move to the new one
+    pks = list(PoolHours.objects.filter(
+        pool=pool, hours=old_pool.hours,
+    ).values_list("pk", flat=True))
+    if not pks:
+        return
 
-    for pool_hours in PoolHours.objects.filter(pool=pool):
-        if old_pool is None or pool_hours.hours == old_pool.hours:
-            pool_hours.hours = pool.hours
-            pool_hours.save(update_fields=["hours"])
+    PoolHours.objects.filter(pk__in=pks).update(hours=pool.hours)
+    if not utils.defer_recompute(
+            utils.recompute_standings, pool.semester_id, *pks
+    ):
+        utils.recompute_standings(pool.semester_id, pks)
 
 
 @receiver(signals.post_save, sender=WorkshiftPool)
+@_unless_suppressed
 def make_pool_hours(sender, instance, created, **kwargs):
     pool = instance
 
@@ -113,6 +108,22 @@ def make_pool_hours(sender, instance, created, **kwargs):
         utils.make_workshift_pool_hours(pool.semester, pools=[pool])
 
 
+@receiver(signals.post_save, sender=WorkshiftPool)
+@_unless_suppressed
+def update_pool_deadlines(sender, instance, created, update_fields=None,
+                          **kwargs):
+    pool = instance
+
+    if created:
+        return
+
+    if update_fields is None or \
+       set(["verify_cutoff", "sign_out_cutoff"]) & set(update_fields):
+        utils.update_deadlines(WorkshiftInstance.objects.filter(
+            Q(weekly_workshift__pool=pool) | Q(info__pool=pool),
+        ))
+
+
 def _check_field_changed(instance, old_instance, field_name, update_fields=None):
     """
     Examines update_fields and an attribute of an instance to determine if
@@ -132,6 +143,7 @@ def _check_field_changed(instance, old_instance, field_name, update_fields=None)
 
 
 @receiver(signals.post_save, sender=WorkshiftInstance)
+@_unless_suppressed
 def log_entry_create(sender, instance, created, **kwargs):
     if created:
         # Don't create the log until after the instance is created, we can't
@@ -146,7 +158,31 @@ def log_entry_create(sender, instance, created, **kwargs):
             )
 
 
+@receiver(signals.pre_save, sender=WorkshiftInstance)
+@_unless_suppressed
+def set_instance_deadlines(sender, instance, update_fields=None, **kwargs):
+    # Partial saves would not write the deadlines, so only recalculate them on
+    # full saves
+    if update_fields is None:
+        instance.set_deadlines()
+
+
+@receiver(signals.post_save, sender=InstanceInfo)
+@_unless_suppressed
+def update_info_deadlines(sender, instance, created, update_fields=None,
+                          **kwargs):
+    info = instance
+
+    if created:
+        return
+
+    if update_fields is None or \
+       set(["pool", "start_time", "end_time"]) & set(update_fields):
+        utils.update_deadlines(WorkshiftInstance.objects.filter(info=info))
+
+
 @receiver(signals.pre_save, sender=PoolHours)
+@_unless_suppressed
 def manual_hour_adjustment(sender, instance, update_fields=None, **kwargs):
     pool_hours = instance
 
@@ -164,25 +200,44 @@ def manual_hour_adjustment(sender, instance, update_fields=None, **kwargs):
         )
 
         if reset_hours:
-            # Reset and recalculate standings from all sources
-            utils.reset_standings(
-                semester=pool_hours.pool.semester,
-                pool_hours=[pool_hours],
-            )
+            # Reset and recalculate standings from all sources, once this
+            # save (and any others alongside it) is done if we can
+            semester_pk = pool_hours.pool.semester_id
+            if not utils.defer_recompute(
+                    utils.recompute_standings, semester_pk, pool_hours.pk,
+            ):
+                utils.reset_standings(
+                    semester=pool_hours.pool.semester,
+                    pool_hours=[pool_hours],
+                )
         elif reset_adjustment:
             change = pool_hours.hour_adjustment - old_pool_hours.hour_adjustment
-            pool_hours.standing += change
+            utils.adjust_standing(pool_hours, change, StandingDelta.ADJUSTMENT)
+            # Don't write back a standing that changed since it was loaded
+            pool_hours.standing = sender.objects.values_list(
+                "standing", flat=True,
+            ).get(pk=pool_hours.pk)
 
 
 @receiver(signals.post_save, sender=PoolHours)
+@_unless_suppressed
 def set_initial_standing(sender, instance, created, **kwargs):
     if created:
         pool_hours = instance
-        pool_hours.standing += pool_hours.hour_adjustment
-        pool_hours.save(update_fields=["standing"])
+        # Start the ledger from whatever standing the hours were created with
+        if pool_hours.standing:
+            StandingDelta.objects.create(
+                pool_hours=pool_hours,
+                amount=pool_hours.standing,
+                reason=StandingDelta.RESET,
+            )
+        utils.adjust_standing(
+            pool_hours, pool_hours.hour_adjustment, StandingDelta.ADJUSTMENT,
+        )
 
 
 @receiver(signals.pre_delete, sender=Semester)
+@_unless_suppressed
 def clear_semester(sender, instance, **kwargs):
     semester = instance
     WorkshiftInstance.objects.filter(semester=semester).delete()
@@ -192,6 +247,7 @@ def clear_semester(sender, instance, **kwargs):
 
 
 @receiver(signals.post_save, sender=Manager)
+@_unless_suppressed
 def create_manager_workshifts(sender, instance, created, **kwargs):
     manager = instance
     try:
@@ -202,13 +258,21 @@ def create_manager_workshifts(sender, instance, created, **kwargs):
         utils.make_manager_workshifts(semester=semester, managers=[manager])
 
 
+def _make_instances(shift):
+    if not utils.defer_recompute(
+            utils.recompute_instances, shift.pool.semester_id, shift.pk,
+    ):
+        utils.make_instances(shift.pool.semester, shifts=[shift])
+
+
 @receiver(signals.post_save, sender=RegularWorkshift)
+@_unless_suppressed
 def create_workshift_instances(sender, instance, created, **kwargs):
     shift = instance
     if shift.active:
         if created:
             # Make instances for newly created shifts
-            utils.make_instances(shift.pool.semester, shifts=[shift])
+            _make_instances(shift)
     else:
         WorkshiftInstance.objects.filter(
             weekly_workshift=shift,
@@ -216,7 +280,25 @@ def create_workshift_instances(sender, instance, created, **kwargs):
         ).delete()
 
 
+@receiver(signals.post_save, sender=RegularWorkshift)
+@_unless_suppressed
+def update_shift_deadlines(sender, instance, created, update_fields=None,
+                           **kwargs):
+    shift = instance
+
+    # New shifts have their instances made with the right deadlines already
+    if created:
+        return
+
+    if update_fields is None or \
+       set(["pool", "start_time", "end_time"]) & set(update_fields):
+        utils.update_deadlines(
+            WorkshiftInstance.objects.filter(weekly_workshift=shift),
+        )
+
+
 @receiver(signals.pre_delete, sender=RegularWorkshift)
+@_unless_suppressed
 def delete_workshift_instances(sender, instance, **kwargs):
     shift = instance
     instances = WorkshiftInstance.objects.filter(
@@ -253,117 +335,85 @@ def delete_workshift_instances(sender, instance, **kwargs):
 
 
 @receiver(signals.m2m_changed, sender=RegularWorkshift.current_assignees.through)
+@_unless_suppressed
 def update_assigned_hours(sender, instance, action, reverse, model, pk_set, **kwargs):
     shift = instance
 
-    if shift.active:
-        # Update workshifter assigned hours
-        if action in ["pre_remove", "pre_clear"]:
-            if not pk_set:
-                assignees = shift.current_assignees.all()
-            else:
-                assignees = WorkshiftProfile.objects.filter(pk__in=pk_set)
-
-            for assignee in assignees:
-                pool_hours = assignee.pool_hours.get(pool=shift.pool)
-                pool_hours.assigned_hours -= shift.hours
-                pool_hours.save(update_fields=["assigned_hours"])
+    if not shift.active:
+        return
 
-                notify.send(
-                    shift,
+    if action in ["pre_remove", "pre_clear"]:
+        # Take the shift's hours back from the members being removed
+        assignees = shift.current_assignees.select_related("user")
+        if pk_set:
+            assignees = assignees.filter(pk__in=pk_set)
+        assignees = list(assignees)
+
+        with transaction.atomic():
+            PoolHours.objects.filter(
+                workshiftprofile__in=assignees,
+                pool=shift.pool_id,
+            ).update(assigned_hours=F("assigned_hours") - shift.hours)
+
+            utils.send_notifications([
+                dict(
+                    sender=shift,
                     verb="You were removed from",
                     action_object=shift,
                     recipient=assignee.user,
                 )
+                for assignee in assignees
+            ])
 
-        elif action in ["post_add"]:
-            # Add shift's hours to current assignees
-            assignees = WorkshiftProfile.objects.filter(pk__in=pk_set)
-
-            for assignee in assignees:
-                pool_hours = assignee.pool_hours.get(pool=shift.pool)
-                pool_hours.assigned_hours += shift.hours
-                pool_hours.save(update_fields=["assigned_hours"])
-
-                notify.send(
-                    shift,
-                    verb="You were assigned to",
-                    action_object=shift,
-                    recipient=assignee.user,
-                )
+        invalidate_navbar_state()
 
+    elif action in ["post_remove", "post_clear"]:
+        # Unassign these people from any instances they were assigned to
         instances = WorkshiftInstance.objects.filter(
+            Q(workshifter__isnull=False) | Q(liable__isnull=False),
             weekly_workshift=shift,
             date__gte=localtime(now()).date(),
             closed=False,
-        ).order_by("date")
-        # Update instances
-        if action in ["post_remove", "post_clear"]:
-            # Unassign these people from any instances they were assigned to
-            for instance in instances:
-                liable = instance.workshifter or instance.liable
-                if liable is not None and \
-                   (not pk_set or liable.pk in pk_set):
-                    instance.workshifter = None
-                    instance.liable = None
-                    instance.save(update_fields=["workshifter", "liable"])
-
-                    instance.logs.add(
-                        ShiftLogEntry.objects.create(
-                            person=liable,
-                            entry_type=ShiftLogEntry.UNASSIGNED,
-                            note="Removed from the recurring shift.",
-                        )
-                    )
-
-        elif action in ["post_add"]:
-            # Assign these people to any instances of this shift if they are
-            # not assigned an instance on that day or have already signed out
-            # of one on that day
-            dates = defaultdict(set)
-            assignees = WorkshiftProfile.objects.filter(pk__in=pk_set)
-
-            for instance in instances:
-                # Check if member is assigned to shift
-                if instance.workshifter is not None:
-                    if instance.workshifter.pk in pk_set:
-                        dates[instance.workshifter.pk].add(instance.date)
-
-                # If an assignee already signed out of a shift on this day,
-                # don't re-assign them to it
-                signed_out = instance.logs.filter(
-                    person__pk__in=pk_set,
-                    entry_type=ShiftLogEntry.SIGNOUT,
-                )
-
-                for person in signed_out:
-                    dates[person.pk].add(instance.date)
-
-            for instance in instances.filter(workshifter__isnull=True):
-                # Find a member who is not yet assigned to an instance on this
-                # day and assign them to this one
-                for assignee in assignees:
-                    if instance.date in dates[assignee.pk]:
-                        continue
-
-                    instance.workshifter = assignee
-                    instance.liable = None
-                    instance.save(update_fields=["workshifter", "liable"])
-
-                    instance.logs.add(
-                        ShiftLogEntry.objects.create(
-                            person=instance.workshifter,
-                            entry_type=ShiftLogEntry.ASSIGNED,
-                            note="Assigned to the recurring shift.",
-                        )
-                    )
-
-                    dates[assignee.pk].add(instance.date)
-
-                    break
+        ).order_by("date", "pk")
+        if pk_set:
+            instances = instances.filter(
+                Q(workshifter__in=pk_set) |
+                Q(workshifter__isnull=True, liable__in=pk_set),
+            )
+        instances = list(instances)
+
+        with transaction.atomic():
+            WorkshiftInstance.objects.filter(
+                pk__in=[i.pk for i in instances],
+            ).update(workshifter=None, liable=None)
+
+            utils.bulk_create_logs([
+                (instance, ShiftLogEntry(
+                    person_id=instance.workshifter_id or instance.liable_id,
+                    entry_type=ShiftLogEntry.UNASSIGNED,
+                    note="Removed from the recurring shift.",
+                ))
+                for instance in instances
+            ])
+
+        invalidate_navbar_state()
+        schedule.invalidate_instances(instances)
+
+    elif action in ["post_add"]:
+        # Add shift's hours to the new assignees and assign them to any
+        # instances of this shift that they are not already working or signed
+        # out of that day
+        utils.bulk_assign_shifts(
+            [
+                (shift, assignee)
+                for assignee in WorkshiftProfile.objects.filter(pk__in=pk_set)
+            ],
+            added=True,
+        )
 
 
 @receiver(signals.pre_save, sender=RegularWorkshift)
+@_unless_suppressed
 def pre_process_shift(sender, instance, update_fields=None, **kwargs):
     shift = instance
 
@@ -377,22 +427,60 @@ def pre_process_shift(sender, instance, update_fields=None, **kwargs):
                 shift, old_shift, "active",
                 update_fields=update_fields,
         ):
-            utils.make_instances(shift.pool.semester, shifts=[shift])
+            _make_instances(shift)
 
 
 @receiver(signals.pre_delete, sender=WorkshiftInstance)
+@_unless_suppressed
 def subtract_instance_hours(sender, instance, **kwargs):
     # Subtract this workshift from a person's hours if necessary
-    if instance.closed and instance.workshifter:
-        pool_hours = instance.workshifter.pool_hours.get(pool=instance.pool)
-        pool_hours.standing -= instance.hours
-        pool_hours.save(update_fields=["standing"])
+    workshifter = instance.workshifter or instance.liable
+    if instance.closed and workshifter:
+        pool_hours = workshifter.pool_hours.get(pool=instance.pool)
+        # The instance is on its way out, so don't point the ledger at it
+        utils.adjust_standing(
+            pool_hours,
+            instance.hours if instance.blown else -instance.hours,
+            StandingDelta.DELETED,
+        )
 
     # Delete any associated information
     instance.logs.all().delete()
 
 
+def _clear_availability(profiles):
+    profiles.update(busy_slots=None, preferred_slots=None)
+
+
+@receiver(signals.m2m_changed, sender=WorkshiftProfile.time_blocks.through)
+@_unless_suppressed
+def time_blocks_changed(sender, instance, action, reverse, model, pk_set,
+                        **kwargs):
+    # Mark the profiles' availability as out of date, it will be rebuilt the
+    # next time that it is needed
+    if action not in ["post_add", "post_remove", "pre_clear"]:
+        return
+
+    if not reverse:
+        instance.busy_slots, instance.preferred_slots = None, None
+        _clear_availability(WorkshiftProfile.objects.filter(pk=instance.pk))
+    elif action == "pre_clear":
+        _clear_availability(WorkshiftProfile.objects.filter(
+            time_blocks=instance,
+        ))
+    else:
+        _clear_availability(WorkshiftProfile.objects.filter(pk__in=pk_set))
+
+
+@receiver(signals.post_save, sender=TimeBlock)
+@receiver(signals.pre_delete, sender=TimeBlock)
+@_unless_suppressed
+def time_block_changed(sender, instance, **kwargs):
+    _clear_availability(WorkshiftProfile.objects.filter(time_blocks=instance))
+
+
 @receiver(signals.pre_delete, sender=WorkshiftProfile)
+@_unless_suppressed
 def delete_associated_hours(sender, instance, **kwargs):
     profile = instance
 
@@ -402,5 +490,34 @@ def delete_associated_hours(sender, instance, **kwargs):
     profile.pool_hours.all().delete()
 
 
+# Semesters, profiles, standings, managers and upcoming shifts are all shown in
+# the navbar
+for model in [Semester, WorkshiftPool, WorkshiftProfile, PoolHours,
+              WorkshiftInstance]:
+    signals.post_save.connect(invalidate_navbar_state, sender=model)
+    signals.post_delete.connect(invalidate_navbar_state, sender=model)
+for through in [Semester.workshift_managers.through,
+                WorkshiftPool.managers.through]:
+    signals.m2m_changed.connect(invalidate_navbar_state, sender=through)
+
+# The cached schedule on the semester page shows instances, along with their
+# shifts' types, times and pools
+signals.post_init.connect(
+    schedule.record_schedule_date, sender=WorkshiftInstance,
+)
+signals.post_save.connect(schedule.instance_changed, sender=WorkshiftInstance)
+signals.post_delete.connect(
+    schedule.instance_changed, sender=WorkshiftInstance,
+)
+signals.m2m_changed.connect(
+    schedule.instance_changed, sender=WorkshiftInstance.logs.through,
+)
+for model in [WorkshiftPool, RegularWorkshift, InstanceInfo]:
+    signals.post_save.connect(schedule.semester_changed, sender=model)
+    signals.post_delete.connect(schedule.semester_changed, sender=model)
+signals.post_save.connect(schedule.everything_changed, sender=WorkshiftType)
+signals.post_delete.connect(schedule.everything_changed, sender=WorkshiftType)
+
+
 # TODO: Auto-notify manager and workshifter when they are >= 10 hours down
 # TODO: Auto-email central when workshifters are >= 15 hours down?
@@ -1,10 +1,14 @@
 
 from __future__ import absolute_import
 
-from datetime import timedelta
+from datetime import datetime, time, timedelta
+from StringIO import StringIO
 
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils.timezone import now, localtime
 
 from base.models import User, UserProfile, ProfileRequest
@@ -312,3 +316,267 @@ class TestMakeInstances(TestCase):
             ).count(),
             0,
         )
+
+
+class TestDeadlines(TestCase):
+    def setUp(self):
+        self.today = localtime(now()).date()
+        self.semester = Semester.objects.create(
+            year=self.today.year,
+            start_date=self.today,
+            end_date=self.today + timedelta(days=6),
+        )
+
+        self.pool = WorkshiftPool.objects.get(
+            semester=self.semester,
+            is_primary=True,
+        )
+        self.pool.verify_cutoff = 2
+        self.pool.sign_out_cutoff = 24
+        self.pool.save()
+
+        self.wtype = WorkshiftType.objects.create(
+            title="Test Posts",
+        )
+        self.shift = RegularWorkshift.objects.create(
+            workshift_type=self.wtype,
+            pool=self.pool,
+            day=self.today.weekday(),
+            start_time=time(10),
+            end_time=time(12),
+        )
+        self.info = InstanceInfo.objects.create(
+            title="One Time",
+            pool=self.pool,
+            start_time=time(14),
+            end_time=time(16),
+        )
+        self.once = WorkshiftInstance.objects.create(
+            info=self.info,
+            date=self.today,
+        )
+
+    def _check_deadlines(self):
+        for instance in WorkshiftInstance.objects.all():
+            self.assertEqual(
+                instance.get_verify_deadline(),
+                instance.verify_deadline,
+            )
+            self.assertEqual(
+                instance.get_sign_out_deadline(),
+                instance.sign_out_deadline,
+            )
+
+    def test_deadlines(self):
+        self._check_deadlines()
+
+        instance = WorkshiftInstance.objects.get(weekly_workshift=self.shift)
+        self.assertEqual(
+            localtime(instance.verify_deadline).replace(tzinfo=None),
+            datetime.combine(self.today, time(14)),
+        )
+        self.assertEqual(
+            localtime(instance.sign_out_deadline).replace(tzinfo=None),
+            datetime.combine(self.today - timedelta(days=1), time(10)),
+        )
+
+    def test_shift_edit(self):
+        self.shift.end_time = time(18)
+        self.shift.save()
+
+        self.info.start_time = None
+        self.info.save()
+
+        self._check_deadlines()
+
+    def test_pool_edit(self):
+        self.pool.verify_cutoff = 48
+        self.pool.save(update_fields=["verify_cutoff"])
+
+        self._check_deadlines()
+
+    def test_backfill(self):
+        WorkshiftInstance.objects.update(
+            verify_deadline=None, sign_out_deadline=None,
+        )
+
+        call_command("update_workshift_deadlines", stdout=StringIO())
+
+        self._check_deadlines()
+        self.assertEqual(
+            0,
+            WorkshiftInstance.objects.filter(
+                verify_deadline__isnull=True,
+            ).count(),
+        )
+
+
+class TestAssignees(TestCase):
+    def setUp(self):
+        self.today = localtime(now()).date()
+        self.semester = Semester.objects.create(
+            year=self.today.year,
+            start_date=self.today,
+            end_date=self.today + timedelta(weeks=4, days=-1),
+        )
+        self.pool = WorkshiftPool.objects.get(
+            semester=self.semester,
+            is_primary=True,
+        )
+        self.wtype = WorkshiftType.objects.create(title="Test Posts")
+
+        self.profiles = []
+        for username in ["u", "v"]:
+            User.objects.create_user(username=username)
+            self.profiles.append(WorkshiftProfile.objects.get(
+                user__username=username,
+            ))
+
+    def _make_shift(self, day, count=1):
+        return RegularWorkshift.objects.create(
+            workshift_type=self.wtype,
+            pool=WorkshiftPool.objects.get(pk=self.pool.pk),
+            day=day,
+            count=count,
+            hours=2,
+        )
+
+    def _assigned_hours(self, profile):
+        return PoolHours.objects.get(
+            workshiftprofile=profile, pool=self.pool,
+        ).assigned_hours
+
+    def test_add_remove(self):
+        shift = self._make_shift(self.today.weekday())
+        instances = list(WorkshiftInstance.objects.filter(
+            weekly_workshift=shift,
+        ).order_by("date"))
+        self.assertEqual(4, len(instances))
+
+        # Members who signed out of an instance are not put back on it
+        instances[1].logs.add(ShiftLogEntry.objects.create(
+            person=self.profiles[0],
+            entry_type=ShiftLogEntry.SIGNOUT,
+        ))
+
+        shift.current_assignees.add(*self.profiles)
+        self.assertEqual(2, self._assigned_hours(self.profiles[0]))
+        self.assertEqual(2, self._assigned_hours(self.profiles[1]))
+        self.assertEqual(
+            [self.profiles[0].pk, self.profiles[1].pk] +
+            [self.profiles[0].pk] * 2,
+            list(WorkshiftInstance.objects.filter(
+                weekly_workshift=shift,
+            ).order_by("date").values_list("workshifter", flat=True)),
+        )
+        self.assertEqual(
+            3,
+            ShiftLogEntry.objects.filter(
+                person=self.profiles[0],
+                entry_type=ShiftLogEntry.ASSIGNED,
+                workshiftinstance__weekly_workshift=shift,
+            ).count(),
+        )
+
+        shift.current_assignees.remove(self.profiles[0])
+        self.assertEqual(0, self._assigned_hours(self.profiles[0]))
+        self.assertEqual(2, self._assigned_hours(self.profiles[1]))
+        self.assertEqual(
+            [None, self.profiles[1].pk, None, None],
+            list(WorkshiftInstance.objects.filter(
+                weekly_workshift=shift,
+            ).order_by("date").values_list("workshifter", flat=True)),
+        )
+        self.assertEqual(
+            3,
+            ShiftLogEntry.objects.filter(
+                person=self.profiles[0],
+                entry_type=ShiftLogEntry.UNASSIGNED,
+                note="Removed from the recurring shift.",
+            ).count(),
+        )
+
+        shift.current_assignees.clear()
+        self.assertEqual(0, self._assigned_hours(self.profiles[1]))
+        self.assertEqual(
+            0,
+            WorkshiftInstance.objects.filter(
+                weekly_workshift=shift, workshifter__isnull=False,
+            ).count(),
+        )
+
+    def test_queries(self):
+        short_shift = self._make_shift(self.today.weekday())
+        self.semester.end_date += timedelta(weeks=12)
+        self.semester.save()
+        long_shift = self._make_shift(self.today.weekday())
+        self.assertLess(
+            WorkshiftInstance.objects.filter(
+                weekly_workshift=short_shift,
+            ).count(),
+            WorkshiftInstance.objects.filter(
+                weekly_workshift=long_shift,
+            ).count(),
+        )
+
+        def _count_queries(shift, method, *args):
+            with CaptureQueriesContext(connection) as queries:
+                getattr(shift.current_assignees, method)(*args)
+            return len(queries)
+
+        # The number of queries does not grow with the number of instances
+        for method, args in [
+                ("add", self.profiles),
+                ("remove", self.profiles[:1]),
+                ("clear", []),
+        ]:
+            self.assertEqual(
+                _count_queries(short_shift, method, *args),
+                _count_queries(long_shift, method, *args),
+            )
+
+    def test_clear_assignments(self):
+        shifts = [self._make_shift(day) for day in range(2)]
+        for shift in shifts:
+            shift.current_assignees.add(*self.profiles)
+        self.assertEqual(4, self._assigned_hours(self.profiles[0]))
+
+        out = StringIO()
+        call_command("clear_workshift_assignments", stdout=out)
+        self.assertIn("Cleared 4 assignments", out.getvalue())
+
+        for profile in self.profiles:
+            self.assertEqual(0, self._assigned_hours(profile))
+            self.assertEqual(
+                0,
+                profile.instance_workshifter.filter(closed=False).count(),
+            )
+        self.assertEqual(
+            0,
+            RegularWorkshift.current_assignees.through.objects.count(),
+        )
+
+    def test_reset_instances(self):
+        shift = self._make_shift(self.today.weekday(), count=2)
+        shift.current_assignees.add(*self.profiles)
+        WorkshiftInstance.objects.filter(weekly_workshift=shift).update(
+            workshifter=None,
+        )
+
+        out = StringIO()
+        call_command("reset_workshift_instances", stdout=out)
+        self.assertIn("Reset 8 instances in total.", out.getvalue())
+
+        for profile in self.profiles:
+            self.assertEqual(
+                4,
+                WorkshiftInstance.objects.filter(
+                    weekly_workshift=shift, workshifter=profile,
+                ).count(),
+            )
+            self.assertEqual(
+                4,
+                ShiftLogEntry.objects.filter(
+                    person=profile, note="Manager reset assignment.",
+                ).count(),
+            )
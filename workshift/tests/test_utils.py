@@ -3,14 +3,16 @@ from __future__ import absolute_import
 
 from datetime import time, date, timedelta
 
+from django.contrib.contenttypes.models import ContentType
 from django.test import TestCase
+from django.test.client import RequestFactory
 from django.utils.timezone import now, localtime
 
 from farnsworth import pre_fill
 from workshift.models import *
 from workshift.forms import *
 from workshift.cron import CollectBlownCronJob, UpdateWeeklyStandings
-from workshift import utils, signals
+from workshift import availability, utils, signals
 
 
 class TestUtils(TestCase):
@@ -151,11 +153,206 @@ class TestUtils(TestCase):
             PoolHours.objects.get(pool=self.p2).hours,
         )
 
+    def test_make_pool_hours_queries(self):
+        # Members who already have hours are left alone
+        self.assertEqual([], utils.make_workshift_pool_hours(self.semester))
+
+        def _count_queries(title):
+            with self.assertNumQueries(15):
+                pool = WorkshiftPool.objects.create(
+                    title=title,
+                    semester=self.semester,
+                )
+            return PoolHours.objects.filter(pool=pool).count()
+
+        self.assertEqual(1, _count_queries("Humor Shift"))
+        for i in range(5):
+            User.objects.create_user(username="u{0}".format(i))
+        self.assertEqual(6, _count_queries("Another Shift"))
+        for profile in WorkshiftProfile.objects.all():
+            self.assertEqual(4, profile.pool_hours.count())
+
     def test_can_manage(self):
-        pass
+        pool_user = User.objects.create_user(username="pm")
+        pool_manager = Manager.objects.create(
+            title="Pool Manager",
+            incumbent=UserProfile.objects.get(user=pool_user),
+        )
+        self.p2.managers = [pool_manager]
+        semester_user = User.objects.create_user(username="sm")
+        self.semester.workshift_managers.add(semester_user)
+        staff = User.objects.create_user(username="st")
+        staff.is_staff = True
+        staff.save()
+        other_semester = Semester.objects.create(
+            year=self.semester.year + 1,
+            start_date=self.semester.start_date,
+            end_date=self.semester.end_date,
+        )
+
+        for user, kwargs, expected in [
+                (self.u, {"semester": self.semester}, False),
+                (self.u, {"pool": self.p2, "any_pool": True}, False),
+                (pool_user, {"semester": self.semester}, False),
+                (pool_user, {"pool": self.p1}, False),
+                (pool_user, {"pool": self.p2}, True),
+                (pool_user, {"any_pool": True}, True),
+                (semester_user, {"semester": self.semester}, True),
+                (semester_user, {"semester": other_semester}, False),
+                (staff, {}, True),
+        ]:
+            self.assertEqual(expected, utils.can_manage(user, **kwargs))
+            self.assertEqual(
+                expected,
+                utils.Permissions(user).can_manage(**kwargs),
+            )
+
+        # Loaded once per request, then answered from memory
+        request = RequestFactory().get("/")
+        request.user = pool_user
+        with self.assertNumQueries(3):
+            permissions = utils.get_permissions(request)
+            self.assertIs(permissions, utils.get_permissions(request))
+            self.assertTrue(permissions.can_manage(pool=self.p2))
+            self.assertFalse(permissions.can_manage(semester=self.semester))
+        self.assertIsNot(
+            permissions,
+            utils.get_permissions(request, user=self.u),
+        )
 
     def test_is_available(self):
-        pass
+        shift = RegularWorkshift.objects.create(
+            workshift_type=WorkshiftType.objects.create(title="Dishes"),
+            pool=self.p1,
+            day=0,
+            start_time=time(10),
+            end_time=time(14),
+            hours=2,
+        )
+        self.assertTrue(utils.is_available(self.profile, shift))
+
+        self.profile.time_blocks.add(TimeBlock.objects.create(
+            preference=TimeBlock.BUSY,
+            day=0,
+            start_time=time(11, 30),
+            end_time=time(12, 10),
+        ))
+        self.assertFalse(utils.is_available(self.profile, shift))
+
+        # A free window of exactly the shift's hours is enough
+        self.profile.time_blocks.clear()
+        self.profile.time_blocks.add(TimeBlock.objects.create(
+            preference=TimeBlock.BUSY,
+            day=0,
+            start_time=time(8),
+            end_time=time(12),
+        ))
+        self.assertTrue(utils.is_available(self.profile, shift))
+
+        # Busy blocks on other days don't matter
+        self.profile.time_blocks.clear()
+        self.profile.time_blocks.add(TimeBlock.objects.create(
+            preference=TimeBlock.BUSY,
+            day=1,
+            start_time=time(0),
+            end_time=time(23, 59),
+        ))
+        self.assertTrue(utils.is_available(self.profile, shift))
+
+    def test_available_without_day(self):
+        shift = RegularWorkshift.objects.create(
+            workshift_type=WorkshiftType.objects.create(title="Pots"),
+            pool=self.p1,
+            start_time=time(10),
+            end_time=time(14),
+            hours=2,
+        )
+        self.assertIsNone(shift.day)
+        self.profile.time_blocks.add(TimeBlock.objects.create(
+            preference=TimeBlock.BUSY,
+            day=0,
+            start_time=time(0),
+            end_time=time(23, 59),
+        ))
+
+        self.assertRaises(
+            ValueError, availability.day_mask, None, time(10), time(14),
+        )
+        self.assertFalse(
+            availability.overlaps(-1, None, time(10), time(14)),
+        )
+        self.assertTrue(utils.is_available(self.profile, shift))
+
+        form = AssignShiftForm(semester=self.semester, instance=shift)
+        self.assertIn(
+            self.profile,
+            form.fields["current_assignees"].queryset,
+        )
+
+    def test_availability_rebuilt(self):
+        block = TimeBlock.objects.create(
+            preference=TimeBlock.BUSY,
+            day=2,
+            start_time=time(9),
+            end_time=time(10),
+        )
+        self.profile.time_blocks.add(block)
+        busy, preferred = WorkshiftProfile.objects.get(
+            pk=self.profile.pk,
+        ).get_availability()
+        self.assertTrue(availability.overlaps(busy, 2, time(9), time(10)))
+        self.assertEqual(0, preferred)
+
+        block.day = 3
+        block.save()
+        profile = WorkshiftProfile.objects.get(pk=self.profile.pk)
+        self.assertEqual(None, profile.busy_slots)
+        busy, preferred = profile.get_availability()
+        self.assertFalse(availability.overlaps(busy, 2, time(9), time(10)))
+        self.assertTrue(availability.overlaps(busy, 3, time(9), time(10)))
+
+        block.delete()
+        self.assertEqual(
+            (0, 0),
+            WorkshiftProfile.objects.get(
+                pk=self.profile.pk,
+            ).get_availability(),
+        )
+
+    def test_get_available_profiles(self):
+        other = WorkshiftProfile.objects.get(
+            user=User.objects.create_user(username="u2"),
+        )
+        busy = WorkshiftProfile.objects.get(
+            user=User.objects.create_user(username="u3"),
+        )
+        other.time_blocks.add(TimeBlock.objects.create(
+            preference=TimeBlock.PREFERRED,
+            day=4,
+            start_time=time(17),
+            end_time=time(20),
+        ))
+        busy.time_blocks.add(TimeBlock.objects.create(
+            preference=TimeBlock.BUSY,
+            day=4,
+            start_time=time(16),
+            end_time=time(21),
+        ))
+        shift = RegularWorkshift.objects.create(
+            workshift_type=WorkshiftType.objects.create(title="Cook"),
+            pool=self.p1,
+            day=4,
+            start_time=time(17),
+            end_time=time(20),
+            hours=3,
+        )
+
+        self.assertEqual(
+            [other, self.profile],
+            utils.get_available_profiles(
+                shift, WorkshiftProfile.objects.order_by("pk"),
+            ),
+        )
 
     def test_make_instances(self):
         wtype = WorkshiftType.objects.create(
@@ -201,6 +398,45 @@ class TestUtils(TestCase):
             set(i.date.weekday() for i in instances),
         )
 
+    def test_make_instances_multiple_slots(self):
+        """
+        Tests that make_instances fills each slot of a shift, only logs
+        assigned slots, and replaces any open instances.
+        """
+        wtype = WorkshiftType.objects.create(
+            title="Test Make Instances Slots",
+        )
+        shift = RegularWorkshift.objects.create(
+            workshift_type=wtype,
+            pool=self.p1,
+            day=2,
+            count=2,
+            hours=3,
+        )
+        shift.current_assignees = [self.profile]
+
+        instances = utils.make_instances(
+            semester=self.semester,
+            shifts=[shift],
+        )
+
+        self.assertEqual(
+            set(instances),
+            set(WorkshiftInstance.objects.filter(weekly_workshift=shift)),
+        )
+        self.assertEqual(0, len(instances) % 2)
+
+        assigned = [i for i in instances if i.workshifter == self.profile]
+        self.assertEqual(len(instances) // 2, len(assigned))
+        for instance in instances:
+            self.assertEqual(
+                1 if instance in assigned else 0,
+                instance.logs.filter(
+                    person=self.profile,
+                    entry_type=ShiftLogEntry.ASSIGNED,
+                ).count(),
+            )
+
     def test_collect_blown(self):
         utils.make_workshift_pool_hours()
         self.assertEqual(
@@ -300,6 +536,337 @@ class TestUtils(TestCase):
             utils.collect_blown(moment=moment),
         )
 
+    def test_collect_blown_standings(self):
+        utils.make_workshift_pool_hours()
+        moment = localtime(now().replace(
+            hour=20, minute=0, second=0, microsecond=0,
+        ))
+        past = moment - timedelta(days=1)
+
+        instances = [
+            WorkshiftInstance.objects.create(
+                info=InstanceInfo.objects.create(
+                    title="Shift {0}".format(index),
+                    pool=self.p1,
+                    end_time=time(12),
+                    verify=verify,
+                ),
+                date=past.date(),
+                workshifter=self.profile,
+                semester=self.semester,
+                hours=2,
+            )
+            for index, verify in enumerate(
+                [AUTO_VERIFY, AUTO_VERIFY, AUTO_VERIFY, SELF_VERIFY],
+            )
+        ]
+
+        self.assertEqual(
+            ([], instances[:3], instances[3:]),
+            utils.collect_blown(moment=moment),
+        )
+
+        pool_hours = self.profile.pool_hours.get(pool=self.p1)
+        self.assertEqual(4, pool_hours.standing)
+
+        for instance in instances:
+            instance = WorkshiftInstance.objects.get(pk=instance.pk)
+            self.assertEqual(True, instance.closed)
+            self.assertEqual(instance.verify == SELF_VERIFY, instance.blown)
+            self.assertEqual(
+                1,
+                instance.logs.filter(
+                    entry_type=ShiftLogEntry.BLOWN
+                    if instance.verify == SELF_VERIFY
+                    else ShiftLogEntry.VERIFY,
+                ).count(),
+            )
+
+        self.assertEqual(4, self.u.notifications.count())
+        self.assertEqual(
+            ([], [], []),
+            utils.collect_blown(moment=moment),
+        )
+
+
+    def test_reset_standings(self):
+        utils.make_workshift_pool_hours()
+        other = User.objects.create_user(username="o")
+        other_profile = WorkshiftProfile.objects.get(user=other)
+        past = localtime(now()).date() - timedelta(days=1)
+
+        for pool, hours, workshifter, liable, closed, blown in [
+                (self.p1, 2, self.profile, None, True, False),
+                (self.p1, 3, self.profile, None, True, True),
+                (self.p1, 1, other_profile, self.profile, True, True),
+                (self.p1, 5, self.profile, None, False, False),
+                (self.p2, 1, self.profile, None, True, False),
+        ]:
+            WorkshiftInstance.objects.create(
+                info=InstanceInfo.objects.create(title="Shift", pool=pool),
+                date=past,
+                workshifter=workshifter,
+                liable=liable,
+                closed=closed,
+                blown=blown,
+                hours=hours,
+            )
+
+        PoolHours.objects.filter(pool=self.p1).update(hour_adjustment=1)
+        PoolHours.objects.update(standing=100)
+
+        # Pool hours, profiles, one aggregate, the ledger totals, then the
+        # ledger corrections and an update for each of the three distinct
+        # standings inside a savepoint
+        with self.assertNumQueries(10):
+            utils.reset_standings(semester=self.semester)
+
+        def _get_standing(profile, pool):
+            hours = profile.pool_hours.get(pool=pool)
+            owed = hours.hours if pool.weeks_per_period == 0 else 0
+            return hours.standing + owed
+
+        self.assertEqual(1 + 2 - 3 - 1, _get_standing(self.profile, self.p1))
+        self.assertEqual(1 - 1, _get_standing(other_profile, self.p1))
+        self.assertEqual(1, _get_standing(self.profile, self.p2))
+        self.assertEqual(0, _get_standing(other_profile, self.p2))
+
+        # Changing one member's hours recomputes just their standing
+        hours = self.profile.pool_hours.get(pool=self.p2)
+        hours.hours = 3
+        hours.save()
+        self.assertEqual(1, _get_standing(self.profile, self.p2))
+        self.assertEqual(
+            1 - 1,
+            _get_standing(other_profile, self.p1),
+        )
+
+        # The ledger still adds up to every standing
+        for hours in PoolHours.objects.all():
+            self.assertEqual(hours.standing, hours.get_standing(now()))
+
+    def test_standing_ledger(self):
+        utils.make_workshift_pool_hours()
+        hours = self.profile.pool_hours.get(pool=self.p1)
+        start = now()
+
+        utils.adjust_standing(
+            hours, 2, StandingDelta.VERIFIED,
+            moment=start - timedelta(days=2),
+        )
+        utils.adjust_standing(
+            hours, -5, StandingDelta.PERIOD,
+            moment=start - timedelta(days=1),
+        )
+        utils.adjust_standing(hours, 0, StandingDelta.EDITED)
+
+        self.assertEqual(-3, hours.standing)
+        self.assertEqual(-3, PoolHours.objects.get(pk=hours.pk).standing)
+        self.assertEqual(2, hours.deltas.count())
+
+        self.assertEqual(0, hours.get_standing(start - timedelta(days=3)))
+        self.assertEqual(2, hours.get_standing(start - timedelta(days=2)))
+        self.assertEqual(-3, hours.get_standing(start))
+
+        other = self.profile.pool_hours.get(pool=self.p2)
+        with self.assertNumQueries(1):
+            standings = utils.get_standings(
+                [hours, other], start - timedelta(hours=36),
+            )
+        self.assertEqual({hours.pk: 2, other.pk: other.standing}, standings)
+
+    def test_update_standings(self):
+        self.p2.weeks_per_period = 0
+        self.p2.save()
+        other = User.objects.create_user(username="o")
+        other_profile = WorkshiftProfile.objects.get(user=other)
+        utils.make_workshift_pool_hours()
+
+        hours = self.profile.pool_hours.get(pool=self.p1)
+        hours.hours = 3
+        hours.save()
+
+        pool_hours = list(PoolHours.objects.all())
+        self.assertEqual(4, len(pool_hours))
+        starting = dict((i.pk, i.standing) for i in pool_hours)
+        moment = localtime(now()) + timedelta(weeks=2)
+
+        # Pools, members, the ledger and an update for each pool inside a
+        # savepoint
+        with self.assertNumQueries(7):
+            changed, elapsed = utils.update_standings(
+                semester=self.semester, moment=moment,
+            )
+        self.assertEqual(4, changed)
+        self.assertGreaterEqual(elapsed, 0)
+
+        for profile in [self.profile, other_profile]:
+            for pool, periods in [(self.p1, 2), (self.p2, 1)]:
+                hours = profile.pool_hours.get(pool=pool)
+                self.assertEqual(
+                    starting[hours.pk] - hours.hours * periods,
+                    hours.standing,
+                )
+                self.assertEqual(hours.standing, hours.get_standing(moment))
+                self.assertIsNotNone(hours.last_updated)
+
+        # Running again for the same period changes nothing
+        changed, elapsed = utils.update_standings(
+            semester=self.semester, moment=moment + timedelta(days=1),
+        )
+        self.assertEqual(0, changed)
+
+        # Instances that are passed in are updated in place
+        hours = self.profile.pool_hours.get(pool=self.p1)
+        standing = hours.standing
+        changed, elapsed = utils.update_standings(
+            semester=self.semester,
+            pool_hours=[hours],
+            moment=moment + timedelta(weeks=1),
+        )
+        self.assertEqual(1, changed)
+        self.assertEqual(standing - 3, hours.standing)
+        self.assertEqual(
+            hours.standing,
+            PoolHours.objects.get(pk=hours.pk).standing,
+        )
+
+    def test_deferred_recompute(self):
+        for i in range(3):
+            User.objects.create_user(username="u{0}".format(i))
+        PoolHours.objects.update(standing=100)
+        wtype = WorkshiftType.objects.create(title="Deferred Posts")
+        self.assertFalse(utils.defer_recompute(utils.recompute_standings, 0))
+
+        with utils.deferred_recompute():
+            for pool_hours in PoolHours.objects.filter(pool=self.p1):
+                pool_hours.hours = 3
+                pool_hours.save()
+
+            # Saving a pool moves everyone on its old requirement as well
+            self.p2.hours = 4
+            self.p2.save()
+
+            shift = RegularWorkshift.objects.create(
+                workshift_type=wtype,
+                pool=self.p1,
+                day=self.semester.start_date.weekday(),
+            )
+
+            # Nothing is recomputed until the end of the block
+            self.assertEqual(
+                set([100]),
+                set(PoolHours.objects.values_list("standing", flat=True)),
+            )
+            self.assertFalse(
+                WorkshiftInstance.objects.filter(weekly_workshift=shift),
+            )
+
+        self.assertEqual(
+            set([0]),
+            set(PoolHours.objects.values_list("standing", flat=True)),
+        )
+        self.assertEqual(
+            set([4]),
+            set(PoolHours.objects.filter(pool=self.p2)
+                .values_list("hours", flat=True)),
+        )
+        self.assertTrue(
+            WorkshiftInstance.objects.filter(weekly_workshift=shift),
+        )
+
+        # Work deferred in blocks that raise is thrown away with them
+        PoolHours.objects.update(standing=100)
+        try:
+            with utils.deferred_recompute():
+                self.p1.hours = 6
+                self.p1.save()
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(
+            set([100]),
+            set(PoolHours.objects.values_list("standing", flat=True)),
+        )
+
+    def test_get_pool_hours_matrix(self):
+        utils.make_workshift_pool_hours()
+        for i in range(3):
+            User.objects.create_user(username="o{0}".format(i))
+        pools = [self.p2, self.p1]
+
+        with self.assertNumQueries(2):
+            matrix = utils.get_pool_hours_matrix(self.semester, pools)
+            # Everything the tables show is already loaded
+            for profile, pool_hours in matrix:
+                profile.user.get_full_name()
+                for hours in pool_hours:
+                    hours.pool.title
+
+        self.assertEqual(4, len(matrix))
+        for profile, pool_hours in matrix:
+            self.assertEqual(
+                [profile.pool_hours.get(pool=pool) for pool in pools],
+                pool_hours,
+            )
+
+        profile = WorkshiftProfile.objects.get(user__username="o0")
+        profile.pool_hours.remove(profile.pool_hours.get(pool=self.p2))
+        matrix = utils.get_pool_hours_matrix(
+            self.semester, pools, profiles=[profile],
+        )
+        self.assertEqual(
+            [(profile, [None, profile.pool_hours.get(pool=self.p1)])],
+            matrix,
+        )
+
+    def test_snapshot_fine_dates(self):
+        other = User.objects.create_user(username="o")
+        other_profile = WorkshiftProfile.objects.get(user=other)
+        utils.make_workshift_pool_hours()
+        today = localtime(now()).date()
+
+        self.semester.rate = 10
+        self.semester.save()
+        self.p1.second_fine_date = today
+        self.p1.save()
+        self.p2.first_fine_date = today + timedelta(days=1)
+        self.p2.save()
+
+        PoolHours.objects.update(standing=-2)
+        PoolHours.objects.filter(
+            workshiftprofile=other_profile, pool=self.p1,
+        ).update(standing=1)
+
+        with self.assertNumQueries(4):
+            snapshots = utils.snapshot_fine_dates(semester=self.semester)
+        self.assertEqual(
+            [(self.p1, "second_date_standing", 1)],
+            snapshots,
+        )
+
+        hours = self.profile.pool_hours.get(pool=self.p1)
+        self.assertEqual(-20, hours.second_date_standing)
+        self.assertEqual(0, hours.first_date_standing)
+        self.assertEqual(
+            0,
+            other_profile.pool_hours.get(pool=self.p1).second_date_standing,
+        )
+        self.assertEqual(
+            0,
+            self.profile.pool_hours.get(pool=self.p2).first_date_standing,
+        )
+
+        with self.assertNumQueries(1):
+            report = utils.get_fines_report(self.semester)
+        self.assertEqual(4, len(report))
+        row = [
+            i for i in report
+            if i["username"] == self.u.username and i["pool"] == self.p1.title
+        ][0]
+        self.assertEqual(-20, row["second_date_standing"])
+        self.assertEqual(-2, row["standing"])
+
 
 class TestAssignment(TestCase):
     """
@@ -547,6 +1114,132 @@ class TestAssignment(TestCase):
             3,
         )
 
+    def test_auto_assign_greedy(self):
+        """
+        Assign shifts using the round-robin strategy.
+        """
+        shift1 = RegularWorkshift.objects.create(
+            workshift_type=self.wtype1,
+            pool=self.p1,
+            hours=2,
+        )
+        shift2 = RegularWorkshift.objects.create(
+            workshift_type=self.wtype1,
+            pool=self.p1,
+            hours=3,
+        )
+
+        unfinished = utils.auto_assign_shifts(
+            self.semester, strategy=utils.AUTO_ASSIGN_GREEDY,
+        )
+        self.assertEqual([], unfinished)
+        self.assertIn(self.profile, shift1.current_assignees.all())
+        self.assertIn(self.profile, shift2.current_assignees.all())
+
+        self.assertRaises(
+            ValueError,
+            utils.auto_assign_shifts, self.semester, strategy="unknown",
+        )
+
+    def test_auto_assign_best_fit(self):
+        """
+        Assign shifts so that a member who is happy with either shift does not
+        take the only shift that another member likes.
+        """
+        other = WorkshiftProfile.objects.get(
+            user=User.objects.create_user(username="u1"),
+            semester=self.semester,
+        )
+        other.ratings = [
+            WorkshiftRating.objects.create(
+                rating=WorkshiftRating.LIKE,
+                workshift_type=self.wtype3,
+            ),
+            WorkshiftRating.objects.create(
+                rating=WorkshiftRating.DISLIKE,
+                workshift_type=self.wtype1,
+            ),
+        ]
+        self.profile.ratings.add(WorkshiftRating.objects.create(
+            rating=WorkshiftRating.LIKE,
+            workshift_type=self.wtype3,
+        ))
+        self.profile.ratings.remove(
+            self.profile.ratings.get(workshift_type=self.wtype3,
+                                     rating=WorkshiftRating.DISLIKE),
+        )
+        utils.make_workshift_pool_hours(semester=self.semester)
+
+        shift1 = RegularWorkshift.objects.create(
+            workshift_type=self.wtype1,
+            pool=self.p1,
+            hours=5,
+        )
+        shift3 = RegularWorkshift.objects.create(
+            workshift_type=self.wtype3,
+            pool=self.p1,
+            hours=5,
+        )
+
+        # Everything is loaded and saved in bulk, so this shouldn't grow with
+        # the number of members or shifts
+        utils.load_availability(WorkshiftProfile.objects.all())
+        ContentType.objects.clear_cache()
+        with self.assertNumQueries(25):
+            unfinished = utils.auto_assign_shifts(self.semester)
+
+        self.assertEqual([], unfinished)
+        self.assertEqual([self.profile], list(shift1.current_assignees.all()))
+        self.assertEqual([other], list(shift3.current_assignees.all()))
+
+        for profile in [self.profile, other]:
+            pool_hours = profile.pool_hours.get(pool=self.p1)
+            self.assertEqual(pool_hours.hours, pool_hours.assigned_hours)
+
+    def test_auto_assign_best_fit_preferred(self):
+        """
+        Assign a shift to the member who prefers to work at its time over an
+        equally happy member who would only be available.
+        """
+        other = WorkshiftProfile.objects.get(
+            user=User.objects.create_user(username="u1"),
+            semester=self.semester,
+        )
+        other.ratings = [
+            WorkshiftRating.objects.create(
+                rating=WorkshiftRating.LIKE,
+                workshift_type=self.wtype1,
+            ),
+        ]
+        utils.make_workshift_pool_hours(semester=self.semester)
+
+        shift = RegularWorkshift.objects.create(
+            workshift_type=self.wtype1,
+            pool=self.p1,
+            day=0,
+            start_time=time(9),
+            end_time=time(14),
+            hours=5,
+        )
+
+        for profile, preferred in [
+                (other, self.profile),
+                (self.profile, other),
+        ]:
+            shift.current_assignees.clear()
+            PoolHours.objects.update(assigned_hours=0)
+            preferred.time_blocks.add(TimeBlock.objects.create(
+                preference=TimeBlock.PREFERRED,
+                day=0,
+                start_time=time(8),
+                end_time=time(15),
+            ))
+            profile.time_blocks.clear()
+
+            utils.auto_assign_shifts(self.semester)
+
+            self.assertEqual([preferred], list(shift.current_assignees.all()))
+
     def _test_auto_assign_fifty(self):
         """
         Assign fifty members to fifty shifts, with each shift providing 5 hours
@@ -614,6 +1307,52 @@ class TestAssignment(TestCase):
         unfinished = utils.auto_assign_shifts(self.semester)
         self.assertEqual([], unfinished)
 
+    def test_randomly_assign_instances(self):
+        for i in range(1, 4):
+            User.objects.create_user(username="u{0}".format(i))
+        utils.make_workshift_pool_hours(semester=self.semester)
+        PoolHours.objects.filter(pool=self.p2).update(hours=2)
+        info = InstanceInfo.objects.create(title="Odd Job", pool=self.p2)
+        for day in range(7):
+            for i in range(2):
+                WorkshiftInstance.objects.create(
+                    info=info,
+                    date=self.semester.start_date + timedelta(days=day),
+                    hours=1,
+                )
+
+        def _assign(seed):
+            WorkshiftInstance.objects.update(workshifter=None)
+            with self.assertNumQueries(17):
+                profiles, instances = utils.randomly_assign_instances(
+                    self.semester, self.p2, seed=seed,
+                )
+            return profiles, instances, dict(
+                (instance.pk, instance.workshifter_id)
+                for instance in WorkshiftInstance.objects.all()
+            )
+
+        profiles, instances, assigned = _assign(1)
+        self.assertEqual([], profiles)
+        self.assertEqual(6, len(instances))
+
+        # Everyone is given enough hours, on different days
+        for profile in WorkshiftProfile.objects.filter(semester=self.semester):
+            dates = WorkshiftInstance.objects.filter(
+                workshifter=profile,
+            ).values_list("date", flat=True)
+            self.assertEqual(2, len(dates))
+            self.assertEqual(2, len(set(dates)))
+            self.assertEqual(
+                2,
+                ShiftLogEntry.objects.filter(
+                    person=profile, note="Randomly assigned.",
+                ).count(),
+            )
+
+        # The same seed makes the same assignments
+        self.assertEqual(assigned, _assign(1)[2])
+
     def _test_pre_fill_and_assign_humor(self):
         """
         Tests that humor shifts can be correctly assigned after
@@ -2,10 +2,17 @@
 from __future__ import absolute_import
 
 from datetime import timedelta, time, date
+from decimal import Decimal
+import json
+import shutil
+import tempfile
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.utils.timezone import now, localtime
 
 from base.models import User, UserProfile
@@ -16,6 +23,7 @@ from workshift.fill import REGULAR_WORKSHIFTS, WEEK_LONG, HUMOR_WORKSHIFTS, \
 from workshift.models import *
 from workshift.forms import *
 from workshift.fields import DAY_CHOICES
+from workshift import schedule, utils
 
 
 class TestPermissions(TestCase):
@@ -347,6 +355,71 @@ class TestStart(TestCase):
         # well
         semester.delete()
 
+    def test_bootstrap(self):
+        today = localtime(now()).date()
+
+        def _bootstrap():
+            semester = Semester(
+                year=today.year,
+                season=Semester.SUMMER,
+                start_date=today,
+                end_date=today + timedelta(weeks=18),
+            )
+            with CaptureQueriesContext(connection) as queries:
+                timings = utils.bootstrap_semester(
+                    semester, pools=[WorkshiftPool(title="Humor Shift")],
+                )
+            self.assertEqual(
+                ["semester", "pools", "profiles", "pool_hours",
+                 "manager_shifts"],
+                [stage for stage, seconds in timings],
+            )
+            return semester, len(queries)
+
+        semester, count = _bootstrap()
+        self.assertTrue(semester.preferences_open)
+        self.assertEqual([self.wu], list(semester.workshift_managers.all()))
+        self.assertEqual(
+            2,
+            WorkshiftPool.objects.filter(semester=semester).count(),
+        )
+        for profile in WorkshiftProfile.objects.filter(semester=semester):
+            self.assertEqual(
+                ["Humor Shift", "Regular Workshift"],
+                sorted(profile.pool_hours.values_list("pool__title", flat=True)),
+            )
+
+        # Manager shifts are assigned to the managers
+        shift = RegularWorkshift.objects.get(
+            pool__semester=semester, workshift_type__title=self.wm.title,
+        )
+        profile = WorkshiftProfile.objects.get(user=self.wu, semester=semester)
+        self.assertEqual([profile], list(shift.current_assignees.all()))
+        self.assertGreater(
+            WorkshiftInstance.objects.filter(
+                weekly_workshift=shift, workshifter=profile,
+            ).count(),
+            0,
+        )
+        self.assertEqual(
+            shift.hours,
+            profile.pool_hours.get(pool=shift.pool).assigned_hours,
+        )
+
+        # The number of queries does not grow with the number of residents,
+        # once the manager shifts' types exist
+        semester.delete()
+        semester, count = _bootstrap()
+        semester.delete()
+        for i in range(5):
+            User.objects.create_user(username="extra{0}".format(i))
+        semester, more_count = _bootstrap()
+        self.assertEqual(
+            7,
+            WorkshiftProfile.objects.filter(semester=semester).count(),
+        )
+        self.assertEqual(count, more_count)
+
 
 class TestViews(TestCase):
     """
@@ -737,6 +810,253 @@ class TestViews(TestCase):
             response,
             self.pool.title,
             )
+        self.assertContains(response, reverse("workshift:fines_report"))
+
+    def test_fines_report(self):
+        hours = self.wprofile.pool_hours.get(pool=self.pool)
+        hours.first_date_standing = -13
+        hours.save(update_fields=["first_date_standing"])
+
+        url = reverse("workshift:fines_report")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual("text/csv", response["Content-Type"])
+        lines = response.content.splitlines()
+        self.assertEqual(",".join(utils.FINES_REPORT_COLUMNS), lines[0])
+        line = [i for i in lines if i.startswith("wu,")][0]
+        self.assertIn("wu,Cooperative,User,{0},".format(self.pool.title), line)
+        self.assertEqual(-13, Decimal(line.split(",")[5]))
+
+        response = self.client.get(url, {"format": "json"})
+        self.assertEqual(response.status_code, 200)
+        rows = json.loads(response.content)
+        row = [i for i in rows if i["username"] == "wu"][0]
+        self.assertEqual(self.pool.title, row["pool"])
+        self.assertEqual(-13, Decimal(str(row["first_date_standing"])))
+
+    def test_schedule(self):
+        url = reverse("workshift:schedule")
+        today = localtime(now()).date()
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual("application/json", response["Content-Type"])
+        data = json.loads(response.content)
+        self.assertEqual(today.isoformat(), data["start_date"])
+        self.assertEqual(
+            sorted(schedule.SCHEDULE_COLUMNS),
+            sorted(data["day"]),
+        )
+
+        index = data["day"]["id"].index(self.instance.pk)
+        self.assertEqual(self.wtype.title, data["day"]["title"][index])
+        self.assertEqual(self.wprofile.pk, data["day"]["workshifter"][index])
+        self.assertFalse(data["day"]["closed"][index])
+        self.assertEqual(
+            "Cooperative User",
+            data["profiles"][str(self.wprofile.pk)],
+        )
+        self.assertNotIn(self.once.pk, data["day"]["id"])
+
+        # Unchanged schedules are not sent again
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(url, {
+            "start_date": today.isoformat(),
+            "end_date": (today + timedelta(days=7)).isoformat(),
+        })
+        self.assertIn(self.once.pk, json.loads(response.content)["day"]["id"])
+
+        response = self.client.get(url, {
+            "start_date": today.isoformat(),
+            "end_date": (today - timedelta(days=1)).isoformat(),
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_schedule_action(self):
+        info = InstanceInfo.objects.create(title="Open Shift", pool=self.pool)
+        instance = WorkshiftInstance.objects.create(
+            info=info,
+            date=localtime(now()).date(),
+        )
+        url = reverse(
+            "workshift:schedule_action",
+            kwargs={"pk": instance.pk, "action": SignInForm.action_name},
+        )
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 405)
+
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 200)
+        row = json.loads(response.content)["row"]
+        self.assertEqual([instance.pk], row["id"])
+        self.assertEqual([self.wprofile.pk], row["workshifter"])
+        self.assertEqual(
+            self.wprofile,
+            WorkshiftInstance.objects.get(pk=instance.pk).workshifter,
+        )
+
+        # The schedule shows the change
+        data = json.loads(
+            self.client.get(reverse("workshift:schedule")).content
+        )
+        index = data["day"]["id"].index(instance.pk)
+        self.assertEqual(self.wprofile.pk, data["day"]["workshifter"][index])
+
+        # Can't sign in twice
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 403)
+
+        response = self.client.post(reverse(
+            "workshift:schedule_action",
+            kwargs={"pk": instance.pk, "action": SignOutForm.action_name},
+        ))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([None], json.loads(response.content)["row"]["workshifter"])
+
+        response = self.client.post(reverse(
+            "workshift:schedule_action",
+            kwargs={"pk": instance.pk, "action": "delete"},
+        ))
+        self.assertEqual(response.status_code, 404)
+
+    def test_schedule_cache(self):
+        today = localtime(now()).date()
+        tomorrow = today + timedelta(days=1)
+
+        def _get_schedule():
+            with CaptureQueriesContext(connection) as queries:
+                data = schedule.get_schedule(self.sem, today, tomorrow)
+            return data, len(queries)
+
+        def _check_schedule():
+            cache.clear()
+            data, count = _get_schedule()
+            self.assertGreater(count, 0)
+            self.assertIn(self.instance.pk, data["day"]["id"])
+
+            # Unchanged dates are read from the cache
+            self.assertEqual((data, 0), _get_schedule())
+
+            self.instance.workshifter = None
+            self.instance.save()
+            data, count = _get_schedule()
+            self.assertGreater(count, 0)
+            index = data["day"]["id"].index(self.instance.pk)
+            self.assertIsNone(data["day"]["workshifter"][index])
+
+            # Instances moved off of a date are removed from it
+            self.instance.date = today + timedelta(days=2)
+            self.instance.save()
+            data, count = _get_schedule()
+            self.assertNotIn(self.instance.pk, data["day"]["id"])
+
+            # As are changes to the shifts behind the instances
+            self.wtype.title = "Renamed Posts"
+            self.wtype.save()
+            self.instance.date = today
+            self.instance.save()
+            data, count = _get_schedule()
+            index = data["day"]["id"].index(self.instance.pk)
+            self.assertEqual("Renamed Posts", data["day"]["title"][index])
+
+            # And to instances changed in bulk
+            utils.make_instances(self.sem, [self.shift])
+            data, count = _get_schedule()
+            self.assertNotIn(self.instance.pk, data["day"]["id"])
+            new = WorkshiftInstance.objects.get(
+                weekly_workshift=self.shift, date=today,
+            )
+            self.assertIn(new.pk, data["day"]["id"])
+
+            self.instance = new
+            self.wtype.title = "Test Posts"
+            self.wtype.save()
+
+        _check_schedule()
+
+        # Caches shared between processes have to give the same results
+        location = tempfile.mkdtemp()
+        try:
+            with override_settings(CACHES={
+                    "default": {
+                        "BACKEND":
+                        "django.core.cache.backends.filebased.FileBasedCache",
+                        "LOCATION": location,
+                    },
+            }):
+                _check_schedule()
+        finally:
+            shutil.rmtree(location)
+
+    def test_semester_queries(self):
+        url = reverse("workshift:view_semester")
+        today = localtime(now()).date()
+
+        def _count_queries():
+            self.client.get(url)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            return len(queries), len(response.context["day_shifts"])
+
+        before, shifts = _count_queries()
+
+        other = WorkshiftProfile.objects.get(user=self.u)
+        info = InstanceInfo.objects.create(
+            title="Another One Time Shift",
+            pool=self.pool,
+            verify=POOL_MANAGER_VERIFY,
+        )
+        for workshifter, liable, verifier, blown in [
+                (self.wprofile, None, None, False),
+                (other, None, None, False),
+                (None, other, None, False),
+                (other, None, self.wprofile, False),
+                (other, None, None, True),
+        ]:
+            instance = WorkshiftInstance.objects.create(
+                info=info,
+                date=today,
+                workshifter=workshifter,
+                liable=liable,
+                verifier=verifier,
+                blown=blown,
+                closed=bool(verifier) or blown,
+            )
+            instance.logs = [self.sle4]
+        self.shift.current_assignees = [self.wprofile, other]
+
+        after, more_shifts = _count_queries()
+        self.assertEqual(shifts + 5, more_shifts)
+        self.assertEqual(before, after)
+
+    def test_workshifter_table_queries(self):
+        urls = [
+            reverse("workshift:manage"),
+            reverse("workshift:profiles"),
+            reverse("workshift:adjust_hours"),
+            reverse("workshift:fine_date"),
+            reverse("workshift:assign_shifts"),
+        ]
+        WorkshiftPool.objects.create(title="Other Pool", semester=self.sem)
+
+        def _count_queries():
+            counts = []
+            for url in urls:
+                self.client.get(url)
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                counts.append(len(queries))
+            return counts
+
+        before = _count_queries()
+        for i in range(5):
+            User.objects.create_user(username="extra{0}".format(i))
+        self.assertEqual(before, _count_queries())
 
 
 class TestPreferences(TestCase):
@@ -21,6 +21,16 @@ urlpatterns = [
         views.semester_info_view,
         name="semester_info",
     ),
+    url(
+        base + r"/schedule/$",
+        views.schedule_view,
+        name="schedule",
+    ),
+    url(
+        base + r"/schedule/(?P<pk>\d+)/(?P<action>\w+)/$",
+        views.schedule_action_view,
+        name="schedule_action",
+    ),
     url(
         base + r"/open/$",
         views.open_shifts_view,
@@ -94,6 +104,11 @@ urlpatterns = [
         views.fine_date_view,
         name="fine_date",
     ),
+    url(
+        base + r"/manage/fines/$",
+        views.fines_report_view,
+        name="fines_report",
+    ),
     url(
         base + r"/pool/(?P<pk>\d+)/$",
         views.pool_view,
@@ -4,21 +4,30 @@ Project: Farnsworth
 Authors: Karandeep Singh Nagra and Nader Morshed
 """
 
-from __future__ import division
+from __future__ import division, absolute_import
 
-from collections import defaultdict
-from datetime import date, timedelta, time, datetime
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+from datetime import date, timedelta
+from heapq import heappop, heappush
 from itertools import cycle
 import random
+import threading
+from timeit import default_timer
+import uuid
 
-from django.conf import settings
-from django.db.models import Q
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import F, Max, Q, Sum
 from django.utils.timezone import now, localtime
 
-from notifications import notify
-from pytz import timezone
+from notifications.models import Notification
 
 from managers.models import Manager
+from utils.navbar import invalidate_navbar_state
+from utils.variables import ANONYMOUS_USERNAME
+from workshift import availability
+from workshift.schedule import invalidate_instances, invalidate_schedule
 from workshift.models import *
 
 
@@ -47,6 +56,90 @@ def can_manage(user, semester=None, pool=None, any_pool=False):
     return user.is_superuser or user.is_staff
 
 
+class Permissions(object):
+    """
+    Everything that decides what a user is allowed to manage in workshift,
+    loaded with a few queries up front and then answered from memory. Use
+    get_permissions to share one between everything that handles a request.
+
+    Attributes
+    ----------
+    managers : set of int
+        The primary keys of the user's manager positions.
+    workshift_manager : bool
+        Whether any of those positions is a workshift manager.
+    pools : set of int
+        The primary keys of the pools managed by any of those positions.
+    semesters : set of int
+        The primary keys of the semesters that list the user as a workshift
+        manager.
+    """
+    def __init__(self, user):
+        self.user = user
+        self.admin = user.is_superuser or user.is_staff
+        self.managers, self.pools, self.semesters = set(), set(), set()
+        self.workshift_manager = False
+
+        if user.pk is None:
+            return
+
+        managers = dict(
+            Manager.objects.filter(incumbent__user=user)
+            .values_list("pk", "workshift_manager")
+        )
+        self.managers = set(managers)
+        self.workshift_manager = any(managers.values())
+
+        if self.managers:
+            self.pools = set(
+                WorkshiftPool.objects.filter(
+                    managers__pk__in=self.managers,
+                ).values_list("pk", flat=True)
+            )
+
+        self.semesters = set(
+            Semester.workshift_managers.through.objects.filter(
+                user=user,
+            ).values_list("semester", flat=True)
+        )
+
+    def can_manage(self, semester=None, pool=None, any_pool=False):
+        """
+        Same as can_manage, for this user.
+        """
+        if semester and semester.pk in self.semesters:
+            return True
+
+        if self.workshift_manager:
+            return True
+
+        if pool and pool.pk in self.pools:
+            return True
+
+        if any_pool and self.pools:
+            return True
+
+        return self.admin
+
+
+def get_permissions(request, user=None):
+    """
+    Gets the Permissions for a user (by default, the one making the request),
+    loading them at most once per request.
+
+    Parameters
+    ----------
+    request : django.http.HttpRequest
+    user : django.contrib.auth.models.User, optional
+    """
+    if user is None:
+        user = request.user
+    permissions = request.__dict__.setdefault("_workshift_permissions", {})
+    if user.pk not in permissions:
+        permissions[user.pk] = Permissions(user)
+    return permissions[user.pk]
+
+
 def get_year_season(day=None):
     """
     Returns a guess of the year and season of the current semester.
@@ -92,21 +185,117 @@ def _date_range(start, end, step):
         start += step
 
 
+def bulk_create_logs(pairs):
+    """
+    Creates many log entries and attaches them to their workshift instances
+    using a fixed number of queries (plus one per distinct note), without
+    relying on per-row signals.
+
+    Parameters
+    ----------
+    pairs : list of (workshift.models.WorkshiftInstance,
+                     workshift.models.ShiftLogEntry)
+        The instances must already be saved, the log entries must not be.
+
+    Returns
+    -------
+    list of workshift.models.ShiftLogEntry
+    """
+    if not pairs:
+        return []
+
+    entries = [entry for instance, entry in pairs]
+
+    # bulk_create does not set primary keys, so we fetch the new rows back.
+    # To be sure we only pick up rows from this call, and not ones made at the
+    # same time by someone else, the rows are saved with a note unique to this
+    # call, which is swapped for the real note once they have been found.
+    token = "bulk-{0}:".format(uuid.uuid4().hex)
+    markers = OrderedDict()
+    for entry in entries:
+        markers.setdefault(entry.note, token + str(len(markers)))
+
+    with transaction.atomic():
+        last_pk = ShiftLogEntry.objects.aggregate(
+            last_pk=Max("pk"),
+        )["last_pk"]
+        notes = [entry.note for entry in entries]
+        for entry in entries:
+            entry.note = markers[entry.note]
+        try:
+            ShiftLogEntry.objects.bulk_create(entries)
+        finally:
+            for entry, note in zip(entries, notes):
+                entry.note = note
+
+        # Log entries with the same person, type, and note are
+        # interchangeable, so we can match them up with the unsaved entries by
+        # those fields alone.
+        created = defaultdict(list)
+        for entry in ShiftLogEntry.objects.filter(
+                pk__gt=last_pk or 0,
+                note__startswith=token,
+        ).order_by("pk"):
+            created[entry.person_id, entry.entry_type, entry.note].append(entry)
+
+        links = []
+        for instance, entry in pairs:
+            match = created[
+                entry.person_id, entry.entry_type, markers[entry.note]
+            ].pop(0)
+            entry.pk = match.pk
+            entry.entry_time = match.entry_time
+            links.append(WorkshiftInstance.logs.through(
+                workshiftinstance_id=instance.pk,
+                shiftlogentry_id=entry.pk,
+            ))
+
+        for note, marker in markers.items():
+            ShiftLogEntry.objects.filter(note=marker).update(note=note)
+        WorkshiftInstance.logs.through.objects.bulk_create(links)
+
+    return [entry for instance, entry in pairs]
+
+
 def make_instances(semester=None, shifts=None, start=None):
+    """
+    Creates the workshift instances for regular workshifts for the rest of the
+    semester, replacing any open instances that already exist. All instances
+    and their initial assignment log entries are written in bulk inside a
+    single transaction.
+
+    Parameters
+    ----------
+    semester : workshift.models.Semester, optional
+    shifts : list of workshift.models.RegularWorkshift, optional
+    start : datetime.date, optional
+
+    Returns
+    -------
+    list of workshift.models.WorkshiftInstance
+    """
     if semester is None:
         semester = Semester.objects.get(current=True)
     if shifts is None:
-        shifts = RegularWorkshift.objects.filter(pool__semester=semester)
+        shifts = RegularWorkshift.objects.filter(
+            pool__semester=semester,
+        ).select_related("pool__semester")
     if start is None:
         start = max([localtime(now()).date(), semester.start_date])
 
+    shifts = list(shifts)
+    if not shifts:
+        return []
+
+    assignees = defaultdict(list)
+    for shift_pk, profile_pk in RegularWorkshift.current_assignees.through \
+            .objects.filter(regularworkshift__in=shifts) \
+            .order_by("pk") \
+            .values_list("regularworkshift", "workshiftprofile"):
+        assignees[shift_pk].append(profile_pk)
+
     new_instances = []
     for shift in shifts:
-        # Delete all old instances of this shift
-        WorkshiftInstance.objects.filter(
-            weekly_workshift=shift, closed=False,
-        ).delete()
-
         # Figure out the day to start from for this shift
         if shift.day is None or shift.week_long:
             # Workshifts have until Sunday to complete their shift
@@ -117,33 +306,80 @@ def make_instances(semester=None, shifts=None, start=None):
         next_day = start + timedelta(days=int(day) - start.weekday())
 
         # Create new instances for the entire semester
-        assignees = shift.current_assignees.all()
         for day in _date_range(
                 next_day,
                 semester.end_date,
                 timedelta(weeks=1),
         ):
             for i in range(shift.count):
-                if i < len(assignees):
-                    workshifter = assignees[i]
+                if i < len(assignees[shift.pk]):
+                    workshifter = assignees[shift.pk][i]
                 else:
                     workshifter = None
 
-                instance = WorkshiftInstance.objects.create(
+                instance = WorkshiftInstance(
                     weekly_workshift=shift,
+                    semester=shift.pool.semester,
                     date=day,
                     hours=shift.hours,
                     intended_hours=shift.hours,
-                    workshifter=workshifter,
+                    workshifter_id=workshifter,
                 )
-
+                # bulk_create skips the pre_save signal that fills these in
+                instance.set_deadlines()
                 new_instances.append(instance)
 
+    with transaction.atomic():
+        # Delete all old instances of these shifts
+        WorkshiftInstance.objects.filter(
+            weekly_workshift__in=shifts, closed=False,
+        ).delete()
+
+        WorkshiftInstance.objects.bulk_create(new_instances)
+
+        # bulk_create does not set primary keys, every open instance of these
+        # shifts is now one that we just created
+        new_instances = list(WorkshiftInstance.objects.filter(
+            weekly_workshift__in=shifts, closed=False,
+        ).order_by("pk"))
+
+        bulk_create_logs([
+            (instance, ShiftLogEntry(
+                person_id=instance.workshifter_id,
+                entry_type=ShiftLogEntry.ASSIGNED,
+                note="Initial assignment.",
+            ))
+            for instance in new_instances
+            if instance.workshifter_id is not None
+        ])
+
+    invalidate_navbar_state()
+    for semester_pk in set(shift.pool.semester_id for shift in shifts):
+        invalidate_schedule(semester_pk)
+
     return new_instances
 
 
 def make_workshift_pool_hours(semester=None, profiles=None, pools=None,
                               primary_hours=None):
+    """
+    Gives profiles hours in every pool that they do not have hours in yet,
+    using a fixed number of queries. The hours are created with zero
+    standing, so there is nothing to record in the standings ledger for them.
+
+    Parameters
+    ----------
+    semester : workshift.models.Semester, optional
+    profiles : list of workshift.models.WorkshiftProfile, optional
+    pools : list of workshift.models.WorkshiftPool, optional
+    primary_hours : decimal.Decimal, optional
+        Hours for the primary pool, in place of the pool's own hours.
+
+    Returns
+    -------
+    list of workshift.models.PoolHours
+        The hours that were created.
+    """
     if semester is None:
         try:
             semester = Semester.objects.get(current=True)
@@ -154,20 +390,70 @@ def make_workshift_pool_hours(semester=None, profiles=None, pools=None,
     if pools is None:
         pools = WorkshiftPool.objects.filter(semester=semester)
 
-    ret = []
-    for profile in profiles:
-        for pool in pools:
-            if not profile.pool_hours.filter(pool=pool):
-                if pool.is_primary and primary_hours:
-                    hours = primary_hours
-                else:
-                    hours = pool.hours
-                pool_hours = PoolHours.objects.create(
-                    pool=pool,
-                    hours=hours,
-                )
-                profile.pool_hours.add(pool_hours)
-                ret.append(pool_hours)
+    profiles, pools = list(profiles), list(pools)
+    if not profiles or not pools:
+        return []
+
+    def _hours(pool):
+        if pool.is_primary and primary_hours:
+            return primary_hours
+        return pool.hours
+
+    through = WorkshiftProfile.pool_hours.through
+
+    with transaction.atomic():
+        # Lock the pools, so that anyone else making hours in them waits until
+        # we commit, and we only see their rows once they are linked
+        list(WorkshiftPool.objects.select_for_update().filter(
+            pk__in=[pool.pk for pool in pools],
+        ).order_by("pk").values_list("pk", flat=True))
+
+        existing = set(through.objects.filter(
+            workshiftprofile__in=profiles,
+            poolhours__pool__in=pools,
+        ).values_list("workshiftprofile", "poolhours__pool"))
+
+        missing = [
+            (profile, pool)
+            for profile in profiles
+            for pool in pools
+            if (profile.pk, pool.pk) not in existing
+        ]
+        if not missing:
+            return []
+
+        last_pk = PoolHours.objects.aggregate(last_pk=Max("pk"))["last_pk"]
+        PoolHours.objects.bulk_create([
+            PoolHours(pool=pool, hours=_hours(pool))
+            for profile, pool in missing
+        ])
+
+        # bulk_create does not set primary keys, so fetch the new rows back.
+        # With the pools locked, the only rows in them that are newer than
+        # last_pk and not yet linked to a profile are the ones we just made.
+        # Rows for the same pool are interchangeable, so hand them out in any
+        # order.
+        created = defaultdict(list)
+        for pool_hours in PoolHours.objects.filter(
+                pk__gt=last_pk or 0,
+                pool__in=pools,
+                workshiftprofile__isnull=True,
+        ).order_by("pk"):
+            created[pool_hours.pool_id].append(pool_hours)
+
+        ret, links = [], []
+        for profile, pool in missing:
+            pool_hours = created[pool.pk].pop()
+            pool_hours.pool = pool
+            ret.append(pool_hours)
+            links.append(through(
+                workshiftprofile_id=profile.pk,
+                poolhours_id=pool_hours.pk,
+            ))
+        through.objects.bulk_create(links)
+
+    invalidate_navbar_state()
+
     return ret
 
 
@@ -223,53 +509,209 @@ def make_manager_workshifts(semester=None, managers=None):
     return shifts
 
 
-def past_verify(instance, moment=None):
-    if moment is None:
-        moment = localtime(now())
+_signal_state = threading.local()
+
 
-    end_time = (
-        instance.end_time
-        if instance.end_time is not None
-        else time(23, 59)
+@contextmanager
+def suppress_signals():
+    """
+    Makes the workshift signal handlers skip their work in this thread until
+    the block exits, for code that does that work itself in bulk.
+    """
+    depth = getattr(_signal_state, "depth", 0)
+    _signal_state.depth = depth + 1
+    try:
+        yield
+    finally:
+        _signal_state.depth = depth
+
+
+def signals_suppressed():
+    return getattr(_signal_state, "depth", 0) > 0
+
+
+_deferred_state = threading.local()
+
+
+@contextmanager
+def deferred_recompute():
+    """
+    Runs the block in a transaction, collecting the recomputes that signal
+    handlers hand to defer_recompute and running each one once, just before
+    the transaction is committed. Nested blocks join the outermost one.
+
+    Work that was deferred is thrown away if the block raises.
+    """
+    if getattr(_deferred_state, "pending", None) is not None:
+        yield
+        return
+
+    _deferred_state.pending = OrderedDict()
+    try:
+        with transaction.atomic():
+            yield
+            # Deferred work can defer more work of its own
+            pending = _deferred_state.pending
+            while pending:
+                (operation, key), items = pending.popitem(last=False)
+                operation(key, items)
+    finally:
+        _deferred_state.pending = None
+
+
+def defer_recompute(operation, key, *items):
+    """
+    Hands a recompute to the enclosing deferred_recompute block. Recomputes
+    with the same operation and key are merged, and operation is called once
+    with the key and the set of every item they were deferred with.
+
+    Parameters
+    ----------
+    operation : callable
+    key : hashable
+        i.e. the primary key of the semester to recompute.
+    items : hashable
+        i.e. the primary keys of the pool hours to recompute.
+
+    Returns
+    -------
+    bool
+        False if there is no deferred_recompute block, in which case the
+        caller should do the work right away.
+    """
+    pending = getattr(_deferred_state, "pending", None)
+    if pending is None:
+        return False
+    pending.setdefault((operation, key), set()).update(items)
+    return True
+
+
+def recompute_standings(semester_pk, pool_hours_pks):
+    """
+    Deferrable version of reset_standings.
+    """
+    reset_standings(
+        semester=Semester.objects.get(pk=semester_pk),
+        pool_hours=PoolHours.objects.filter(
+            pk__in=pool_hours_pks,
+        ).select_related("pool__semester"),
     )
 
-    end_datetime = datetime.combine(
-        instance.date,
-        end_time,
+
+def recompute_instances(semester_pk, shift_pks):
+    """
+    Deferrable version of make_instances, for the shifts that are still
+    active.
+    """
+    make_instances(
+        Semester.objects.get(pk=semester_pk),
+        RegularWorkshift.objects.filter(
+            pk__in=shift_pks,
+            active=True,
+        ).select_related("pool__semester"),
     )
 
-    if instance.end_time is None:
-        end_datetime += timedelta(days=1)
 
-    if settings.USE_TZ:
-        end_datetime = end_datetime.replace(
-            tzinfo=timezone(settings.TIME_ZONE),
+def bootstrap_semester(semester, pools=None):
+    """
+    Sets up a new semester: its workshift managers, its pools, a workshift
+    profile and pool hours for every resident, and its manager shifts. All of
+    it happens in one transaction, with the workshift signal handlers
+    suppressed and their work done in bulk instead.
+
+    Parameters
+    ----------
+    semester : workshift.models.Semester
+        Saved by this function if it has not been already.
+    pools : list of workshift.models.WorkshiftPool, optional
+        Unsaved pools to add to the semester alongside the primary pool.
+
+    Returns
+    -------
+    list of (str, float)
+        How many seconds each stage took.
+    """
+    if pools is None:
+        pools = []
+
+    timings = []
+    stage_start = [default_timer()]
+
+    def _stage(name):
+        moment = default_timer()
+        timings.append((name, moment - stage_start[0]))
+        stage_start[0] = moment
+
+    with transaction.atomic(), suppress_signals():
+        managers = Manager.objects.filter(workshift_manager=True)
+
+        semester.preferences_open = True
+        semester.save()
+        semester.workshift_managers = [
+            manager.incumbent.user
+            for manager in managers.filter(
+                incumbent__isnull=False,
+            ).select_related("incumbent__user")
+        ]
+        # Set current to false for previous semesters
+        Semester.objects.exclude(pk=semester.pk).update(current=False)
+        _stage("semester")
+
+        primary, created = WorkshiftPool.objects.get_or_create(
+            semester=semester,
+            is_primary=True,
         )
+        if created:
+            primary.managers = managers
+        for pool in pools:
+            pool.semester = semester
+            pool.save()
+        pools = list(WorkshiftPool.objects.filter(semester=semester))
+        _stage("pools")
 
-    return moment > end_datetime + timedelta(hours=instance.pool.verify_cutoff)
+        existing = WorkshiftProfile.objects.filter(
+            semester=semester,
+        ).values_list("user", flat=True)
+        WorkshiftProfile.objects.bulk_create([
+            WorkshiftProfile(user_id=user_pk, semester=semester)
+            for user_pk in UserProfile.objects.filter(
+                status=UserProfile.RESIDENT,
+            ).exclude(
+                user__username=ANONYMOUS_USERNAME,
+            ).exclude(
+                user__in=existing,
+            ).values_list("user", flat=True)
+        ])
+        _stage("profiles")
+
+        make_workshift_pool_hours(semester, pools=pools)
+        _stage("pool_hours")
+
+        shifts = make_manager_workshifts(semester=semester)
+        if shifts:
+            # The pools' semester is as it was saved, not as it was passed in
+            make_instances(shifts[0].pool.semester, shifts)
+        calculate_assigned_hours(semester)
+        _stage("manager_shifts")
+
+    invalidate_navbar_state()
+    invalidate_schedule(semester)
+
+    return timings
 
 
-def past_sign_out(instance, moment=None):
+def past_verify(instance, moment=None):
     if moment is None:
         moment = localtime(now())
 
-    start_time = (
-        instance.start_time
-        if instance.start_time is not None
-        else time(0)
-    )
-    start_datetime = datetime.combine(
-        instance.date,
-        start_time,
-    )
+    return moment > instance.get_verify_deadline()
 
-    if settings.USE_TZ:
-        start_datetime = start_datetime.replace(
-            tzinfo=timezone(settings.TIME_ZONE),
-        )
 
-    cutoff_hours = timedelta(hours=instance.pool.sign_out_cutoff)
-    cutoff_time = start_datetime - cutoff_hours
+def past_sign_out(instance, moment=None):
+    if moment is None:
+        moment = localtime(now())
+
+    cutoff_time = instance.get_sign_out_deadline()
 
     # Let people sign out of shifts if they were assigned to them within the
     # no-sign-out window (i.e. assigned on Monday, shift on Tuesday)
@@ -285,7 +727,193 @@ def past_sign_out(instance, moment=None):
     return moment > cutoff_time
 
 
+def update_deadlines(instances=None):
+    """
+    Recalculates the stored verify and sign out deadlines of workshift
+    instances, i.e. after their shift's times or their pool's cutoffs change.
+    Instances that end up with the same deadlines are updated together.
+
+    Parameters
+    ----------
+    instances : QuerySet of workshift.models.WorkshiftInstance, optional
+
+    Returns
+    -------
+    int
+        The number of instances whose deadlines changed.
+    """
+    if instances is None:
+        instances = WorkshiftInstance.objects.all()
+
+    instances = instances.select_related(
+        "weekly_workshift__pool", "info__pool",
+    )
+
+    changed = defaultdict(list)
+    for instance in instances:
+        deadlines = (
+            instance.get_verify_deadline(),
+            instance.get_sign_out_deadline(),
+        )
+        if deadlines != (instance.verify_deadline, instance.sign_out_deadline):
+            changed[deadlines].append(instance.pk)
+
+    with transaction.atomic():
+        for (verify_deadline, sign_out_deadline), pks in changed.items():
+            WorkshiftInstance.objects.filter(pk__in=pks).update(
+                verify_deadline=verify_deadline,
+                sign_out_deadline=sign_out_deadline,
+            )
+
+    return sum(len(pks) for pks in changed.values())
+
+
+def send_notifications(notifications):
+    """
+    Sends out many notifications at once, using a single insert in place of
+    one notify.send call per recipient.
+
+    Parameters
+    ----------
+    notifications : list of dict
+        Each dict holds the arguments that would have been passed to
+        notify.send: sender, recipient, verb and optionally action_object
+        and target.
+    """
+    if not notifications:
+        return []
+
+    def _make(sender, recipient, verb, action_object=None, target=None):
+        notification = Notification(
+            recipient=recipient,
+            actor_content_type=ContentType.objects.get_for_model(sender),
+            actor_object_id=sender.pk,
+            verb=verb,
+        )
+        for name, obj in [("action_object", action_object), ("target", target)]:
+            if obj is not None:
+                setattr(
+                    notification, name + "_content_type",
+                    ContentType.objects.get_for_model(obj),
+                )
+                setattr(notification, name + "_object_id", obj.pk)
+        return notification
+
+    created = [_make(**kwargs) for kwargs in notifications]
+    Notification.objects.bulk_create(created)
+    return created
+
+
+def adjust_standings(deltas):
+    """
+    Records changes to members' standings in the ledger and applies them to
+    the cached standings with atomic increments, so that concurrent changes
+    never overwrite each other.
+
+    Parameters
+    ----------
+    deltas : list of workshift.models.StandingDelta
+        Unsaved ledger entries. Entries for zero hours are skipped.
+
+    Returns
+    -------
+    list of workshift.models.StandingDelta
+        The entries that were recorded.
+    """
+    deltas = [delta for delta in deltas if delta.amount]
+    if not deltas:
+        return []
+
+    totals = defaultdict(int)
+    for delta in deltas:
+        totals[delta.pool_hours_id] += delta.amount
+
+    # Update pool hours that share the same change together
+    by_amount = defaultdict(list)
+    for pk, amount in totals.items():
+        if amount:
+            by_amount[amount].append(pk)
+
+    with transaction.atomic():
+        StandingDelta.objects.bulk_create(deltas)
+        for amount, pks in by_amount.items():
+            PoolHours.objects.filter(pk__in=pks).update(
+                standing=F("standing") + amount,
+            )
+
+    invalidate_navbar_state()
+    return deltas
+
+
+def adjust_standing(pool_hours, amount, reason, instance=None, moment=None):
+    """
+    Records a single change to a member's standing, see adjust_standings.
+    pool_hours is updated in place as well as in the database.
+
+    Parameters
+    ----------
+    pool_hours : workshift.models.PoolHours
+    amount : decimal.Decimal
+    reason : str
+        One of StandingDelta.REASON_CHOICES.
+    instance : workshift.models.WorkshiftInstance, optional
+        The shift that caused this change.
+    moment : datetime, optional
+    """
+    delta = StandingDelta(
+        pool_hours=pool_hours,
+        amount=amount,
+        reason=reason,
+        instance=instance,
+    )
+    if moment is not None:
+        delta.timestamp = moment
+
+    adjust_standings([delta])
+    pool_hours.standing += amount
+
+
+def get_standings(pool_hours, moment):
+    """
+    Finds what members' standings were at a given point in time, by summing
+    their ledger entries up to then in the database.
+
+    Parameters
+    ----------
+    pool_hours : list of workshift.models.PoolHours
+    moment : datetime
+
+    Returns
+    -------
+    dict of int, decimal.Decimal
+        Maps the primary key of each of pool_hours to its standing.
+    """
+    standings = dict((hours.pk, 0) for hours in pool_hours)
+    standings.update(
+        StandingDelta.objects.filter(
+            pool_hours__in=pool_hours,
+            timestamp__lte=moment,
+        ).order_by().values_list("pool_hours").annotate(Sum("amount"))
+    )
+    return standings
+
+
 def collect_blown(semester=None, moment=None):
+    """
+    Closes every instance whose verification window has passed, marking those
+    with assignees as verified or blown and updating their standings.
+
+    Parameters
+    ----------
+    semester : workshift.models.Semester, optional
+    moment : datetime.datetime, optional
+
+    Returns
+    -------
+    closed : list of workshift.models.WorkshiftInstance
+    verified : list of workshift.models.WorkshiftInstance
+    blown : list of workshift.models.WorkshiftInstance
+    """
     if semester is None:
         try:
             semester = Semester.objects.get(current=True)
@@ -295,16 +923,43 @@ def collect_blown(semester=None, moment=None):
         moment = localtime(now())
 
     closed, verified, blown = [], [], []
-    today = moment.date()
-    instances = WorkshiftInstance.objects.filter(
-        semester=semester, closed=False, date__lte=today,
+
+    instances = list(WorkshiftInstance.objects.filter(
+        semester=semester, closed=False, verify_deadline__lt=moment,
+    ).select_related(
+        "weekly_workshift__pool", "info__pool",
+        "workshifter__user", "liable__user",
+    ).order_by("pk"))
+
+    if not instances:
+        return closed, verified, blown
+
+    pools = WorkshiftPool.objects.filter(
+        semester=semester,
+    ).prefetch_related("managers__incumbent__user")
+    managers = dict(
+        (
+            pool.pk,
+            [
+                manager.incumbent.user
+                for manager in pool.managers.all()
+                if manager.incumbent
+            ],
+        )
+        for pool in pools
     )
 
-    for instance in instances:
-        # Skip shifts not yet ended
-        if not past_verify(instance, moment=moment):
-            continue
+    pool_hours = dict(
+        ((profile_pk, pool_pk), pk)
+        for pk, profile_pk, pool_pk in PoolHours.objects.filter(
+            pool__in=pools,
+            workshiftprofile__semester=semester,
+        ).values_list("pk", "workshiftprofile", "pool")
+    )
+
+    deltas, log_pairs, notifications = [], [], []
 
+    for instance in instances:
         instance.closed = True
 
         workshifter = instance.workshifter or instance.liable
@@ -312,124 +967,187 @@ def collect_blown(semester=None, moment=None):
         # Skip shifts that have no assignees
         if workshifter is None:
             closed.append(instance)
+            continue
+
+        pool_hours_pk = pool_hours[workshifter.pk, instance.pool.pk]
+
+        if instance.verify != AUTO_VERIFY or instance.liable:
+            amount, reason = -instance.hours, StandingDelta.BLOWN
+            entry_type = ShiftLogEntry.BLOWN
+            instance.blown = True
+            blown.append(instance)
         else:
-            # Update the workshifter's standing
-            pool_hours = workshifter.pool_hours.get(pool=instance.pool)
-
-            if instance.verify != AUTO_VERIFY or instance.liable:
-                pool_hours.standing -= instance.hours
-                entry_type = ShiftLogEntry.BLOWN
-                instance.blown = True
-                blown.append(instance)
-            else:
-                pool_hours.standing += instance.hours
-                entry_type = ShiftLogEntry.VERIFY
-                verified.append(instance)
-
-            pool_hours.save(update_fields=["standing"])
-
-            # Make a log entry
-            if entry_type:
-                instance.logs.add(
-                    ShiftLogEntry.objects.create(
-                        entry_type=entry_type,
-                    )
-                )
+            amount, reason = instance.hours, StandingDelta.VERIFIED
+            entry_type = ShiftLogEntry.VERIFY
+            verified.append(instance)
+
+        deltas.append(StandingDelta(
+            pool_hours_id=pool_hours_pk,
+            amount=amount,
+            reason=reason,
+            instance=instance,
+            timestamp=moment,
+        ))
+
+        log_pairs.append((instance, ShiftLogEntry(entry_type=entry_type)))
+
+        for target in [workshifter.user] + managers[instance.pool.pk]:
+            notifications.append(dict(
+                sender=instance,
+                verb="was automatically marked as blown",
+                recipient=target,
+            ))
+
+    with transaction.atomic():
+        WorkshiftInstance.objects.filter(
+            pk__in=[i.pk for i in closed + verified],
+        ).update(closed=True)
+        WorkshiftInstance.objects.filter(
+            pk__in=[i.pk for i in blown],
+        ).update(closed=True, blown=True)
 
-            # Send out notifications
-            targets = []
-            targets.append(workshifter.user)
-            for manager in instance.pool.managers.all():
-                if manager.incumbent:
-                    targets.append(manager.incumbent.user)
-            for target in targets:
-                notify.send(
-                    instance,
-                    verb="was automatically marked as blown",
-                    recipient=target,
-                )
+        adjust_standings(deltas)
+        bulk_create_logs(log_pairs)
+        send_notifications(notifications)
 
-        instance.save(update_fields=["closed", "blown"])
+    invalidate_navbar_state()
+    invalidate_instances(instances)
 
     return closed, verified, blown
 
 
-def is_available(workshift_profile, shift):
+def load_availability(profiles):
+    """
+    Loads the availability bitmaps of many profiles at once, rebuilding any
+    that are out of date from a single query for their time blocks.
+
+    Parameters
+    ----------
+    profiles : list of workshift.models.WorkshiftProfile
+
+    Returns
+    -------
+    dict of int to (int, int)
+        Mapping of profile pks to their busy and preferred bitmaps.
+    """
+    profiles = list(profiles)
+    stale = [
+        profile for profile in profiles
+        if profile.busy_slots is None or profile.preferred_slots is None
+    ]
+
+    if stale:
+        time_blocks = defaultdict(list)
+        for link in WorkshiftProfile.time_blocks.through.objects.filter(
+                workshiftprofile__in=stale,
+        ).select_related("timeblock"):
+            time_blocks[link.workshiftprofile_id].append(link.timeblock)
+
+        # Save the rebuilt bitmaps together, many members share the same
+        # schedule (i.e. those who haven't entered any time blocks)
+        changed = defaultdict(list)
+        for profile in stale:
+            busy, preferred = availability.build(time_blocks[profile.pk])
+            profile.busy_slots = availability.to_string(busy)
+            profile.preferred_slots = availability.to_string(preferred)
+            changed[profile.busy_slots, profile.preferred_slots].append(
+                profile.pk,
+            )
+
+        for (busy_slots, preferred_slots), pks in changed.items():
+            WorkshiftProfile.objects.filter(pk__in=pks).update(
+                busy_slots=busy_slots,
+                preferred_slots=preferred_slots,
+            )
+
+    return dict(
+        (profile.pk, profile.get_availability())
+        for profile in profiles
+    )
+
+
+def is_available(workshift_profile, shift, busy=None):
     """
     Check whether a specified user is able to do a specified workshift.
     Parameters:
         workshift_profile is the workshift profile for a user
         shift is a weekly recurring workshift
+        busy is an optional bitmap of when the user is busy, from
+            load_availability, to use instead of the profile's own
     Returns:
         True if the user has enough free time between the shift's start time
             and end time to do the shift's required number of hours.
         False otherwise.
     """
-    if shift.week_long:
+    if shift.week_long or shift.day is None:
         return True
 
-    start_time = (
-        shift.start_time
-        if shift.start_time is not None
-        else time(hour=0)
-    )
-    end_time = (
-        shift.end_time
-        if shift.end_time is not None
-        else time(hour=23, minute=59)
-    )
-    relevant_blocks = list()
-
-    for block in workshift_profile.time_blocks.order_by('start_time'):
-        if block.day == shift.day and block.preference == TimeBlock.BUSY \
-           and block.start_time < end_time \
-           and block.end_time > start_time:
-            relevant_blocks.append(block)
-
-    # Time blocks should be ordered; so go through and see if there is a wide
-    # enough window for the workshifter to do the shift.  If there is,
-    # return True.
-    if not relevant_blocks:
-        return True
+    if busy is None:
+        busy, preferred = workshift_profile.get_availability()
 
-    hours_delta = timedelta(hours=float(shift.hours))
+    # Shift hours are not always the length of the shift, so only look for a
+    # long enough window if the member is busy at some point during the shift
+    if not availability.overlaps(
+            busy, shift.day, shift.start_time, shift.end_time,
+    ):
+        return True
 
-    # Check the time between shift start and block start
-    block = relevant_blocks.pop(0)
-    start_delta = timedelta(
-        hours=block.start_time.hour - start_time.hour,
-        minutes=block.start_time.minute - start_time.minute,
+    free_minutes = availability.free_minutes(
+        busy, shift.day, shift.start_time, shift.end_time,
     )
 
-    if start_delta >= hours_delta:
-        return True
+    return free_minutes >= float(shift.hours) * 60
+
+
+def get_available_profiles(shift, profiles):
+    """
+    Finds who could cover a regular workshift, listing those who would prefer
+    to work at that time first.
 
-    while len(relevant_blocks) > 0:
-        block, prev_block = relevant_blocks.pop(0), block
+    Parameters
+    ----------
+    shift : workshift.models.RegularWorkshift
+    profiles : list of workshift.models.WorkshiftProfile
+
+    Returns
+    -------
+    list of workshift.models.WorkshiftProfile
+    """
+    profiles = list(profiles)
+    profile_availability = load_availability(profiles)
 
-        # Check the time between the last block and the next block
-        # is larger than the length of the shift
-        start_end_delta = timedelta(
-            hours=block.start_time.hour - prev_block.end_time.hour,
-            minutes=block.start_time.minute - prev_block.end_time.minute,
+    window = 0
+    if not shift.week_long and shift.day is not None:
+        window = availability.day_mask(
+            shift.day, shift.start_time, shift.end_time,
         )
 
-        if start_end_delta >= hours_delta:
-            return True
+    available = [
+        profile for profile in profiles
+        if is_available(
+            profile, shift, busy=profile_availability[profile.pk][0],
+        )
+    ]
 
-    # Check the time between the end of the time block to the end of the shift
-    end_delta = timedelta(
-        hours=end_time.hour - block.end_time.hour,
-        minutes=end_time.minute - block.end_time.minute,
+    return sorted(
+        available,
+        key=lambda profile: not (
+            window and profile_availability[profile.pk][1] & window
+        ),
     )
 
-    if end_delta >= hours_delta:
-        return True
 
-    return False
+AUTO_ASSIGN_MATCHING = "matching"
+AUTO_ASSIGN_GREEDY = "greedy"
 
+AUTO_ASSIGN_STRATEGIES = (
+    (AUTO_ASSIGN_MATCHING, "Best overall fit"),
+    (AUTO_ASSIGN_GREEDY, "Round-robin"),
+)
 
-def auto_assign_shifts(semester=None, pool=None, profiles=None, shifts=None):
+
+def auto_assign_shifts(semester=None, pool=None, profiles=None, shifts=None,
+                       strategy=AUTO_ASSIGN_MATCHING):
     """
     Auto-assigns profiles to regular workshifts.
 
@@ -439,6 +1157,15 @@ def auto_assign_shifts(semester=None, pool=None, profiles=None, shifts=None):
     pool : workshift.models.WorkshiftPool, optional
     profiles : list of workshift.models.WorkshiftProfile, optional
     shifts : list of workshift.models.RegularWorkshift, optional
+    strategy : str, optional
+        AUTO_ASSIGN_MATCHING to pick the assignments that best fit everyone's
+        preferences in each round, or AUTO_ASSIGN_GREEDY to have members pick
+        their favorite remaining shift one at a time.
+
+    Returns
+    -------
+    list of workshift.models.WorkshiftProfile
+        Profiles that could not be assigned all of their hours.
     """
     if semester is None:
         try:
@@ -460,6 +1187,32 @@ def auto_assign_shifts(semester=None, pool=None, profiles=None, shifts=None):
             workshift_type__assignment=WorkshiftType.AUTO_ASSIGN,
         )
 
+    if strategy == AUTO_ASSIGN_MATCHING:
+        return _matching_assign_shifts(pool, profiles, shifts)
+    elif strategy == AUTO_ASSIGN_GREEDY:
+        return _greedy_assign_shifts(pool, profiles, shifts)
+
+    raise ValueError("Unknown assignment strategy: {0}".format(strategy))
+
+
+def _get_rank(rating, status):
+    """
+    Ranks how well a shift suits a member, from 1 (best) to 6 (worst).
+    """
+    if rating == WorkshiftRating.DISLIKE:
+        rank = 5
+    elif rating == WorkshiftRating.INDIFFERENT:
+        rank = 3
+    else:
+        rank = 1
+
+    if status != TimeBlock.PREFERRED:
+        rank += 1
+
+    return rank
+
+
+def _greedy_assign_shifts(pool, profiles, shifts):
     shifts = set([
         shift
         for shift in shifts
@@ -496,17 +1249,7 @@ def auto_assign_shifts(semester=None, pool=None, profiles=None, shifts=None):
             except WorkshiftRating.DoesNotExist:
                 rating = WorkshiftRating.INDIFFERENT
 
-            if rating == WorkshiftRating.DISLIKE:
-                rank = 5
-            elif rating == WorkshiftRating.INDIFFERENT:
-                rank = 3
-            else:
-                rank = 1
-
-            if status != TimeBlock.PREFERRED:
-                rank += 1
-
-            rankings[profile, rank].add(shift)
+            rankings[profile, _get_rank(rating, status)].add(shift)
 
     # Assign shifts in a round-robin manner, run until we can't assign anyone
     # any more shifts
@@ -560,10 +1303,369 @@ def auto_assign_shifts(semester=None, pool=None, profiles=None, shifts=None):
     return profiles
 
 
-def randomly_assign_instances(semester, pool, profiles=None, instances=None):
+def _min_cost_matching(left, right, costs):
+    """
+    Pairs up two groups of items with a min-cost max-flow, making as many pairs
+    as possible while keeping the total cost of those pairs as low as possible.
+
+    Parameters
+    ----------
+    left : list of (object, int)
+        Items and the number of pairs each can be a part of.
+    right : list of (object, int)
+        Items and the number of pairs each can be a part of.
+    costs : dict of (int, int) to int
+        The non-negative cost of pairing left[i] with right[j], for every pair
+        that is allowed.
+
+    Returns
+    -------
+    list of (object, object)
+    """
+    source, sink = 0, 1
+    node_count = 2 + len(left) + len(right)
+    graph = [[] for i in range(node_count)]
+    heads, capacities, weights = [], [], []
+
+    # Edges are stored in pairs, so edge ^ 1 is always the reverse of edge
+    def _add_edge(start, end, capacity, weight):
+        for tail, head, cap, cost in [
+                (start, end, capacity, weight),
+                (end, start, 0, -weight),
+        ]:
+            graph[tail].append(len(heads))
+            heads.append(head)
+            capacities.append(cap)
+            weights.append(cost)
+
+    for i, (item, capacity) in enumerate(left):
+        _add_edge(source, 2 + i, capacity, 0)
+    for j, (item, capacity) in enumerate(right):
+        _add_edge(2 + len(left) + j, sink, capacity, 0)
+
+    pair_edges = []
+    for (i, j), cost in sorted(costs.items()):
+        pair_edges.append(((i, j), len(heads)))
+        _add_edge(2 + i, 2 + len(left) + j, 1, cost)
+
+    # Successive shortest paths, using Dijkstra's algorithm with potentials so
+    # that the reverse edges' negative costs can be handled
+    potentials = [0] * node_count
+    while True:
+        distances = [None] * node_count
+        distances[source] = 0
+        previous = [None] * node_count
+        queue = [(0, source)]
+
+        while queue:
+            distance, node = heappop(queue)
+            if distance > distances[node]:
+                continue
+            for edge in graph[node]:
+                if capacities[edge] <= 0:
+                    continue
+                head = heads[edge]
+                new_distance = distance + weights[edge] + \
+                    potentials[node] - potentials[head]
+                if distances[head] is None or new_distance < distances[head]:
+                    distances[head] = new_distance
+                    previous[head] = edge
+                    heappush(queue, (new_distance, head))
+
+        if distances[sink] is None:
+            break
+
+        for node, distance in enumerate(distances):
+            if distance is not None:
+                potentials[node] += distance
+
+        # Find the bottleneck along the path, then push that much through it
+        path, node = [], sink
+        while node != source:
+            edge = previous[node]
+            path.append(edge)
+            node = heads[edge ^ 1]
+
+        flow = min(capacities[edge] for edge in path)
+        for edge in path:
+            capacities[edge] -= flow
+            capacities[edge ^ 1] += flow
+
+    return [
+        (left[i][0], right[j][0])
+        for (i, j), edge in pair_edges
+        if capacities[edge] == 0
+    ]
+
+
+def _matching_assign_shifts(pool, profiles, shifts):
+    """
+    Assigns shifts in rounds, giving each member at most one more shift per
+    round. Each round is solved as a min-cost matching between members and
+    open shifts, so members are not stuck with worse shifts because someone
+    earlier in the list took the one that fit them best.
+
+    Everything needed is loaded up front, and the assignments are all saved
+    at the end with bulk_assign_shifts.
+    """
+    profiles = list(profiles)
+    shifts = list(shifts)
+
+    assignees = defaultdict(set)
+    for shift_pk, profile_pk in RegularWorkshift.current_assignees.through \
+            .objects.filter(regularworkshift__in=shifts) \
+            .values_list("regularworkshift", "workshiftprofile"):
+        assignees[shift_pk].add(profile_pk)
+
+    slots = dict(
+        (shift.pk, shift.count - len(assignees[shift.pk]))
+        for shift in shifts
+    )
+    shifts = [shift for shift in shifts if slots[shift.pk] > 0]
+
+    hours, assigned_hours = {}, {}
+    for profile_pk, total, assigned in PoolHours.objects.filter(
+            pool=pool,
+            workshiftprofile__in=profiles,
+    ).values_list("workshiftprofile", "hours", "assigned_hours"):
+        hours[profile_pk] = float(total)
+        assigned_hours[profile_pk] = float(assigned)
+
+    profile_availability = load_availability(profiles)
+
+    ratings = {}
+    for profile_pk, workshift_type_pk, rating in \
+            WorkshiftProfile.ratings.through.objects.filter(
+                workshiftprofile__in=profiles,
+            ).values_list(
+                "workshiftprofile",
+                "workshiftrating__workshift_type",
+                "workshiftrating__rating",
+            ):
+        ratings[profile_pk, workshift_type_pk] = rating
+
+    windows = dict(
+        (shift.pk, availability.day_mask(
+            shift.day, shift.start_time, shift.end_time,
+        ))
+        for shift in shifts
+        if not shift.week_long and shift.day is not None
+    )
+
+    # Rank every shift that fits each member's schedule
+    ranks = {}
+    for profile in profiles:
+        busy, preferred = profile_availability[profile.pk]
+        for shift in shifts:
+            if not is_available(profile, shift, busy=busy):
+                continue
+
+            status = None
+            if preferred & windows.get(shift.pk, 0):
+                status = TimeBlock.PREFERRED
+
+            rating = ratings.get(
+                (profile.pk, shift.workshift_type_id),
+                WorkshiftRating.INDIFFERENT,
+            )
+            ranks[profile.pk, shift.pk] = _get_rank(rating, status)
+
+    # Prefer better ranked shifts first, then the shifts that give the most
+    # hours, as the greedy assignment does
+    max_hours = max([float(shift.hours) for shift in shifts] or [0])
+
+    new_assignments = []
+    while True:
+        costs = {}
+        for i, profile in enumerate(profiles):
+            if profile.pk not in hours:
+                continue
+            for j, shift in enumerate(shifts):
+                if (profile.pk, shift.pk) not in ranks or \
+                   slots[shift.pk] <= 0 or \
+                   profile.pk in assignees[shift.pk] or \
+                   assigned_hours[profile.pk] + float(shift.hours) > \
+                   hours[profile.pk]:
+                    continue
+                costs[i, j] = int(
+                    ranks[profile.pk, shift.pk] * (max_hours + 1) * 100 +
+                    (max_hours - float(shift.hours)) * 100
+                )
+
+        if not costs:
+            break
+
+        pairs = _min_cost_matching(
+            [(profile, 1) for profile in profiles],
+            [(shift, slots[shift.pk]) for shift in shifts],
+            costs,
+        )
+
+        for profile, shift in pairs:
+            assignees[shift.pk].add(profile.pk)
+            slots[shift.pk] -= 1
+            assigned_hours[profile.pk] += float(shift.hours)
+            new_assignments.append((shift, profile))
+
+    bulk_assign_shifts(new_assignments)
+
+    # Return profiles that were incompletely assigned shifts
+    return [
+        profile
+        for profile in profiles
+        if profile.pk in hours and
+        assigned_hours[profile.pk] < hours[profile.pk]
+    ]
+
+
+def bulk_assign_shifts(assignments, added=False):
+    """
+    Adds members to regular workshifts, doing the same work as the signals
+    for RegularWorkshift.current_assignees in a fixed number of queries:
+    members' assigned hours are updated, they are assigned to the upcoming
+    instances of their new shifts, and they are notified.
+
+    Parameters
+    ----------
+    assignments : list of (workshift.models.RegularWorkshift,
+                           workshift.models.WorkshiftProfile)
+    added : bool, optional
+        Whether the members were already added to the shifts, i.e. by
+        shift.current_assignees.add, so that only the work that follows
+        remains.
+    """
+    if not assignments:
+        return
+
+    shifts = dict((shift.pk, shift) for shift, profile in assignments)
+    profiles = WorkshiftProfile.objects.select_related("user").in_bulk(
+        set(profile.pk for shift, profile in assignments),
+    )
+    new_assignees = defaultdict(list)
+    for shift, profile in assignments:
+        new_assignees[shift.pk].append(profiles[profile.pk])
+
+    active = [shift for shift in shifts.values() if shift.active]
+
+    pool_hours = dict(
+        ((profile_pk, pool_pk), pk)
+        for pk, profile_pk, pool_pk in PoolHours.objects.filter(
+            workshiftprofile__in=profiles.keys(),
+            pool__in=set(shift.pool_id for shift in active),
+        ).values_list("pk", "workshiftprofile", "pool")
+    )
+
+    deltas = defaultdict(int)
+    for shift in active:
+        for profile in new_assignees[shift.pk]:
+            deltas[pool_hours[profile.pk, shift.pool_id]] += shift.hours
+
+    instances = list(WorkshiftInstance.objects.filter(
+        weekly_workshift__in=active,
+        date__gte=localtime(now()).date(),
+        closed=False,
+    ).order_by("date", "pk"))
+
+    # Members shouldn't be given a second instance on days where they already
+    # have one, or have already signed out of one
+    dates = defaultdict(set)
+    for instance in instances:
+        if instance.workshifter_id is not None:
+            dates[instance.weekly_workshift_id, instance.workshifter_id] \
+                .add(instance.date)
+
+    instances_by_pk = dict((instance.pk, instance) for instance in instances)
+    for instance_pk, person_pk in ShiftLogEntry.objects.filter(
+            workshiftinstance__in=instances,
+            person__in=profiles.keys(),
+            entry_type=ShiftLogEntry.SIGNOUT,
+    ).values_list("workshiftinstance", "person"):
+        instance = instances_by_pk[instance_pk]
+        dates[instance.weekly_workshift_id, person_pk].add(instance.date)
+
+    to_assign = defaultdict(list)
+    log_pairs = []
+    for instance in instances:
+        if instance.workshifter_id is not None:
+            continue
+        for profile in new_assignees[instance.weekly_workshift_id]:
+            key = (instance.weekly_workshift_id, profile.pk)
+            if instance.date in dates[key]:
+                continue
+
+            to_assign[profile.pk].append(instance.pk)
+            log_pairs.append((instance, ShiftLogEntry(
+                person=profile,
+                entry_type=ShiftLogEntry.ASSIGNED,
+                note="Assigned to the recurring shift.",
+            )))
+            dates[key].add(instance.date)
+            break
+
+    with transaction.atomic():
+        if not added:
+            RegularWorkshift.current_assignees.through.objects.bulk_create([
+                RegularWorkshift.current_assignees.through(
+                    regularworkshift_id=shift.pk,
+                    workshiftprofile_id=profile.pk,
+                )
+                for shift, profile in assignments
+            ])
+
+        by_delta = defaultdict(list)
+        for pk, delta in deltas.items():
+            by_delta[delta].append(pk)
+        for delta, pks in by_delta.items():
+            PoolHours.objects.filter(pk__in=pks).update(
+                assigned_hours=F("assigned_hours") + delta,
+            )
+
+        for profile_pk, instance_pks in to_assign.items():
+            WorkshiftInstance.objects.filter(pk__in=instance_pks).update(
+                workshifter=profiles[profile_pk], liable=None,
+            )
+
+        bulk_create_logs(log_pairs)
+
+        send_notifications([
+            dict(
+                sender=shift,
+                verb="You were assigned to",
+                action_object=shift,
+                recipient=profile.user,
+            )
+            for shift in active
+            for profile in new_assignees[shift.pk]
+        ])
+
+    invalidate_navbar_state()
+    invalidate_instances(
+        instances_by_pk[pk]
+        for instance_pks in to_assign.values()
+        for pk in instance_pks
+    )
+
+
+def randomly_assign_instances(semester, pool, profiles=None, instances=None,
+                              seed=None):
     """
     Randomly assigns workshift instances to profiles.
 
+    Members are drawn one instance at a time, weighted by how many hours they
+    are still owed, so that those furthest from their hours are the most
+    likely to go next. Nobody is given an instance on a day they are already
+    working.
+
+    Parameters
+    ----------
+    semester : workshift.models.Semester
+    pool : workshift.models.WorkshiftPool
+    profiles : list of workshift.models.WorkshiftProfile, optional
+    instances : list of workshift.models.WorkshiftInstance, optional
+    seed : hashable, optional
+        Seeds the random draws, so that the same assignments can be made
+        again.
+
     Returns
     -------
     list of workshift.WorkshiftProfile
@@ -583,56 +1685,108 @@ def randomly_assign_instances(semester, pool, profiles=None, instances=None):
 
     instances = list(instances)
     profiles = list(profiles)
-
-    # List of hours assigned to each profile
-    hours_mapping = defaultdict(float)
-    total_hours_owed = defaultdict(float)
+    rng = random.Random(seed)
 
     semester_weeks = (semester.end_date - semester.start_date).days / 7
 
-    # Initialize with already-assigned instances
-    for profile in profiles:
-        for shift in profile.instance_workshifter.filter(
-                Q(info__pool=pool) |
-                Q(weekly_workshift__pool=pool)
-        ):
-            hours_mapping[profile] += float(shift.hours)
-        pool_hours = profile.pool_hours.get(pool=pool)
+    hours_owed = {}
+    for profile_pk, hours in PoolHours.objects.filter(
+            pool=pool,
+            workshiftprofile__in=profiles,
+    ).values_list("workshiftprofile", "hours"):
         if pool.weeks_per_period == 0:
-            total_hours_owed[profile] = pool_hours.hours
+            hours_owed[profile_pk] = float(hours)
         else:
             periods = semester_weeks / pool.weeks_per_period
-            total_hours_owed[profile] = periods * float(pool_hours.hours)
+            hours_owed[profile_pk] = periods * float(hours)
 
-    while profiles and instances:
-        for profile in profiles[:]:
-            instance = random.choice(instances)
-            instance.workshifter = profile
-            instance.save(update_fields=["workshifter"])
-
-            instance.logs.add(
-                ShiftLogEntry.objects.create(
-                    person=instance.workshifter,
-                    entry_type=ShiftLogEntry.ASSIGNED,
-                    note="Randomly assigned.",
-                )
-            )
+    # Initialize with already-assigned instances, counting the hours of those
+    # in this pool and the days of every one
+    hours_assigned = defaultdict(float)
+    dates = defaultdict(set)
+    for row in WorkshiftInstance.objects.filter(
+            semester=semester,
+            workshifter__in=profiles,
+    ).values(
+        "workshifter", "date", "weekly_workshift__pool", "info__pool",
+    ).annotate(total_hours=Sum("hours")).order_by():
+        dates[row["workshifter"]].add(row["date"])
+        if pool.pk in [row["weekly_workshift__pool"], row["info__pool"]]:
+            hours_assigned[row["workshifter"]] += float(row["total_hours"])
+
+    def _remaining(profile):
+        return hours_owed.get(profile.pk, 0) - hours_assigned[profile.pk]
+
+    # Weighted random order, drawing the member with the largest
+    # random() ** (1 / weight) each time
+    def _push(queue, profile):
+        remaining = _remaining(profile)
+        if remaining > 0:
+            key = rng.random() ** (1 / remaining)
+            heappush(queue, (-key, profile.pk, profile))
+
+    queue = []
+    for profile in profiles:
+        _push(queue, profile)
 
-            instances.remove(instance)
+    rng.shuffle(instances)
+    to_assign = defaultdict(list)
+    log_pairs = []
 
-            hours_mapping[profile] += float(instance.hours)
-            if hours_mapping[profile] >= total_hours_owed[profile]:
-                profiles.remove(profile)
-            if not instances:
+    while queue and instances:
+        key, profile_pk, profile = heappop(queue)
+
+        # Take the last instance on a day the member is free, swapping the
+        # last instance into its place
+        for i in range(len(instances) - 1, -1, -1):
+            if instances[i].date not in dates[profile.pk]:
                 break
+        else:
+            # Nothing left that this member can take
+            continue
+        instance = instances[i]
+        instances[i] = instances[-1]
+        instances.pop()
+
+        instance.workshifter = profile
+        to_assign[profile.pk].append(instance.pk)
+        log_pairs.append((instance, ShiftLogEntry(
+            person=profile,
+            entry_type=ShiftLogEntry.ASSIGNED,
+            note="Randomly assigned.",
+        )))
+        dates[profile.pk].add(instance.date)
+        hours_assigned[profile.pk] += float(instance.hours)
+
+        _push(queue, profile)
+
+    profiles_by_pk = dict((profile.pk, profile) for profile in profiles)
+    with transaction.atomic():
+        for profile_pk, instance_pks in to_assign.items():
+            WorkshiftInstance.objects.filter(pk__in=instance_pks).update(
+                workshifter=profiles_by_pk[profile_pk],
+            )
+        bulk_create_logs(log_pairs)
+
+    invalidate_navbar_state()
+    invalidate_instances(instance for instance, entry in log_pairs)
 
-    return profiles, instances
+    return [
+        profile
+        for profile in profiles
+        if _remaining(profile) > 0
+    ], instances
 
 
 def clear_all_assignments(semester=None, pool=None, shifts=None):
     """
     Clears all regular workshift assignments.
 
+    Does the same work as the signals for RegularWorkshift.current_assignees
+    for every shift at once: members are unassigned from the upcoming
+    instances of their shifts and notified, and their assigned hours are
+    recalculated.
+
     Parameters
     ----------
     semester : workshift.models.Semester, optional
@@ -640,12 +1794,17 @@ def clear_all_assignments(semester=None, pool=None, shifts=None):
         If set, grab workshifts from a specific pool. Otherwise, the primary
         workshift pool will be used.
     shifts : list of workshift.models.RegularWorkshift, optional
+
+    Returns
+    -------
+    int
+        The number of assignments that were cleared.
     """
     if semester is None:
         try:
             semester = Semester.objects.get(current=True)
         except (Semester.DoesNotExist, Semester.MultipleObjectsReturned):
-            return []
+            return 0
     if pool is None:
         pool = WorkshiftPool.objects.get(
             semester=semester,
@@ -658,8 +1817,61 @@ def clear_all_assignments(semester=None, pool=None, shifts=None):
             workshift_type__assignment=WorkshiftType.AUTO_ASSIGN,
         )
 
-    for shift in shifts:
-        shift.current_assignees.clear()
+    shifts = dict((shift.pk, shift) for shift in shifts)
+    through = RegularWorkshift.current_assignees.through
+    assignments = list(through.objects.filter(
+        regularworkshift__in=shifts.keys(),
+    ).values_list("regularworkshift", "workshiftprofile"))
+
+    if not assignments:
+        return 0
+
+    profiles = WorkshiftProfile.objects.select_related("user").in_bulk(
+        set(profile_pk for shift_pk, profile_pk in assignments),
+    )
+
+    instances = list(WorkshiftInstance.objects.filter(
+        Q(workshifter__isnull=False) | Q(liable__isnull=False),
+        weekly_workshift__in=[
+            shift for shift in shifts.values() if shift.active
+        ],
+        date__gte=localtime(now()).date(),
+        closed=False,
+    ).order_by("date", "pk"))
+
+    with transaction.atomic():
+        through.objects.filter(regularworkshift__in=shifts.keys()).delete()
+
+        WorkshiftInstance.objects.filter(
+            pk__in=[instance.pk for instance in instances],
+        ).update(workshifter=None, liable=None)
+
+        bulk_create_logs([
+            (instance, ShiftLogEntry(
+                person_id=instance.workshifter_id or instance.liable_id,
+                entry_type=ShiftLogEntry.UNASSIGNED,
+                note="Removed from the recurring shift.",
+            ))
+            for instance in instances
+        ])
+
+        calculate_assigned_hours(semester, profiles=profiles.values())
+
+        send_notifications([
+            dict(
+                sender=shifts[shift_pk],
+                verb="You were removed from",
+                action_object=shifts[shift_pk],
+                recipient=profiles[profile_pk].user,
+            )
+            for shift_pk, profile_pk in assignments
+            if shifts[shift_pk].active
+        ])
+
+    invalidate_navbar_state()
+    invalidate_instances(instances)
+
+    return len(assignments)
 
 
 def update_standings(semester=None, pool_hours=None, moment=None):
@@ -667,52 +1879,175 @@ def update_standings(semester=None, pool_hours=None, moment=None):
     This function acts to update a list of PoolHours objects to adjust their
     current standing based on the time in the semester.
 
+    The number of periods that have passed is worked out once for each pool
+    (and last update), and the standings of every member that share it are
+    written with a single update. Members who have already been updated for
+    the current period are left alone, so running this twice is harmless.
+
     Parameters
     ----------
     semester : workshift.models.Semester, optional
     pool_hours : list of workshift.models.PoolHours, optional
-        If None, runs on all pool hours for semester.
+        If None, runs on all pool hours for semester. Any instances passed in
+        are updated in place, as well as in the database.
     moment : datetime, optional
+
+    Returns
+    -------
+    changed : int
+        The number of pool hours whose standings were updated.
+    elapsed : float
+        How long the update took, in seconds.
     """
+    start = default_timer()
+
     if semester is None:
         try:
             semester = Semester.objects.get(current=True)
         except (Semester.DoesNotExist, Semester.MultipleObjectsReturned):
-            return []
+            return 0, default_timer() - start
 
     if moment is None:
         moment = localtime(now())
 
-    if pool_hours is None:
-        pool_hours = PoolHours.objects.filter(pool__semester=semester)
+    pools = dict(
+        (pool.pk, pool)
+        for pool in WorkshiftPool.objects.filter(semester=semester)
+    )
+    for pool in pools.values():
+        pool.semester = semester
+
+    rows = PoolHours.objects.filter(pool__semester=semester)
+    if pool_hours is not None:
+        pool_hours = list(pool_hours)
+        rows = rows.filter(pk__in=[hours.pk for hours in pool_hours])
+
+    periods_since = {}
+    groups = defaultdict(list)
+    deltas = []
+    changed = 0
+
+    with transaction.atomic():
+        # Lock the rows, so that a retried run waits for this one and then
+        # finds nothing left to do
+        rows = rows.select_for_update().values_list(
+            "pk", "pool", "hours", "last_updated",
+        )
 
-    for hours in pool_hours:
-        # Don't update hours after the semester ends
-        if hours.last_updated and \
-           hours.last_updated.date() > semester.end_date:
-            continue
+        for pk, pool_pk, hours, last_updated in rows:
+            last_date = last_updated.date() if last_updated else None
 
-        # Calculate the number of periods (n weeks / once per semester) that
-        # have passed since last update
-        periods = hours.periods_since_last_update(moment=moment)
+            # Don't update hours after the semester ends
+            if last_date and last_date > semester.end_date:
+                continue
 
-        # Update the actual standings
-        if periods > 0:
-            hours.standing -= hours.hours * periods
-            hours.last_updated = moment
-            hours.save(update_fields=["standing", "last_updated"])
+            key = (pool_pk, last_date)
+            if key not in periods_since:
+                periods_since[key] = pools[pool_pk].periods_since(
+                    last_updated, moment=moment,
+                )
+            periods = periods_since[key]
+
+            if periods > 0:
+                groups[pool_pk, periods].append(pk)
+                deltas.append(StandingDelta(
+                    pool_hours_id=pk,
+                    amount=-hours * periods,
+                    reason=StandingDelta.PERIOD,
+                    timestamp=moment,
+                ))
+
+        StandingDelta.objects.bulk_create(
+            [delta for delta in deltas if delta.amount],
+        )
 
+        for (pool_pk, periods), pks in groups.items():
+            changed += PoolHours.objects.filter(pk__in=pks).update(
+                standing=F("standing") - F("hours") * periods,
+                last_updated=moment,
+            )
+
+    if pool_hours:
+        amounts = dict((delta.pool_hours_id, delta.amount) for delta in deltas)
+        for hours in pool_hours:
+            if hours.pk in amounts:
+                hours.standing += amounts[hours.pk]
+                hours.last_updated = moment
+
+    if changed:
+        invalidate_navbar_state()
+
+    return changed, default_timer() - start
+
+
+def get_hour_totals(pool_hours):
+    """
+    Totals up the hours that each member has had verified or blown in each
+    pool, using a single aggregate over the closed workshift instances.
+
+    Parameters
+    ----------
+    pool_hours : list of workshift.models.PoolHours
 
-def reset_standings(semester=None, pool_hours=None):
+    Returns
+    -------
+    dict of int, decimal.Decimal
+        Maps the primary key of each of pool_hours to the hours verified minus
+        the hours blown for that member in that pool.
     """
-    Utility function to recalculate workshift standings. This function is meant
-    to only be called from the manager shell, it is not referenced anywhere
-    else in the workshift module.
+    pool_hours = list(pool_hours)
+
+    # Map (profile, pool) pairs back onto the pool hours being recomputed
+    keys = dict(
+        ((profile_pk, pool_pk), pk)
+        for pk, pool_pk, profile_pk in
+        WorkshiftProfile.pool_hours.through.objects.filter(
+            poolhours__in=pool_hours,
+        ).values_list("poolhours", "poolhours__pool", "workshiftprofile")
+    )
+    profile_pks = set(profile_pk for profile_pk, _ in keys)
+    pool_pks = set(pool_pk for _, pool_pk in keys)
+
+    rows = WorkshiftInstance.objects.filter(
+        Q(weekly_workshift__pool__in=pool_pks) |
+        Q(info__pool__in=pool_pks),
+        Q(workshifter__in=profile_pks) | Q(liable__in=profile_pks),
+        closed=True,
+    ).order_by().values_list(
+        "workshifter", "liable", "blown",
+        "weekly_workshift__pool", "info__pool",
+    ).annotate(Sum("hours"))
+
+    totals = dict((hours.pk, 0) for hours in pool_hours)
+    for workshifter, liable, blown, shift_pool, info_pool, hours in rows:
+        pool_pk = shift_pool or info_pool
+        # Blown shifts count against both the workshifter and whoever was
+        # liable for them
+        for profile_pk in set([workshifter, liable]):
+            pk = keys.get((profile_pk, pool_pk))
+            if pk is not None:
+                totals[pk] += -hours if blown else hours
+
+    return totals
+
+
+def reset_standings(semester=None, pool_hours=None, moment=None):
+    """
+    Utility function to recalculate workshift standings from scratch: each
+    member's hour adjustment, plus their verified hours, minus their blown
+    hours and the hours owed for every period that has passed.
+
+    The totals for every member come from one aggregate query and are written
+    back in one update per distinct standing, so this is cheap enough to run
+    while saving a single member's pool hours.
 
     Parameters
     ----------
     semester : workshift.models.Semester, optional
     pool_hours : list of workshift.models.PoolHours, optional
+        If None, runs on all pool hours for semester. Any instances passed in
+        are updated in place, as well as in the database.
+    moment : datetime, optional
     """
     if semester is None:
         try:
@@ -720,110 +2055,331 @@ def reset_standings(semester=None, pool_hours=None):
         except (Semester.DoesNotExist, Semester.MultipleObjectsReturned):
             return
     if pool_hours is None:
-        pool_hours = PoolHours.objects.filter(pool__semester=semester)
+        pool_hours = PoolHours.objects.filter(pool__semester=semester) \
+            .select_related("pool__semester")
+    if moment is None:
+        moment = localtime(now())
+
+    pool_hours = list(pool_hours)
+    totals = get_hour_totals(pool_hours)
+    # What the ledger adds up to now, which may have drifted from the standings
+    current = defaultdict(int)
+    current.update(
+        StandingDelta.objects.filter(pool_hours__in=pool_hours)
+        .order_by().values_list("pool_hours").annotate(Sum("amount"))
+    )
+
+    # Members often end up with the same standing (i.e. no shifts yet), so
+    # write those together
+    standings = defaultdict(list)
+    corrections = []
 
     for hours in pool_hours:
         hours.last_updated = None
-        hours.standing = hours.hour_adjustment
+        hours.standing = hours.hour_adjustment + totals[hours.pk]
+
+        periods = hours.periods_since_last_update(moment=moment)
+        if periods > 0:
+            hours.standing -= hours.hours * periods
+            hours.last_updated = moment
 
-        profile = WorkshiftProfile.objects.get(pool_hours=hours)
+        standings[hours.standing, hours.last_updated].append(hours.pk)
 
-        instances = WorkshiftInstance.objects.filter(
-            Q(weekly_workshift__pool=hours.pool) |
-            Q(info__pool=hours.pool),
-            Q(workshifter=profile) | Q(liable=profile),
-            closed=True,
+        # Record the correction in the ledger, so that it still sums to the
+        # new standing
+        corrections.append(StandingDelta(
+            pool_hours_id=hours.pk,
+            amount=hours.standing - current[hours.pk],
+            reason=StandingDelta.RESET,
+            timestamp=moment,
+        ))
+
+    with transaction.atomic():
+        StandingDelta.objects.bulk_create(
+            [delta for delta in corrections if delta.amount],
+        )
+        for (standing, last_updated), pks in standings.items():
+            PoolHours.objects.filter(pk__in=pks).update(
+                standing=standing,
+                last_updated=last_updated,
+            )
+
+    invalidate_navbar_state()
+
+
+def get_pool_hours_matrix(semester, pools, profiles=None):
+    """
+    Pairs every member with their pool hours in each of pools, fetching all of
+    the pool hours at once through the profiles' many-to-many table and
+    pivoting them in memory.
+
+    Parameters
+    ----------
+    semester : workshift.models.Semester
+    pools : list of workshift.models.WorkshiftPool
+    profiles : list of workshift.models.WorkshiftProfile, optional
+        If None, uses every profile in semester.
+
+    Returns
+    -------
+    list of tuple of workshift.models.WorkshiftProfile, list
+        Each profile, with its pool hours (or None if it has none) in the same
+        order as pools.
+    """
+    pools = list(pools)
+    if profiles is None:
+        profiles = WorkshiftProfile.objects.filter(
+            semester=semester,
+        ).select_related("user", "semester")
+    profiles = list(profiles)
+
+    pools_by_pk = dict((pool.pk, pool) for pool in pools)
+    pool_hours = defaultdict(dict)
+
+    for row in WorkshiftProfile.pool_hours.through.objects.filter(
+            workshiftprofile__semester=semester,
+            poolhours__pool__in=pools,
+    ).select_related("poolhours"):
+        hours = row.poolhours
+        hours.pool = pools_by_pk[hours.pool_id]
+        pool_hours[row.workshiftprofile_id][hours.pool_id] = hours
+
+    return [
+        (
+            profile,
+            [pool_hours[profile.pk].get(pool.pk) for pool in pools],
         )
-        for instance in instances:
-            if instance.blown:
-                hours.standing -= instance.hours
-            else:
-                hours.standing += instance.hours
+        for profile in profiles
+    ]
+
 
-        hours.save(update_fields=["standing", "last_updated"])
+# Each fine date in a pool, with the field that its fines are stored in
+FINE_DATES = (
+    ("first_fine_date", "first_date_standing"),
+    ("second_fine_date", "second_date_standing"),
+    ("third_fine_date", "third_date_standing"),
+)
 
-    update_standings(
+
+# The columns of each row of get_fines_report
+FINES_REPORT_COLUMNS = (
+    "username", "first_name", "last_name", "pool", "standing",
+) + tuple(standing_field for date_field, standing_field in FINE_DATES)
+
+
+def snapshot_fine_dates(semester=None, moment=None):
+    """
+    Fines every member who is behind on their hours in any pool whose fine
+    date is today, by storing their standing times the semester's rate with
+    one update for each pool.
+
+    Parameters
+    ----------
+    semester : workshift.models.Semester, optional
+    moment : datetime.datetime, optional
+
+    Returns
+    -------
+    list of tuple of workshift.models.WorkshiftPool, str, int
+        Each pool that was fined, the field its fines were stored in, and the
+        number of members fined.
+    """
+    if semester is None:
+        try:
+            semester = Semester.objects.get(current=True)
+        except (Semester.DoesNotExist, Semester.MultipleObjectsReturned):
+            return []
+
+    if semester.rate is None:
+        return []
+
+    if moment is None:
+        moment = localtime(now())
+
+    today = moment.date()
+    pools = WorkshiftPool.objects.filter(
+        Q(first_fine_date=today) |
+        Q(second_fine_date=today) |
+        Q(third_fine_date=today),
         semester=semester,
-        pool_hours=pool_hours,
     )
 
+    snapshots = []
+
+    with transaction.atomic():
+        for pool in pools:
+            for date_field, standing_field in FINE_DATES:
+                if getattr(pool, date_field) != today:
+                    continue
+                fined = PoolHours.objects.filter(
+                    pool=pool,
+                    standing__lt=0,
+                ).update(**{standing_field: F("standing") * semester.rate})
+                snapshots.append((pool, standing_field, fined))
+
+    return snapshots
+
+
+def get_fines_report(semester):
+    """
+    Lists every member's standing and fines in each pool of a semester, using
+    a single query.
+
+    Parameters
+    ----------
+    semester : workshift.models.Semester
+
+    Returns
+    -------
+    list of dict
+    """
+    fields = [
+        "workshiftprofile__user__username",
+        "workshiftprofile__user__first_name",
+        "workshiftprofile__user__last_name",
+        "poolhours__pool__title",
+        "poolhours__standing",
+    ] + [
+        "poolhours__" + standing_field
+        for date_field, standing_field in FINE_DATES
+    ]
+    rows = WorkshiftProfile.pool_hours.through.objects.filter(
+        workshiftprofile__semester=semester,
+    ).order_by(
+        "workshiftprofile__user__last_name",
+        "workshiftprofile__user__first_name",
+        "-poolhours__pool__is_primary",
+        "poolhours__pool__title",
+    ).values_list(*fields)
+
+    return [dict(zip(FINES_REPORT_COLUMNS, row)) for row in rows]
+
 
 def calculate_assigned_hours(semester=None, profiles=None):
     """
-    Utility function to recalculate the assigned workshift hours. This function
-    is meant to only be called from the manager shell, it is not referenced
-    anywhere else in the workshift module.
+    Recalculates members' assigned workshift hours from the active regular
+    workshifts they are assigned to, using one query to add up the hours and
+    one update for each distinct total that changed.
 
     Parameters
     ----------
     semester : workshift.models.Semester, optional
     profiles : list of workshift.models.WorkshiftProfile, optional
+
+    Returns
+    -------
+    int
+        The number of pool hours whose assigned hours changed.
     """
     if semester is None:
         try:
             semester = Semester.objects.get(current=True)
         except (Semester.DoesNotExist, Semester.MultipleObjectsReturned):
-            return
+            return 0
     if profiles is None:
         profiles = WorkshiftProfile.objects.filter(semester=semester)
 
-    for profile in profiles:
-        for pool_hours in profile.pool_hours.all():
-            shifts = RegularWorkshift.objects.filter(
-                current_assignees=profile,
-                pool=pool_hours.pool,
-                active=True,
-            )
-            pool_hours.assigned_hours = sum(shift.hours for shift in shifts)
-            pool_hours.save(update_fields=["assigned_hours"])
+    totals = dict(
+        ((row["workshiftprofile"], row["regularworkshift__pool"]),
+         row["total_hours"])
+        for row in RegularWorkshift.current_assignees.through.objects.filter(
+            workshiftprofile__in=profiles,
+            regularworkshift__active=True,
+        ).values(
+            "workshiftprofile", "regularworkshift__pool",
+        ).annotate(total_hours=Sum("regularworkshift__hours")).order_by()
+    )
+
+    changed = defaultdict(list)
+    for pk, profile_pk, pool_pk, assigned in PoolHours.objects.filter(
+            workshiftprofile__in=profiles,
+    ).values_list("pk", "workshiftprofile", "pool", "assigned_hours"):
+        total = totals.get((profile_pk, pool_pk)) or 0
+        if total != assigned:
+            changed[total].append(pk)
+
+    with transaction.atomic():
+        for total, pks in changed.items():
+            PoolHours.objects.filter(pk__in=pks).update(assigned_hours=total)
+
+    return sum(len(pks) for pks in changed.values())
 
 
 def reset_instance_assignments(semester=None, shifts=None):
     """
-    Utility function to reset instance assignments. This function is meant to
-    only be called from the manager shell, it is not referenced anywhere else
-    in the workshift module.
+    Reassigns the open instances of regular workshifts to the shifts' current
+    assignees, taking turns between them (and any open slots) from the
+    earliest instance on, without giving anyone two instances of a shift on
+    the same day.
 
     Parameters
     ----------
     semester : workshift.models.Semester, optional
     shifts : list of workshift.models.RegularWorkshift, optional
+
+    Returns
+    -------
+    int
+        The number of instances that were reset.
     """
     if semester is None:
         try:
             semester = Semester.objects.get(current=True)
         except (Semester.DoesNotExist, Semester.MultipleObjectsReturned):
-            return
+            return 0
     if shifts is None:
         shifts = RegularWorkshift.objects.filter(
             pool__semester=semester,
         )
 
-    for shift in shifts:
-        instances = WorkshiftInstance.objects.filter(
+    shifts = list(shifts)
+
+    assignees = defaultdict(list)
+    for shift_pk, profile_pk in RegularWorkshift.current_assignees.through \
+            .objects.filter(regularworkshift__in=shifts) \
+            .order_by("pk") \
+            .values_list("regularworkshift", "workshiftprofile"):
+        assignees[shift_pk].append(profile_pk)
+
+    instances = defaultdict(list)
+    for instance in WorkshiftInstance.objects.filter(
             closed=False,
-            weekly_workshift=shift,
-        ).order_by("date")
+            weekly_workshift__in=shifts,
+    ).order_by("date", "pk"):
+        instances[instance.weekly_workshift_id].append(instance)
 
-        assignees = list(shift.current_assignees.all())
-        assignees += [None] * (shift.count - len(assignees))
+    to_assign = defaultdict(list)
+    log_pairs = []
+    for shift in shifts:
+        shift_assignees = assignees[shift.pk]
+        shift_assignees = shift_assignees + \
+            [None] * (shift.count - len(shift_assignees))
         dates = defaultdict(set)
 
-        for assignee, instance in zip(cycle(assignees), instances):
+        for assignee, instance in zip(
+                cycle(shift_assignees), instances[shift.pk],
+        ):
             if assignee is not None:
-                if instance.date in dates[assignee.pk]:
+                if instance.date in dates[assignee]:
                     continue
 
-                dates[assignee.pk].add(instance.date)
+                dates[assignee].add(instance.date)
 
-            instance.workshifter = assignee
-            instance.liable = None
-            instance.save(update_fields=["workshifter", "liable"])
+            to_assign[assignee].append(instance.pk)
+            log_pairs.append((instance, ShiftLogEntry(
+                person_id=assignee,
+                entry_type=ShiftLogEntry.ASSIGNED,
+                note="Manager reset assignment.",
+            )))
 
-            instance.logs.add(
-                ShiftLogEntry.objects.create(
-                    person=instance.workshifter,
-                    entry_type=ShiftLogEntry.ASSIGNED,
-                    note="Manager reset assignment.",
-                )
+    with transaction.atomic():
+        for profile_pk, instance_pks in to_assign.items():
+            WorkshiftInstance.objects.filter(pk__in=instance_pks).update(
+                workshifter=profile_pk, liable=None,
             )
+        bulk_create_logs(log_pairs)
+
+    invalidate_navbar_state()
+    invalidate_instances(instance for instance, entry in log_pairs)
+
+    return len(log_pairs)
@@ -6,20 +6,28 @@ Authors: Karandeep Singh Nagra and Nader Morshed
 
 from __future__ import division, absolute_import
 
+import csv
 from datetime import date, timedelta
+from decimal import Decimal
+import hashlib
+import json
 
 from django.db.models import Q
 from django.conf import settings
 from django.contrib import messages
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.http import HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, \
+    HttpResponseNotModified, Http404
 from django.shortcuts import render_to_response, get_object_or_404
 from django.template import RequestContext
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
 from django.utils.timezone import now, localtime
 
 import inflect
 p = inflect.engine()
 
+from utils.navbar import get_navbar_state
 from utils.variables import MESSAGES, ANONYMOUS_USERNAME, date_formats
 from base.models import User
 from managers.models import Manager
@@ -27,7 +35,7 @@ from workshift.decorators import get_workshift_profile, \
     workshift_manager_required, semester_required
 from workshift.models import *
 from workshift.forms import *
-from workshift import utils
+from workshift import schedule, utils
 from workshift.templatetags.workshift_tags import wurl
 
 
@@ -59,25 +67,88 @@ def add_archive_context(request):
     return nodes, []
 
 
+def _get_navbar_state(user, semester=None, permissions=None):
+    current_semesters = list(
+        Semester.objects.filter(current=True).order_by("-start_date")
+    )
+
+    if not current_semesters and not Semester.objects.exists():
+        return None
+
+    current_semester = current_semesters[0] if current_semesters else None
+
+    # Semester is for populating the current page
+    if semester is None:
+        semester = current_semester
+
+    try:
+        workshift_profile = WorkshiftProfile.objects.get(
+            semester=semester,
+            user=user,
+        )
+    except WorkshiftProfile.DoesNotExist:
+        workshift_profile = None
+
+    standing = None
+    if workshift_profile:
+        try:
+            standing = workshift_profile.pool_hours.get(
+                pool__is_primary=True,
+            ).standing
+        except (PoolHours.DoesNotExist, PoolHours.MultipleObjectsReturned):
+            pass
+
+    today = localtime(now()).date()
+    upcoming_shifts = list(WorkshiftInstance.objects.filter(
+        workshifter=workshift_profile,
+        closed=False,
+        date__gte=today,
+        date__lte=today + timedelta(days=2),
+    ).select_related(
+        "weekly_workshift__workshift_type", "weekly_workshift__pool",
+        "info__pool",
+    ))
+
+    return {
+        "MULTIPLE_CURRENT_SEMESTERS": len(current_semesters) > 1,
+        "SEMESTER": semester,
+        "CURRENT_SEMESTER": current_semester,
+        "WORKSHIFT_MANAGER": (permissions or utils.Permissions(user))
+        .can_manage(semester=semester),
+        "WORKSHIFT_PROFILE": workshift_profile,
+        "STANDING": standing,
+        "UPCOMING_SHIFTS": upcoming_shifts,
+    }
+
+
 def add_workshift_context(request):
     """ Add workshift variables to all dictionaries passed to templates. """
     if not request.user.is_authenticated():
         return {}
 
-    if Semester.objects.count() < 1:
+    semester = getattr(request, "semester", None)
+    today = localtime(now()).date()
+
+    state = get_navbar_state(
+        request, "workshift",
+        [
+            request.user.pk, request.user.date_joined,
+            semester.pk if semester else None, today,
+        ],
+        lambda: _get_navbar_state(
+            request.user, semester=semester,
+            permissions=utils.get_permissions(request),
+        ),
+    )
+
+    if state is None:
         return {
             "WORKSHIFT_ENABLED": False,
         }
 
-    # Current semester is for navbar notifications
-    try:
-        current_semester = Semester.objects.get(current=True)
-    except Semester.DoesNotExist:
-        current_semester = None
-    except Semester.MultipleObjectsReturned:
-        current_semester = Semester.objects.filter(
-            current=True,
-        ).latest("start_date")
+    current_semester = state["CURRENT_SEMESTER"]
+
+    if state["MULTIPLE_CURRENT_SEMESTERS"]:
         workshift_emails = []
         for pos in Manager.objects.filter(workshift_manager=True, active=True):
             if pos.email:
@@ -102,14 +173,9 @@ def add_workshift_context(request):
             ),
         )
 
-    today = localtime(now()).date()
-
     days_passed = None
     total_days = None
     semester_percentage = None
-    standing = None
-    happening_now = None
-    workshift_profile = None
 
     if current_semester:
         # number of days passed in this semester
@@ -121,28 +187,7 @@ def add_workshift_context(request):
         ).days
         semester_percentage = round((days_passed / total_days) * 100, 2)
 
-    # Semester is for populating the current page
-    try:
-        semester = request.semester
-    except AttributeError:
-        semester = current_semester
-
-    try:
-        workshift_profile = WorkshiftProfile.objects.get(
-            semester=semester,
-            user=request.user,
-            )
-    except WorkshiftProfile.DoesNotExist:
-        workshift_profile = None
-
-    workshift_manager = utils.can_manage(request.user, semester=semester)
-
-    upcoming_shifts = WorkshiftInstance.objects.filter(
-        workshifter=workshift_profile,
-        closed=False,
-        date__gte=today,
-        date__lte=today + timedelta(days=2),
-    )
+    upcoming_shifts = state["UPCOMING_SHIFTS"]
 
     # TODO: Add a fudge factor of an hour to this?
     time = localtime(now()).time()
@@ -170,21 +215,13 @@ def add_workshift_context(request):
         if time > shift.start_time and time < shift.end_time:
             happening_now.append(shift)
 
-    if workshift_profile:
-        try:
-            standing = workshift_profile.pool_hours.get(
-                pool__is_primary=True,
-            ).standing
-        except (PoolHours.DoesNotExist, PoolHours.MultipleObjectsReturned):
-            pass
-
     return {
         "WORKSHIFT_ENABLED": True,
-        "SEMESTER": semester,
+        "SEMESTER": state["SEMESTER"],
         "CURRENT_SEMESTER": current_semester,
-        "WORKSHIFT_MANAGER": workshift_manager,
-        "WORKSHIFT_PROFILE": workshift_profile,
-        "STANDING": standing,
+        "WORKSHIFT_MANAGER": state["WORKSHIFT_MANAGER"],
+        "WORKSHIFT_PROFILE": state["WORKSHIFT_PROFILE"],
+        "STANDING": state["STANDING"],
         "DAYS_PASSED": days_passed,
         "TOTAL_DAYS": total_days,
         "SEMESTER_PERCENTAGE": semester_percentage,
@@ -235,10 +272,15 @@ def start_semester_view(request):
             pool_forms.append(form)
 
     if semester_form.is_valid() and all(i.is_valid() for i in pool_forms):
-        # And save this semester
-        semester = semester_form.save()
-        for pool_form in pool_forms:
-            pool_form.save(semester=semester)
+        # And save this semester, along with everything it starts with
+        semester = semester_form.save(commit=False)
+        pools = [
+            pool_form.save(semester=semester, commit=False)
+            for pool_form in pool_forms
+        ]
+        utils.bootstrap_semester(
+            semester, pools=[pool for pool in pools if pool is not None],
+        )
         return HttpResponseRedirect(wurl("workshift:manage",
                                          sem_url=semester.sem_url))
 
@@ -324,23 +366,25 @@ def semester_view(request, semester, profile=None):
             semester = switch_form.save()
             return HttpResponseRedirect(semester.get_view_url())
 
-    # Grab the shifts for just today, as well as week-long shifts
-    day_shifts = WorkshiftInstance.objects.filter(
-        date__gte=start_date,
-        date__lte=end_date,
-    ).exclude(
-        Q(weekly_workshift__week_long=True) |
-        Q(info__week_long=True),
-    )
-
-    last_monday = start_date - timedelta(days=start_date.weekday())
-    next_sunday = end_date - timedelta(days=end_date.weekday() + 1) + timedelta(weeks=1)
+    # Everything the forms and tables need for each instance
+    instances = WorkshiftInstance.objects.select_related(
+        "semester",
+        "weekly_workshift__workshift_type",
+        "weekly_workshift__pool",
+        "info__pool",
+        "workshifter__user",
+        "workshifter__semester",
+        "liable__user",
+        "liable__semester",
+        "verifier__user",
+        "verifier__semester",
+    ).prefetch_related("logs")
 
-    week_shifts = WorkshiftInstance.objects.filter(
-        Q(weekly_workshift__week_long=True) |
-        Q(info__week_long=True),
-        date__gte=last_monday, date__lte=next_sunday,
+    # Grab the shifts for just today, as well as week-long shifts
+    day_shifts, week_shifts = schedule.get_schedule_instances(
+        start_date, end_date, instances=instances,
     )
+    last_monday, next_sunday = schedule.get_week_range(start_date, end_date)
 
     template_dict["last_monday"] = last_monday.strftime("%Y-%m-%d")
     template_dict["next_sunday"] = next_sunday.strftime("%Y-%m-%d")
@@ -358,17 +402,24 @@ def semester_view(request, semester, profile=None):
 
         template_dict["anonymous_form"] = anonymous_form
 
+    # Work out who can do what once, rather than for every shift
+    user_permissions = utils.get_permissions(request)
+    permissions = utils.get_permissions(request, profile.user) \
+        if profile else None
+
     template_dict["day_shifts"] = [
         (shift, _get_forms(
             profile, shift, request,
-            undo=utils.can_manage(request.user, semester=semester, pool=shift.pool),
+            undo=user_permissions.can_manage(semester, pool=shift.pool),
+            permissions=permissions,
         ))
         for shift in day_shifts
     ]
     template_dict["week_shifts"] = [
         (shift, _get_forms(
             profile, shift, request,
-            undo=utils.can_manage(request.user, semester=semester, pool=shift.pool),
+            undo=user_permissions.can_manage(semester, pool=shift.pool),
+            permissions=permissions,
         ))
         for shift in week_shifts
     ]
@@ -400,16 +451,149 @@ def semester_view(request, semester, profile=None):
     )
 
 
+def _get_schedule_instances(semester):
+    return WorkshiftInstance.objects.filter(
+        semester=semester,
+    ).select_related(
+        "weekly_workshift__workshift_type",
+        "info",
+        "workshifter__user",
+        "liable__user",
+        "verifier__user",
+    ).order_by("date", "pk")
+
+
+def _json_response(content, status=200):
+    return HttpResponse(
+        json.dumps(content, sort_keys=True, separators=(",", ":")),
+        content_type="application/json",
+        status=status,
+    )
+
+
+@get_workshift_profile
+def schedule_view(request, semester, profile=None):
+    """
+    The shifts shown on the semester page for a range of days, as JSON, so that
+    the page can switch between days without being reloaded. Takes the same
+    day or start_date and end_date parameters as the semester page.
+
+    Each set of shifts is sent as columns (see schedule.SCHEDULE_COLUMNS), along
+    with the names of everyone they refer to.
+    """
+    day = _get_date(request, "day", localtime(now()).date())
+    start_date = _get_date(request, "start_date", day)
+    end_date = _get_date(request, "end_date", day)
+
+    if not timedelta(0) <= end_date - start_date <= timedelta(weeks=5):
+        return _json_response({"errors": ["Invalid date range."]}, status=400)
+
+    content = json.dumps(
+        schedule.get_schedule(semester, start_date, end_date),
+        sort_keys=True, separators=(",", ":"),
+    )
+
+    etag = hashlib.md5(content).hexdigest()
+    if etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type="application/json")
+
+    response["ETag"] = quote_etag(etag)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+# The forms that can be submitted through schedule_action_view
+SCHEDULE_ACTION_FORMS = dict(
+    (form.action_name, form)
+    for form in [
+        VerifyShiftForm, BlownShiftForm, UndoShiftForm, SignInForm,
+        SignOutForm,
+    ]
+)
+
+
+@get_workshift_profile
+def schedule_action_view(request, semester, pk, action, profile=None):
+    """
+    Signs in to, signs out of, verifies, blows or undoes an instance from the
+    semester page's schedule, returning its updated row. POST only.
+    """
+    if request.method != "POST":
+        response = _json_response(
+            {"errors": ["Only POST is allowed."]}, status=405,
+        )
+        response["Allow"] = "POST"
+        return response
+
+    if action not in SCHEDULE_ACTION_FORMS:
+        raise Http404
+
+    instance = get_object_or_404(
+        _get_schedule_instances(semester).select_related(
+            "weekly_workshift__pool", "info__pool",
+        ),
+        pk=pk,
+    )
+
+    undo = utils.get_permissions(request).can_manage(
+        semester, pool=instance.pool,
+    )
+    permissions = utils.get_permissions(request, profile.user) \
+        if profile else None
+
+    # Only allow what the semester page would offer
+    if action not in [
+            form.action_name
+            for form in _get_forms(
+                profile, instance, request,
+                undo=undo, permissions=permissions,
+            )
+    ]:
+        return _json_response(
+            {"errors": ["You cannot do that for this workshift."]},
+            status=403,
+        )
+
+    form = SCHEDULE_ACTION_FORMS[action](
+        data={"pk": instance.pk},
+        profile=profile,
+        undo=undo,
+        permissions=permissions,
+    )
+    if not form.is_valid():
+        return _json_response(
+            {
+                "errors": [
+                    error
+                    for errors in form.errors.values()
+                    for error in errors
+                ],
+            },
+            status=400,
+        )
+
+    form.save(note=request.POST.get("note") or None)
+
+    profiles = {}
+    instance = _get_schedule_instances(semester).get(pk=instance.pk)
+    return _json_response({
+        "row": schedule.get_schedule_rows([instance], profiles),
+        "profiles": profiles,
+    })
+
+
 @get_workshift_profile
 def semester_info_view(request, semester, profile=None):
     page_name = "{} {}".format(semester.get_season_display(), semester.year)
     pools = WorkshiftPool.objects.filter(semester=semester)
-    full_management = utils.can_manage(request.user, semester)
+    full_management = utils.get_permissions(request).can_manage(semester)
     pool_edits = [
         (
             pool,
             full_management or
-            utils.can_manage(request.user, semester, pool=pool),
+            utils.get_permissions(request).can_manage(semester, pool=pool),
         )
         for pool in pools
     ]
@@ -421,10 +605,14 @@ def semester_info_view(request, semester, profile=None):
     }, context_instance=RequestContext(request))
 
 
-def _get_forms(profile, instance, request, undo=False, prefix=""):
+def _get_forms(profile, instance, request, undo=False, prefix="",
+               permissions=None):
     """
     Gets the forms for profile interacting with an instance of a shift. This
     includes verify shift, mark shift as blown, sign in, and sign out.
+
+    permissions is the utils.Permissions for profile's user, from
+    utils.get_permissions.
     """
     anonymous = profile is None and request.user.username == ANONYMOUS_USERNAME
 
@@ -436,11 +624,15 @@ def _get_forms(profile, instance, request, undo=False, prefix=""):
     else:
         prefix = "{}".format(instance.pk)
 
+    if permissions is None and profile:
+        permissions = utils.get_permissions(request, profile.user)
+
     kwargs = dict(
         initial={"pk": instance.pk},
         profile=profile,
         prefix=prefix,
         undo=undo,
+        permissions=permissions,
     )
 
     ret = []
@@ -449,9 +641,11 @@ def _get_forms(profile, instance, request, undo=False, prefix=""):
         pool = instance.pool
 
         if not profile:
-            managers = []
+            managers, managed_pools, workshift_manager = set(), set(), False
         else:
-            managers = Manager.objects.filter(incumbent__user=profile.user)
+            managers = permissions.managers
+            managed_pools = permissions.pools
+            workshift_manager = permissions.workshift_manager
 
         verify, blow = False, False
 
@@ -465,10 +659,10 @@ def _get_forms(profile, instance, request, undo=False, prefix=""):
         elif instance.verify == ANY_MANAGER_VERIFY and managers:
             verify = True
         elif instance.verify == POOL_MANAGER_VERIFY and \
-          set(managers).intersections(pool.managers):
+          pool.pk in managed_pools:
             verify = True
         elif instance.verify == WORKSHIFT_MANAGER_VERIFY and \
-          any(i.workshift_manager for i in managers):
+          workshift_manager:
             verify = True
 
         if verify and not instance.verifier:
@@ -484,10 +678,8 @@ def _get_forms(profile, instance, request, undo=False, prefix=""):
         if pool.any_blown:
             blow = True
 
-        if profile:
-            pool_managers = pool.managers.filter(incumbent__user=profile.user)
-            if pool_managers.count():
-                blow = True
+        if pool.pk in managed_pools:
+            blow = True
 
         if blow and not instance.blown:
             # Blown Shift
@@ -568,10 +760,12 @@ def open_shifts_view(request, semester, profile=None):
         instances = paginator.page(1)
     except EmptyPage:
         instances = paginator.page(paginator.num_pages)
+    permissions = utils.get_permissions(request, profile.user) \
+        if profile else None
     instance_tuples = [
         (
             instance,
-            _get_forms(profile, instance, request),
+            _get_forms(profile, instance, request, permissions=permissions),
             _is_preferred(instance, profile),
         )
         for instance in instances
@@ -676,16 +870,18 @@ def profile_view(request, semester, targetUsername, profile=None):
     ).exclude(
         weekly_workshift__current_assignees=wprofile,
     )
-    pool_hours = wprofile.pool_hours.order_by(
+    pool_hours = list(wprofile.pool_hours.select_related(
+        "pool__semester",
+    ).order_by(
         "-pool__is_primary", "pool__title",
-    )
-    first_standing, second_standing, third_standing = \
-      any(pool_hours.first_date_standing for pool_hours in wprofile.pool_hours.all()), \
-      any(pool_hours.second_date_standing for pool_hours in wprofile.pool_hours.all()), \
-      any(pool_hours.third_date_standing for pool_hours in wprofile.pool_hours.all())
+    ))
+    first_standing, second_standing, third_standing = [
+        any(getattr(hours, standing_field) for hours in pool_hours)
+        for date_field, standing_field in utils.FINE_DATES
+    ]
 
-    full_management = utils.can_manage(request.user, semester=semester)
-    any_management = utils.can_manage(request.user, semester, any_pool=True)
+    full_management = utils.get_permissions(request).can_manage(semester=semester)
+    any_management = utils.get_permissions(request).can_manage(semester, any_pool=True)
     view_note = wprofile == profile or full_management
 
     return render_to_response("profile.html", {
@@ -713,7 +909,7 @@ def preferences_view(request, semester, targetUsername, profile=None):
         WorkshiftProfile,
         user__username=targetUsername,
     )
-    full_management = utils.can_manage(request.user, semester=semester)
+    full_management = utils.get_permissions(request).can_manage(semester=semester)
 
     if wprofile.user != request.user and \
        not full_management:
@@ -787,20 +983,12 @@ def preferences_view(request, semester, targetUsername, profile=None):
 @get_workshift_profile
 def profiles_view(request, semester, profile=None):
     page_name = "Workshift Profiles"
-    wprofiles = WorkshiftProfile.objects.filter(semester=semester)
     pools = WorkshiftPool.objects.filter(semester=semester).order_by(
         "-is_primary", "title",
     )
-    pool_hours = [
-        [
-            wprofile.pool_hours.get(pool=pool)
-            for pool in pools
-        ]
-        for wprofile in wprofiles
-    ]
     return render_to_response("profiles.html", {
         "page_name": page_name,
-        "workshifter_tuples": zip(wprofiles, pool_hours),
+        "workshifter_tuples": utils.get_pool_hours_matrix(semester, pools),
         "pools": pools,
     }, context_instance=RequestContext(request))
 
@@ -813,7 +1001,7 @@ def manage_view(request, semester, profile=None):
     """
     page_name = "Manage Workshift"
     pools = WorkshiftPool.objects.filter(semester=semester)
-    full_management = utils.can_manage(request.user, semester=semester)
+    full_management = utils.get_permissions(request).can_manage(semester=semester)
     edit_semester_form = None
     close_semester_form = None
     open_semester_form = None
@@ -869,14 +1057,6 @@ def manage_view(request, semester, profile=None):
         ))
 
     pools = pools.order_by("-is_primary", "title")
-    workshifters = WorkshiftProfile.objects.filter(semester=semester)
-    pool_hours = [
-        [
-            workshifter.pool_hours.get(pool=pool)
-            for pool in pools
-        ]
-        for workshifter in workshifters
-    ]
 
     return render_to_response("manage.html", {
         "page_name": page_name,
@@ -885,7 +1065,7 @@ def manage_view(request, semester, profile=None):
         "edit_semester_form": edit_semester_form,
         "close_semester_form": close_semester_form,
         "open_semester_form": open_semester_form,
-        "workshifters": zip(workshifters, pool_hours),
+        "workshifters": utils.get_pool_hours_matrix(semester, pools),
     }, context_instance=RequestContext(request))
 
 
@@ -967,6 +1147,10 @@ def assign_shifts_view(request, semester):
         workshift_type__assignment=WorkshiftType.NO_ASSIGN,
     )
 
+    profile_availability = utils.load_availability(
+        WorkshiftProfile.objects.filter(semester=semester),
+    )
+
     assign_forms = []
     for shift in shifts:
         form = AssignShiftForm(
@@ -974,6 +1158,7 @@ def assign_shifts_view(request, semester):
             prefix="shift-{}".format(shift.pk),
             instance=shift,
             semester=semester,
+            availability=profile_availability,
         )
         assign_forms.append(form)
 
@@ -990,31 +1175,30 @@ def assign_shifts_view(request, semester):
             sem_url=semester.sem_url,
         ))
 
-    workshifters = WorkshiftProfile.objects.filter(semester=semester)
     pools = WorkshiftPool.objects.filter(semester=semester).order_by(
         "-is_primary", "title",
     )
 
-    pool_hours = []
-    for workshifter in workshifters:
-        hours_owed = []
-        for pool in pools:
-            hours = workshifter.pool_hours.get(pool=pool)
-            hours_owed.append(hours.hours - hours.assigned_hours)
+    unassigned_profiles = []
+    for workshifter, pool_hours in utils.get_pool_hours_matrix(semester, pools):
+        hours_owed = [
+            hours.hours - hours.assigned_hours
+            for hours in pool_hours
+        ]
 
         if any(i > 0 for i in hours_owed):
-            pool_hours.append(hours_owed)
+            unassigned_profiles.append((workshifter, hours_owed))
 
     total_pool_hours = [
-        sum(hours[i] for hours in pool_hours)
-        for i in range(len(pool_hours[0]) if len(pool_hours) > 0 else 0)
+        sum(hours_owed[i] for workshifter, hours_owed in unassigned_profiles)
+        for i in range(len(pools) if unassigned_profiles else 0)
     ]
 
     return render_to_response("assign_shifts.html", {
         "page_name": page_name,
         "forms": forms,
         "assign_forms": assign_forms,
-        "unassigned_profiles": zip(workshifters, pool_hours),
+        "unassigned_profiles": unassigned_profiles,
         "pools": pools,
         "total_pool_hours": total_pool_hours,
     }, context_instance=RequestContext(request))
@@ -1031,13 +1215,13 @@ def adjust_hours_view(request, semester):
     pools = WorkshiftPool.objects.filter(semester=semester).order_by(
         "-is_primary", "title",
     )
-    workshifters = WorkshiftProfile.objects.filter(semester=semester)
+    workshifters = []
     pool_hour_forms = []
 
-    for workshifter in workshifters:
+    for workshifter, pool_hours in utils.get_pool_hours_matrix(semester, pools):
+        workshifters.append(workshifter)
         forms_list = []
-        for pool in pools:
-            hours = workshifter.pool_hours.get(pool=pool)
+        for hours in pool_hours:
             forms_list.append((
                 AdjustHoursForm(
                     data=request.POST or None,
@@ -1053,9 +1237,11 @@ def adjust_hours_view(request, semester):
             for workshifter_forms in pool_hour_forms
             for form, pool_hours in workshifter_forms
     ):
-        for workshifter_forms in pool_hour_forms:
-            for form, pool_hours in workshifter_forms:
-                form.save()
+        # Recalculate the standings of everyone whose hours changed at once
+        with utils.deferred_recompute():
+            for workshifter_forms in pool_hour_forms:
+                for form, pool_hours in workshifter_forms:
+                    form.save()
         messages.add_message(request, messages.INFO, "Updated hours.")
         return HttpResponseRedirect(wurl(
             "workshift:adjust_hours",
@@ -1163,7 +1349,7 @@ def fill_shifts_view(request, semester):
     reset_all_shifts_form = None
 
     managers = Manager.objects.filter(incumbent__user=request.user)
-    admin = utils.can_manage(request.user, semester=semester)
+    admin = utils.get_permissions(request).can_manage(semester=semester)
 
     if admin:
         fill_regular_shifts_form = FillRegularShiftsForm(
@@ -1235,7 +1421,7 @@ def add_shift_view(request, semester):
     View for the workshift manager to create new types of workshifts.
     """
     page_name = "Add Workshift"
-    any_management = utils.can_manage(request.user, semester, any_pool=True)
+    any_management = utils.get_permissions(request).can_manage(semester, any_pool=True)
 
     if not any_management:
         messages.add_message(
@@ -1247,7 +1433,7 @@ def add_shift_view(request, semester):
 
     # Check what pools this person can manage
     pools = WorkshiftPool.objects.filter(semester=semester)
-    full_management = utils.can_manage(request.user, semester=semester)
+    full_management = utils.get_permissions(request).can_manage(semester=semester)
 
     if not full_management:
         pools = pools.filter(managers__incumbent__user=request.user)
@@ -1316,28 +1502,56 @@ def fine_date_view(request, semester):
     pools = WorkshiftPool.objects.filter(semester=semester).order_by(
         "-is_primary", "title",
     )
-    workshifters = WorkshiftProfile.objects.filter(semester=semester)
-    pool_hours = [
-        [
-            workshifter.pool_hours.get(pool=pool)
-            for pool in pools
-        ]
-        for workshifter in workshifters
-    ]
 
     return render_to_response("fine_date.html", {
         "page_name": page_name,
         "fine_form": fine_form,
         "pools": pools,
-        "workshifters": zip(workshifters, pool_hours),
+        "workshifters": utils.get_pool_hours_matrix(semester, pools),
     }, context_instance=RequestContext(request))
 
 
+@semester_required
+@workshift_manager_required
+def fines_report_view(request, semester):
+    """
+    Downloads every member's standing and fines for the semester, as CSV or,
+    with ?format=json, as JSON.
+    """
+    rows = utils.get_fines_report(semester)
+
+    if request.GET.get("format") == "json":
+        content = json.dumps(
+            [
+                dict(
+                    (name, str(value) if isinstance(value, Decimal) else value)
+                    for name, value in row.items()
+                )
+                for row in rows
+            ],
+            separators=(",", ":"),
+        )
+        return HttpResponse(content, content_type="application/json")
+
+    response = HttpResponse(content_type="text/csv")
+    response["Content-Disposition"] = \
+        "attachment; filename=\"fines-{0}.csv\"".format(semester.sem_url)
+    writer = csv.writer(response)
+    writer.writerow(utils.FINES_REPORT_COLUMNS)
+    for row in rows:
+        writer.writerow([
+            u"{0}".format("" if row[name] is None else row[name])
+            .encode("utf-8")
+            for name in utils.FINES_REPORT_COLUMNS
+        ])
+    return response
+
+
 @get_workshift_profile
 def pool_view(request, semester, pk, profile=None):
     pool = get_object_or_404(WorkshiftPool, semester=semester, pk=pk)
     page_name = "{} Pool".format(pool.title)
-    can_edit = utils.can_manage(request.user, semester, pool=pool)
+    can_edit = utils.get_permissions(request).can_manage(semester, pool=pool)
 
     today = localtime(now()).date()
     shifts = RegularWorkshift.objects.filter(
@@ -1351,14 +1565,16 @@ def pool_view(request, semester, pk, profile=None):
         workshifter=None,
         liable=None,
     )
+    permissions = utils.get_permissions(request, profile.user) \
+        if profile else None
     upcoming_pool_instances = [
         (instance, _get_forms(
             profile, instance, request,
-            undo=utils.can_manage(
-                request.user,
+            undo=utils.get_permissions(request).can_manage(
                 semester=semester,
                 pool=instance.pool,
             ),
+            permissions=permissions,
         ))
         for instance in instances
     ]
@@ -1391,7 +1607,7 @@ def pool_view(request, semester, pk, profile=None):
 def edit_pool_view(request, semester, pk, profile=None):
     pool = get_object_or_404(WorkshiftPool, semester=semester, pk=pk)
     page_name = "Edit " + pool.title
-    full_management = utils.can_manage(request.user, semester=semester)
+    full_management = utils.get_permissions(request).can_manage(semester=semester)
     managers = pool.managers.filter(incumbent__user=request.user)
 
     if not full_management and managers.count() == 0:
@@ -1419,7 +1635,8 @@ def edit_pool_view(request, semester, pk, profile=None):
         full_management=full_management,
     )
     if edit_pool_form.is_valid():
-        edit_pool_form.save()
+        with utils.deferred_recompute():
+            edit_pool_form.save()
         messages.add_message(
             request,
             messages.INFO,
@@ -1451,8 +1668,7 @@ def shift_view(request, semester, pk, profile=None):
         ).count() > 0
         can_edit = request.user.is_superuser or president
     else:
-        can_edit = utils.can_manage(
-            request.user,
+        can_edit = utils.get_permissions(request).can_manage(
             semester=semester,
             pool=shift.pool,
         )
@@ -1504,7 +1720,7 @@ def edit_shift_view(request, semester, pk, profile=None):
         else:
             return HttpResponseRedirect(manager.get_edit_url())
 
-    if not utils.can_manage(request.user, semester=semester, pool=shift.pool):
+    if not utils.get_permissions(request).can_manage(semester=semester, pool=shift.pool):
         messages.add_message(
             request,
             messages.ERROR,
@@ -1545,8 +1761,7 @@ def instance_view(request, semester, pk, profile=None):
     """
     instance = get_object_or_404(WorkshiftInstance, pk=pk)
     page_name = instance.title
-    management = utils.can_manage(
-        request.user,
+    management = utils.get_permissions(request).can_manage(
         semester=semester,
         pool=instance.pool,
     )
@@ -1580,8 +1795,8 @@ def instance_view(request, semester, pk, profile=None):
         ).count() > 0
         can_edit = request.user.is_superuser or president
     else:
-        can_edit = utils.can_manage(
-            request.user, semester=instance.pool.semester, pool=instance.pool,
+        can_edit = utils.get_permissions(request).can_manage(
+            semester=instance.pool.semester, pool=instance.pool,
         )
 
     if can_edit:
@@ -1624,8 +1839,8 @@ def edit_instance_view(request, semester, pk, profile=None):
         can_edit = request.user.is_superuser or president
         message = MESSAGES["PRESIDENTS_ONLY"]
     else:
-        can_edit = utils.can_manage(
-            request.user, semester=semester, pool=instance.pool,
+        can_edit = utils.get_permissions(request).can_manage(
+            semester=semester, pool=instance.pool,
         )
         message = MESSAGES["ADMINS_ONLY"]
 
@@ -1665,8 +1880,8 @@ def list_types_view(request, semester, profile=None):
     View the details of a particular WorkshiftType.
     """
     page_name = "Workshift Types"
-    full_management = utils.can_manage(request.user, semester)
-    any_management = utils.can_manage(request.user, semester, any_pool=True)
+    full_management = utils.get_permissions(request).can_manage(semester)
+    any_management = utils.get_permissions(request).can_manage(semester, any_pool=True)
 
     types = WorkshiftType.objects.all()
     type_shifts = [
@@ -1681,7 +1896,7 @@ def list_types_view(request, semester, profile=None):
             (
                 shift,
                 full_management or
-                utils.can_manage(request.user, semester, pool=shift.pool),
+                utils.get_permissions(request).can_manage(semester, pool=shift.pool),
             )
             for shift in shifts
         ]
@@ -1700,7 +1915,7 @@ def type_view(request, semester, pk, profile=None):
     """
     View the details of a particular WorkshiftType.
     """
-    any_management = utils.can_manage(request.user, semester, any_pool=True)
+    any_management = utils.get_permissions(request).can_manage(semester, any_pool=True)
     wtype = get_object_or_404(WorkshiftType, pk=pk)
     page_name = wtype.title
     regular_shifts = RegularWorkshift.objects.filter(
@@ -1721,8 +1936,8 @@ def edit_type_view(request, semester, pk, profile=None):
     View for a manager to edit the details of a particular WorkshiftType.
     """
     wtype = get_object_or_404(WorkshiftType, pk=pk)
-    full_management = utils.can_manage(request.user, semester)
-    any_management = utils.can_manage(request.user, semester, any_pool=True)
+    full_management = utils.get_permissions(request).can_manage(semester)
+    any_management = utils.get_permissions(request).can_manage(semester, any_pool=True)
 
     if not any_management:
         messages.add_message(